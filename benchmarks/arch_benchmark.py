@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+'''
+    x86_64 vs arm64 (Graviton) throughput benchmark for the NumPy/Scikit-learn work done by the pipeline Lambdas.
+
+    Worker mode times LinearRegression fit/predict and a float64 matmul on synthetic data in the current interpreter.
+    Driver mode runs the worker inside a pipeline Lambda image once per architecture, natively or under QEMU
+    emulation (docker run --platform), and compares throughput and Lambda price-performance.
+    Numbers obtained under emulation are only meaningful relative to each other on the same host; run the
+    driver on native x86_64 and Graviton hosts (--native) to compare absolute throughput.
+
+    Usage:
+        python3 benchmarks/arch_benchmark.py \
+            --image <account>.dkr.ecr.<region>.amazonaws.com/<repo>:model-training-lambda-{architecture}-<content hash>
+        python3 benchmarks/arch_benchmark.py --worker --rows 1000000 --features 16
+'''
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+
+# USD per GB-second (us-east-1)
+PRICE_PER_GB_SECOND = {"x86_64": 0.0000166667, "arm64": 0.0000133334}
+DOCKER_PLATFORMS = {"x86_64": "linux/amd64", "arm64": "linux/arm64"}
+
+
+def best_of(repeats: int, fn) -> float:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def worker(rows: int, features: int, repeats: int) -> dict:
+    '''
+        Times the numeric kernels used by the training and evaluation stages.
+
+        returns:
+            throughput in rows per second for fit/predict and GFLOP/s for matmul
+    '''
+    import numpy as np
+    from sklearn.linear_model import LinearRegression
+
+    rng = np.random.default_rng(0)
+    X = rng.standard_normal((rows, features))
+    y = X @ rng.standard_normal(features) + rng.standard_normal(rows)
+
+    model = LinearRegression()
+    fit_seconds = best_of(repeats, lambda: model.fit(X, y))
+    predict_seconds = best_of(repeats, lambda: model.predict(X))
+
+    A = rng.standard_normal((1024, 1024))
+    matmul_seconds = best_of(repeats, lambda: A @ A)
+
+    return {
+        "architecture": platform.machine().replace("aarch64", "arm64").replace("AMD64", "x86_64"),
+        "numpy": np.__version__,
+        "rows": rows,
+        "features": features,
+        "fit_rows_per_second": rows / fit_seconds,
+        "predict_rows_per_second": rows / predict_seconds,
+        "matmul_gflops": 2 * 1024 ** 3 / matmul_seconds / 1e9
+    }
+
+
+def run_in_image(image: str, architecture: str, args: argparse.Namespace) -> dict:
+    '''
+        Runs worker mode inside a Lambda image for the given architecture and returns its results.
+    '''
+    benchmark_dir = os.path.dirname(os.path.abspath(__file__))
+    completed = subprocess.run(
+        [
+            "docker", "run", "--rm",
+            "--platform", DOCKER_PLATFORMS[architecture],
+            "--entrypoint", "python3",
+            "-v", f"{benchmark_dir}:/benchmarks:ro",
+            image.format(architecture=architecture),
+            "/benchmarks/arch_benchmark.py", "--worker",
+            "--rows", str(args.rows), "--features", str(args.features), "--repeats", str(args.repeats)
+        ],
+        check=True,
+        capture_output=True
+    )
+    return json.loads(completed.stdout.decode().strip().splitlines()[-1])
+
+
+def compare(results: dict, memory_size: int) -> None:
+    '''
+        Prints throughput per architecture and the Lambda cost of fitting one million rows at the given memory size.
+    '''
+    print(f"{'architecture':<14}{'fit rows/s':>16}{'predict rows/s':>18}{'matmul GFLOP/s':>18}{'fit $/1M rows':>16}")
+    for architecture, result in results.items():
+        gb_seconds_per_million = memory_size / 1024 * 1e6 / result["fit_rows_per_second"]
+        cost = gb_seconds_per_million * PRICE_PER_GB_SECOND[architecture]
+        print(f"{architecture:<14}{result['fit_rows_per_second']:>16,.0f}{result['predict_rows_per_second']:>18,.0f}"
+              f"{result['matmul_gflops']:>18.2f}{cost:>16.8f}")
+
+    if set(results) == set(PRICE_PER_GB_SECOND):
+        speed_ratio = results["arm64"]["fit_rows_per_second"] / results["x86_64"]["fit_rows_per_second"]
+        price_ratio = PRICE_PER_GB_SECOND["x86_64"] / PRICE_PER_GB_SECOND["arm64"]
+        print(f"arm64 fit throughput is {speed_ratio:.2f}x x86_64; price-performance {speed_ratio * price_ratio:.2f}x")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare NumPy/Scikit-learn throughput on x86_64 and arm64")
+    parser.add_argument("--worker", action="store_true", help="Run the benchmark in this interpreter and print JSON")
+    parser.add_argument("--native", action="store_true", help="Run in this interpreter and print the comparison table")
+    parser.add_argument("--image", help="Lambda image to run the worker in; {architecture} is replaced per architecture")
+    parser.add_argument("--architectures", nargs="+", default=list(DOCKER_PLATFORMS), choices=list(DOCKER_PLATFORMS))
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--features", type=int, default=8)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--memory-size", type=int, default=1769, help="Lambda memory size used for the cost column")
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(worker(args.rows, args.features, args.repeats)))
+        return
+
+    if args.native:
+        result = worker(args.rows, args.features, args.repeats)
+        compare({result["architecture"]: result}, args.memory_size)
+        return
+
+    if not args.image:
+        parser.error("--image is required unless --worker or --native is given")
+
+    results = {architecture: run_in_image(args.image, architecture, args) for architecture in args.architectures}
+    compare(results, args.memory_size)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+'''
+    CSV vs .npy dataset read benchmark for the S3 dataset handoff between pipeline stages.
+
+    A synthetic dataset is written to S3 once per format (utils.write_data and utils.write_array), then every
+    reader runs in a fresh interpreter so its peak memory is not hidden by earlier runs:
+
+        - csv:        utils.read_data (bytes -> str -> StringIO -> DataFrame -> .to_numpy())
+        - csv-stream: utils.read_validated (chunked read_csv with the dtype plan, chunks concatenated)
+        - npy:        utils.read_array (header parsed from the stream, body read into one preallocated array)
+        - csv-ranged: utils.read_data over parallel byte ranges (row-aligned chunks parsed as ranges arrive)
+        - npy-ranged: utils.read_array over parallel byte ranges (every range read into its slice of the array)
+
+    The single-stream readers run with the byte-range threshold (RANGE_THRESHOLD_BYTES) out of reach, the ranged
+    ones with it at zero.
+
+    Peak memory above the interpreter's baseline is reported in MB and in copies of the dataset (an ideal
+    reader holds exactly one copy). Point boto3 at a stand-in (MinIO, moto server) through AWS_ENDPOINT_URL to
+    keep the runs local.
+
+    Usage:
+        AWS_ENDPOINT_URL=http://localhost:5000 python3 benchmarks/array_io_benchmark.py --bucket <bucket> \
+            --rows 1000000 --columns 16 --repeats 3
+'''
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambda", "model-training", "lambda")
+COMMON_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambda", "common")
+READERS = ("csv", "csv-stream", "npy", "csv-ranged", "npy-ranged")
+
+
+def memory_status(field: str) -> float:
+    '''
+        VmRSS (resident) or VmHWM (peak resident) of this process in MB.
+    '''
+    with open("/proc/self/status") as fp:
+        for line in fp:
+            if line.startswith(f"{field}:"):
+                return int(line.split()[1]) / 1024
+    raise KeyError(field)
+
+
+def reset_peak() -> None:
+    '''
+        Resets VmHWM to the current resident size (Linux 4.0+); the peak of a freshly exec'd interpreter would
+        otherwise include the driver's memory at fork time.
+    '''
+    with open("/proc/self/clear_refs", "w") as fp:
+        fp.write("5")
+
+
+def worker(reader: str, bucket: str, key: str, dtypes: dict) -> dict:
+    '''
+        Reads one dataset with one reader in this interpreter.
+
+        returns:
+            {"seconds", "peak_mb" above the baseline, "nbytes", "dtype"}
+    '''
+    sys.path[:0] = [LAMBDA_DIR, COMMON_DIR]
+    from contracts import DatasetContract
+    from utils import read_data, read_validated, read_array
+
+    # Imports and the S3 client are set up before the baseline, so only the read itself is measured
+    import boto3
+    boto3.client("s3").head_object(Bucket=bucket, Key=key)
+    contract = DatasetContract(name="benchmark")
+    reset_peak()
+    baseline = memory_status("VmRSS")
+
+    start = time.perf_counter()
+    if reader in ("csv", "csv-ranged"):
+        dataset = read_data(bucket, key)
+    elif reader == "csv-stream":
+        dataset, _ = read_validated(bucket, key, contract, dtypes)
+    else:
+        dataset = read_array(bucket, key)
+    seconds = time.perf_counter() - start
+
+    peak = memory_status("VmHWM")
+    return {"seconds": seconds, "peak_mb": max(peak - baseline, 0.0), "nbytes": int(dataset.nbytes), "dtype": dataset.dtype.name}
+
+
+def run_worker(reader: str, bucket: str, key: str, dtypes: dict) -> dict:
+    threshold = "0" if reader.endswith("-ranged") else str(2 ** 62)
+    completed = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--worker", "--reader", reader, "--bucket", bucket, "--key", key,
+         "--dtypes", json.dumps(dtypes)],
+        check=True,
+        capture_output=True,
+        env={**os.environ, "RANGE_THRESHOLD_BYTES": threshold}
+    )
+    return json.loads(completed.stdout.decode().strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare CSV and .npy dataset reads from S3")
+    parser.add_argument("--bucket", required=True)
+    parser.add_argument("--prefix", default="benchmarks/array-io")
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--columns", type=int, default=16)
+    parser.add_argument("--dtype", default="float64")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--reader", choices=READERS, help=argparse.SUPPRESS)
+    parser.add_argument("--key", help=argparse.SUPPRESS)
+    parser.add_argument("--dtypes", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(worker(args.reader, args.bucket, args.key, json.loads(args.dtypes))))
+        return
+
+    sys.path[:0] = [LAMBDA_DIR, COMMON_DIR]
+    import numpy as np
+    from dtypes import plan_dtypes
+    from utils import write_data, write_array
+
+    dataset = np.random.default_rng(0).standard_normal((args.rows, args.columns)).astype(args.dtype)
+    plan = plan_dtypes(dataset)
+    keys = {"csv": f"{args.prefix}/dataset.csv", "npy": f"{args.prefix}/dataset.npy"}
+    write_data(dataset, args.bucket, keys["csv"])
+    write_array(dataset, args.bucket, keys["npy"])
+
+    data_mb = dataset.nbytes / 1024 ** 2
+    print(f"{args.rows:,} x {args.columns} {args.dtype} ({data_mb:.1f} MB in memory)")
+    print(f"{'reader':<12}{'seconds':>10}{'MB/s':>10}{'peak MB':>10}{'copies':>8}")
+    for reader in READERS:
+        key = keys["npy"] if reader.startswith("npy") else keys["csv"]
+        runs = [run_worker(reader, args.bucket, key, plan) for _ in range(args.repeats)]
+        seconds = min(run["seconds"] for run in runs)
+        peak_mb = min(run["peak_mb"] for run in runs)
+        print(f"{reader:<12}{seconds:>10.3f}{data_mb / seconds:>10.1f}{peak_mb:>10.1f}{peak_mb / data_mb:>8.2f}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
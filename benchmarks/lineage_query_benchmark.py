@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+'''
+    Lineage query benchmark for the compacted lineage table (lambda/<stage>/lambda/lineage.py).
+
+    A lineage table of synthetic runs is written to S3 as one generation (lineage.write_table): every run has
+    one record per pipeline stage spread over --days days, and three datasets handed from stage to stage (each
+    an output edge of one stage and an input edge of the next). Then each query runs against it:
+
+        - runs_using:    LineageQuery.runs_using of a random dataset (fence lookup, ranged GETs of its edge rows)
+        - stage_latency: LineageQuery.stage_latency of one stage over the last 90 days (its rows from the window
+                         start)
+        - scan:          both queries answered from the whole table (every column of both tables downloaded),
+                         the cost of a store without the sorted layout and fences
+
+    Point boto3 at a stand-in (MinIO, moto server) through AWS_ENDPOINT_URL to keep the runs local.
+
+    Usage:
+        AWS_ENDPOINT_URL=http://localhost:5000 python3 benchmarks/lineage_query_benchmark.py --bucket <bucket> \
+            --runs 200000 --repeats 5
+'''
+import argparse
+import os
+import sys
+import time
+
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambda", "data-preparation", "lambda")
+COMMON_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambda", "common")
+STAGES = ["data-preparation", "feature-engineering", "model-training", "model-evaluation"]
+
+
+def synthetic_table(runs: int, days: int, now: float, seed: int = 0) -> tuple:
+    '''
+        records and edges columns (lineage.table_columns layout) of runs spread evenly over the last days.
+    '''
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    run_ids = np.char.add(b"r", np.char.zfill(np.arange(runs).astype(np.bytes_), 8))
+    run_start = (now - days * 86400) * 1000 + np.sort(rng.uniform(0, days * 86400 * 1000, runs))
+    seconds = rng.lognormal(mean=1.0, sigma=0.5, size=(runs, len(STAGES))).astype(np.float32)
+    finished = (run_start[:, None] + np.cumsum(seconds, axis=1) * 1000).astype(np.int64)
+
+    records = {
+        "stage": np.tile(np.arange(len(STAGES), dtype=np.int16), runs),
+        "finished": finished.ravel(),
+        "seconds": seconds.ravel(),
+        "run": np.repeat(run_ids, len(STAGES)),
+        "status": (rng.random(runs * len(STAGES)) < 0.01).astype(np.int8),
+        "image": rng.integers(0, 10, runs * len(STAGES)).astype(np.int32)
+    }
+
+    # Dataset d of a run is written by stage d and read by stage d + 1
+    datasets = rng.integers(0, 2 ** 63, (runs, len(STAGES) - 1), dtype=np.int64).astype(np.uint64)
+    edge_stage = np.stack([np.arange(len(STAGES) - 1), np.arange(1, len(STAGES))], axis=1).astype(np.int16)
+    edges = {
+        "dataset": np.repeat(datasets.ravel(), 2),
+        "finished": finished[:, edge_stage].ravel(),
+        "run": np.repeat(run_ids, (len(STAGES) - 1) * 2),
+        "stage": np.tile(edge_stage.ravel(), runs),
+        "role": np.tile(np.array([1, 0], dtype=np.int8), runs * (len(STAGES) - 1))
+    }
+    return records, edges, datasets
+
+
+def timed(function, repeats: int) -> tuple:
+    '''
+        returns:
+            (best seconds over the repeats, result of the last call)
+    '''
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Time lineage queries against a synthetic lineage table")
+    parser.add_argument("--bucket", required=True)
+    parser.add_argument("--runs", type=int, default=200000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    sys.path[:0] = [LAMBDA_DIR, COMMON_DIR]
+    import numpy as np
+    import lineage
+    from lineage import LineageQuery, write_table, load_table, read_manifest
+
+    now = time.time()
+    records, edges, datasets = synthetic_table(args.runs, args.days, now)
+    start = time.perf_counter()
+    write_table(args.bucket, records, edges, list(STAGES), [None], f"{lineage.LOG_PREFIX}/0", f"{int(now * 1000):013d}")
+    print(f"{args.runs:,} runs, {len(records['finished']):,} records, {len(edges['dataset']):,} edges "
+          f"written in {time.perf_counter() - start:.1f} s")
+
+    # No log records past the watermark: the queries read only the table
+    query = LineageQuery(args.bucket)
+    dataset = f"{int(datasets[args.runs // 2, 1]):016x}" + "0" * 48
+    since = int((now - 90 * 86400) * 1000)
+
+    def scan() -> tuple:
+        manifest = read_manifest(args.bucket)
+        edges_table, records_table = load_table(args.bucket, manifest, "edges"), load_table(args.bucket, manifest, "records")
+        using = np.flatnonzero(edges_table["dataset"] == lineage.dataset_id(dataset))
+        window = (records_table["stage"] == STAGES.index("model-training")) & (records_table["finished"] >= since) & (records_table["status"] == 0)
+        return using.size, int(window.sum())
+
+    results = {
+        "runs_using": timed(lambda: query.runs_using(dataset), args.repeats),
+        "stage_latency": timed(lambda: query.stage_latency("model-training", 90, now), args.repeats),
+        "scan": timed(scan, args.repeats)
+    }
+    print(f"{'query':<16}{'seconds':>10}  result")
+    print(f"{'runs_using':<16}{results['runs_using'][0]:>10.3f}  {len(results['runs_using'][1])} stage executions")
+    print(f"{'stage_latency':<16}{results['stage_latency'][0]:>10.3f}  {sum(day['runs'] for day in results['stage_latency'][1])} runs over {len(results['stage_latency'][1])} days")
+    print(f"{'scan':<16}{results['scan'][0]:>10.3f}  {results['scan'][1][0]} edges, {results['scan'][1][1]} runs")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,23 +1,20 @@
 #!/usr/bin/env python3
 import os
-import sys
 
 import aws_cdk as cdk
 
+from training_pipeline.buildspec import BuildspecTemplate, load_buildspec
 from training_pipeline.ci_cd_stack import CICDStack
 from training_pipeline.lightweight_training_stack import LightweightTrainingStack
 
 # *** IMMUTABLE INFRASTRUCTURE - only approved IAM Users can commit changes through the centralized DevOps accounts ***
 
-def read_buildspec(path: str) -> str:
+def read_buildspec(path: str) -> BuildspecTemplate:
     '''
-        Open local buildspec.yml file, read it into a string object & return for input into CDK CICDStack's props.
+        Parse a local buildspec.yml template once and return it for rendering by CDK CICDStack.
         This abstracts CodeBuild configuration away from data scientists.
     '''
-    file = open(path)
-    buildspec_yml = file.read()
-    file.close()
-    return buildspec_yml
+    return load_buildspec(path)
     
 
 app = cdk.App()
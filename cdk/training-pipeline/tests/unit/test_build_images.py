@@ -0,0 +1,65 @@
+import os
+import re
+import shutil
+import subprocess
+import importlib.util
+
+import pytest
+
+TRAINING_PIPELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+
+LAMBDA_DIR = os.path.join(TRAINING_PIPELINE_DIR, "..", "..", "lambda")
+
+
+def load_build_images():
+    spec = importlib.util.spec_from_file_location("build_images", os.path.join(TRAINING_PIPELINE_DIR, "tools", "build_images.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+build_images = load_build_images()
+
+
+def buildspec_hash(buildspec: str, stage_dir: str) -> str:
+    '''
+        Runs the CONTENT_HASH command of a lambda-build buildspec on stage_dir.
+    '''
+    with open(os.path.join(TRAINING_PIPELINE_DIR, "lambda-build", buildspec)) as file:
+        command = re.search(r"CONTENT_HASH=\$\((.*?)\)\n", file.read(), re.S).group(1)
+    command = command.replace("lambda/$STAGE", stage_dir)
+    return subprocess.run(["bash", "-c", command], capture_output=True, text=True, check=True).stdout.strip()
+
+
+@pytest.fixture
+def stage_dir(tmp_path):
+    '''
+        A copy of the model-training build context with the shared modules assembled, plus files the hash skips.
+    '''
+    lambda_dir = tmp_path / "lambda"
+    shutil.copytree(os.path.join(LAMBDA_DIR, "model-training"), lambda_dir / "model-training", ignore=shutil.ignore_patterns("__pycache__"))
+    shutil.copytree(os.path.join(LAMBDA_DIR, "common"), lambda_dir / "common", ignore=shutil.ignore_patterns("__pycache__"))
+    build_images.assemble_common(str(lambda_dir), "model-training")
+
+    stage = lambda_dir / "model-training"
+    for skipped in ("tests/test_new.py", "wheelhouse/numpy.whl", "lambda/__pycache__/utils.pyc"):
+        (stage / skipped).parent.mkdir(parents=True, exist_ok=True)
+        (stage / skipped).write_text("skipped")
+    return str(stage)
+
+
+@pytest.mark.parametrize("buildspec", ["build.yml", "deploy.yml"])
+def test_content_hash_matches_buildspec(stage_dir, buildspec):
+    assert build_images.content_hash(stage_dir) == buildspec_hash(buildspec, stage_dir)
+
+
+def test_content_hash_follows_image_contents_only(stage_dir):
+    original = build_images.content_hash(stage_dir)
+
+    with open(os.path.join(stage_dir, "tests", "test_new.py"), "a") as file:
+        file.write("changed")
+    assert build_images.content_hash(stage_dir) == original
+
+    with open(os.path.join(stage_dir, "common", "registry.py"), "a") as file:
+        file.write("\n")
+    assert build_images.content_hash(stage_dir) != original
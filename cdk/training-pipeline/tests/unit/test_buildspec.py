@@ -0,0 +1,101 @@
+import os
+
+import pytest
+import yaml
+
+from training_pipeline import buildspec
+from training_pipeline.buildspec import BuildspecError, load_buildspec
+
+LAMBDA_BUILD_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "lambda-build")
+
+VARIABLES = {
+    "aws_account": "000123456789",
+    "aws_region": "us-east-1",
+    "repo": "regression-repo",
+    "bucket": "pr-test-regression-bucket",
+    "project": "regression",
+    "prod_aws_account": "000987654321",
+    "stages": "data-preparation model-training",
+    "architectures": "x86_64 arm64",
+    "wheel_cache_prefix": "build-cache/pip-wheels"
+}
+
+TEMPLATE = '''
+version: 0.2
+env:
+  variables:
+    AWS_ACCOUNT: "{{ aws_account }}"
+    PARALLELISM: "{{ parallelism }}"
+phases:
+  build:
+    commands:
+      - echo repo_name project_name {{ repo }}
+      - docker push {{ aws_account }}.dkr.ecr.{{ aws_region }}.amazonaws.com/{{ repo }}:{{parallelism}}
+'''
+
+
+def template(tmp_path, text: str = TEMPLATE) -> str:
+    path = tmp_path / "buildspec.yml"
+    path.write_text(text)
+    return str(path)
+
+
+@pytest.fixture
+def parallelism(monkeypatch):
+    '''
+        An integer build variable next to the string ones.
+    '''
+    monkeypatch.setitem(buildspec.VARIABLE_TYPES, "parallelism", int)
+
+
+def test_whole_scalars_keep_their_type_and_text_is_interpolated(tmp_path, parallelism):
+    rendered = yaml.safe_load(load_buildspec(template(tmp_path)).render(aws_account="000123456789", aws_region="us-east-1", repo="models", parallelism=4))
+
+    # A numeric-looking string stays a string (leading zeros kept), an int stays an int
+    assert rendered["env"]["variables"] == {"AWS_ACCOUNT": "000123456789", "PARALLELISM": 4}
+    # Bare words that look like variable names are left alone
+    assert rendered["phases"]["build"]["commands"] == [
+        "echo repo_name project_name models",
+        "docker push 000123456789.dkr.ecr.us-east-1.amazonaws.com/models:4"
+    ]
+
+
+def test_renders_are_cached(tmp_path, parallelism):
+    path = template(tmp_path)
+    assert load_buildspec(path) is load_buildspec(path)
+    variables = {"aws_account": "1", "aws_region": "us-east-1", "repo": "models", "parallelism": 2}
+    assert load_buildspec(path).render(**variables) is load_buildspec(path).render(**variables)
+
+
+def test_unknown_placeholder_is_rejected_when_loading(tmp_path):
+    with pytest.raises(BuildspecError, match="unknown buildspec variables \\['parallelism'\\]"):
+        load_buildspec(template(tmp_path))
+
+
+@pytest.mark.parametrize("variables, message", [
+    ({"aws_account": "1", "aws_region": "us-east-1", "parallelism": 2}, "missing buildspec variables \\['repo'\\]"),
+    ({"aws_account": "1", "aws_region": "us-east-1", "repo": "models", "parallelism": 2, "branch": "main"}, "unknown buildspec variable branch"),
+    ({"aws_account": 1, "aws_region": "us-east-1", "repo": "models", "parallelism": 2}, "aws_account must be str"),
+    ({"aws_account": "1", "aws_region": "us-east-1", "repo": "models", "parallelism": True}, "parallelism must be int")
+])
+def test_render_rejects_bad_variables(tmp_path, parallelism, variables, message):
+    with pytest.raises(BuildspecError, match=message):
+        load_buildspec(template(tmp_path)).render(**variables)
+
+
+def test_invalid_buildspec_is_rejected(tmp_path):
+    with pytest.raises(BuildspecError, match="unsupported buildspec version"):
+        load_buildspec(template(tmp_path, "version: 0.1\nphases:\n  build:\n    commands: [ls]\n"))
+    with pytest.raises(BuildspecError, match="list of string commands"):
+        load_buildspec(template(tmp_path, "version: 0.2\nphases:\n  build:\n    commands: ls\n"))
+
+
+@pytest.mark.parametrize("name", ["build.yml", "deploy.yml", "factory.yml", "prod-factory.yml"])
+def test_pipeline_buildspecs_render(name):
+    path = os.path.join(LAMBDA_BUILD_DIR, name)
+    template = load_buildspec(path)
+    rendered = yaml.safe_load(template.render(**{variable: VARIABLES[variable] for variable in template.placeholders}))
+
+    assert "{{" not in yaml.dump(rendered)
+    for variable, value in rendered.get("env", {}).get("variables", {}).items():
+        assert isinstance(value, str), variable
@@ -0,0 +1,42 @@
+import json
+import re
+
+import pytest
+
+from training_pipeline.lightweight_training_stack import RUN_PARAMETERS_CODE
+
+ULID = re.compile(r"^[0-9A-HJKMNP-TV-Z]{26}$")
+
+
+@pytest.fixture
+def run_parameters(monkeypatch):
+    '''
+        The run parameters Lambda handler, with the environment the stack gives it.
+    '''
+    monkeypatch.setenv("ENVIRONMENT", "test")
+    monkeypatch.setenv("PROJECT", "regression")
+    monkeypatch.setenv("FUSED_ROW_LIMIT", "1000")
+    namespace = {}
+    exec(compile(RUN_PARAMETERS_CODE, "index.py", "exec"), namespace)
+    return lambda event: json.loads(namespace["lambda_handler"](event, None))
+
+
+def test_new_run(run_parameters):
+    parameters = run_parameters({})
+
+    assert ULID.match(parameters["RunId"])
+    assert (parameters["Environment"], parameters["Project"], parameters["ExecutionMode"]) == ("test", "regression", "split")
+    assert run_parameters(None)["RunId"] != parameters["RunId"]
+
+
+def test_small_runs_are_fused(run_parameters, monkeypatch):
+    assert run_parameters({"DatasetRows": 1000})["ExecutionMode"] == "fused"
+    assert run_parameters({"DatasetRows": 1001})["ExecutionMode"] == "split"
+    assert run_parameters({"Generator": {"Rows": 10}})["ExecutionMode"] == "fused"
+    monkeypatch.setenv("FUSED_ROW_LIMIT", "0")
+    assert run_parameters({"DatasetRows": 10})["ExecutionMode"] == "split"
+
+
+def test_resumed_run_keeps_its_id(run_parameters):
+    parameters = run_parameters({"Resume": {"RunId": "01JAXYZ", "RunDate": "2026-10-01"}, "TrainingSince": "2026-09-01"})
+    assert (parameters["RunId"], parameters["RunDate"], parameters["TrainingSince"]) == ("01JAXYZ", "2026-10-01", "2026-09-01")
@@ -0,0 +1,63 @@
+import json
+from dataclasses import replace
+
+import pytest
+
+from training_pipeline.stages import (
+    PIPELINE, FUSED_STAGE, LEASE_STAGE, FAILED_STATE, RELEASE_LEASE_AFTER_FAILURE_STATE, build_definition, fused_stage,
+    retry_seconds, use_distributed_training
+)
+
+
+def task_states(states: dict):
+    for name, state in states.items():
+        if state["Type"] == "Task":
+            yield name, state
+        for branch in state.get("Branches", []):
+            yield from task_states(branch["States"])
+        if "Iterator" in state:
+            yield from task_states(state["Iterator"]["States"])
+        if "ItemProcessor" in state:
+            yield from task_states(state["ItemProcessor"]["States"])
+
+
+def test_tasks_only_retry_transient_errors():
+    steps = use_distributed_training(PIPELINE, 4)
+    definition = json.loads(build_definition(steps, fused_stage(steps), LEASE_STAGE))
+
+    tasks = list(task_states(definition["States"]))
+    assert tasks
+    for name, state in tasks:
+        retried = {error for retrier in state["Retry"] for error in retrier["ErrorEquals"]}
+        assert "TransientAWSError" in retried, name
+        assert not retried & {"ClientError", "States.ALL", "States.TaskFailed", "Sandbox.Timedout", "Lambda.Unknown"}, name
+
+
+def test_stage_failures_release_the_lease():
+    definition = json.loads(build_definition(PIPELINE, fused_stage(PIPELINE), LEASE_STAGE))
+    states = definition["States"]
+
+    for step in PIPELINE:
+        if hasattr(step, "construct_id"):
+            assert states[step.state_name]["Catch"][0]["Next"] == RELEASE_LEASE_AFTER_FAILURE_STATE
+    assert states[FUSED_STAGE.state_name]["Catch"][0]["Next"] == RELEASE_LEASE_AFTER_FAILURE_STATE
+    assert states[RELEASE_LEASE_AFTER_FAILURE_STATE]["Next"] == FAILED_STATE
+
+
+def lease_stage(seconds: int):
+    return replace(LEASE_STAGE, environment={**LEASE_STAGE.environment, "LEASE_SECONDS": str(seconds)})
+
+
+@pytest.mark.parametrize("state_machine_type, seconds", [("STANDARD", 6 * 3600), ("STANDARD", 600), ("EXPRESS", 300)])
+def test_lease_wait_fits_in_the_execution_timeout(state_machine_type, seconds):
+    definition = json.loads(build_definition(PIPELINE, None, lease_stage(seconds), state_machine_type))
+    lease_retrier = definition["States"][LEASE_STAGE.state_name]["Retry"][0]
+
+    assert lease_retrier["ErrorEquals"] == ["LeaseUnavailable"]
+    assert definition["TimeoutSeconds"] == seconds
+    assert retry_seconds(lease_retrier) <= seconds / 2
+
+
+def test_express_lease_cannot_outlive_the_execution():
+    with pytest.raises(ValueError):
+        build_definition(PIPELINE, None, lease_stage(6 * 3600), "EXPRESS")
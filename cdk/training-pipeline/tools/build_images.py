@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+'''
+    Local build orchestrator for the training pipeline Lambda images.
+
+    Outside AWS the stage images are built the way the CI/CD Build stage builds them, one image per stage and
+    architecture with the same content hash tags (<stage>-lambda-<architecture>-<content hash>), but concurrently
+    in a process pool instead of one CodeBuild action per stage. Images whose tag already exists locally are
+    skipped, and with --manifest-dir the per-stage image manifests read by LightweightTrainingStack are written too.
+
+    Usage (from cdk/training-pipeline):
+        python3 tools/build_images.py --lambda-dir ../../lambda --repository <account>.dkr.ecr.<region>.amazonaws.com/<repo> \
+            --workers 4 --push
+'''
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from training_pipeline.stages import ARCHITECTURES, PIPELINE, image_stages
+
+
+DOCKER_PLATFORMS = {"x86_64": "linux/amd64", "arm64": "linux/arm64"}
+
+
+def content_hash(stage_dir: str) -> str:
+    '''
+        Content hash of a stage directory, identical to the one computed by lambda-build/build.yml:
+        sha256 over the sorted "sha256sum" lines of every file except the wheelhouse, the tests and __pycache__.
+        args:
+            stage_dir: lambda/<stage> directory
+        returns:
+            first 16 hex digits of the hash
+    '''
+    paths = []
+    for root, dirs, files in os.walk(stage_dir):
+        dirs[:] = [name for name in dirs if name != "__pycache__" and not (root == stage_dir and name in ("wheelhouse", "tests"))]
+        paths.extend("./" + os.path.relpath(os.path.join(root, name), stage_dir).replace(os.sep, "/") for name in files)
+
+    digest = hashlib.sha256()
+    for path in sorted(paths, key=lambda path: path.encode()):
+        with open(os.path.join(stage_dir, path), "rb") as file:
+            digest.update(f"{hashlib.sha256(file.read()).hexdigest()}  {path}\n".encode())
+    return digest.hexdigest()[:16]
+
+
+def assemble_common(lambda_dir: str, stage_name: str) -> None:
+    '''
+        Copies the shared helper modules (lambda/common/*.py) into lambda/<stage>/common, as lambda-build/build.yml
+        does before hashing (every image carries them).
+    '''
+    target = os.path.join(lambda_dir, stage_name, "common")
+    os.makedirs(target, exist_ok=True)
+    for name in os.listdir(target):
+        if name.endswith(".py"):
+            os.remove(os.path.join(target, name))
+    source = os.path.join(lambda_dir, "common")
+    for name in os.listdir(source):
+        if name.endswith(".py"):
+            shutil.copyfile(os.path.join(source, name), os.path.join(target, name))
+
+
+def assemble_bundle(lambda_dir: str, stage_name: str) -> None:
+    '''
+        Copies the Lambda code of the stages listed in lambda/<stage>/bundle.txt into lambda/<stage>/bundle/<listed stage>,
+        as lambda-build/build.yml does before hashing (the fused pipeline image bundles every stage's code).
+    '''
+    bundle_list = os.path.join(lambda_dir, stage_name, "bundle.txt")
+    if not os.path.exists(bundle_list):
+        return
+    with open(bundle_list) as file:
+        bundled = [line.strip() for line in file if line.strip() and not line.startswith("#")]
+    for name in bundled:
+        target = os.path.join(lambda_dir, stage_name, "bundle", name)
+        shutil.rmtree(target, ignore_errors=True)
+        shutil.copytree(os.path.join(lambda_dir, name, "lambda"), target, ignore=shutil.ignore_patterns("__pycache__"))
+
+
+def image_exists(image: str) -> bool:
+    return subprocess.run(["docker", "image", "inspect", image], capture_output=True).returncode == 0
+
+
+def build_image(stage_dir: str, architecture: str, image: str, push: bool) -> dict:
+    '''
+        Builds (and optionally pushes) one stage image. Runs in a pool worker process.
+        returns:
+            {"image", "status", "seconds"}, status being built, pushed, skipped or failed
+    '''
+    start = time.perf_counter()
+    if image_exists(image):
+        return {"image": image, "status": "skipped", "seconds": 0.0}
+
+    environment = dict(os.environ, DOCKER_BUILDKIT="1")
+    completed = subprocess.run(
+        ["docker", "build", "--platform", DOCKER_PLATFORMS[architecture], "-t", image, stage_dir],
+        capture_output=True, env=environment
+    )
+    if completed.returncode == 0 and push:
+        completed = subprocess.run(["docker", "push", image], capture_output=True)
+
+    result = {"image": image, "seconds": time.perf_counter() - start}
+    if completed.returncode != 0:
+        result.update(status="failed", error=completed.stderr.decode()[-2000:])
+    else:
+        result["status"] = "pushed" if push else "built"
+    return result
+
+
+def write_manifest(manifest_dir: str, stage_name: str, stage_hash: str, images: dict) -> None:
+    os.makedirs(manifest_dir, exist_ok=True)
+    with open(os.path.join(manifest_dir, f"{stage_name}.json"), "w") as file:
+        json.dump({"stage": stage_name, "content_hash": stage_hash, "build_number": "local", "images": images}, file)
+
+
+def main() -> Optional[int]:
+    stage_names = [stage.name for stage in image_stages(PIPELINE)]
+
+    parser = argparse.ArgumentParser(description="Build the training pipeline Lambda images concurrently")
+    parser.add_argument("--lambda-dir", default=os.path.join("..", "..", "lambda"))
+    parser.add_argument("--repository", default="training-pipeline", help="Image repository; tags are appended to it")
+    parser.add_argument("--stages", nargs="+", default=stage_names, choices=stage_names)
+    parser.add_argument("--architectures", nargs="+", default=list(ARCHITECTURES), choices=list(ARCHITECTURES))
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--push", action="store_true")
+    parser.add_argument("--manifest-dir", help="Write build/image-manifest/<stage>.json style manifests here")
+    args = parser.parse_args()
+
+    for stage in args.stages:
+        assemble_common(args.lambda_dir, stage)
+        assemble_bundle(args.lambda_dir, stage)
+    hashes = {stage: content_hash(os.path.join(args.lambda_dir, stage)) for stage in args.stages}
+    images = {
+        (stage, architecture): f"{args.repository}:{stage}-lambda-{architecture}-{hashes[stage]}"
+        for stage in args.stages for architecture in args.architectures
+    }
+
+    start = time.perf_counter()
+    results = {}
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = {
+            executor.submit(build_image, os.path.join(args.lambda_dir, stage), architecture, image, args.push): (stage, architecture)
+            for (stage, architecture), image in images.items()
+        }
+        for future in as_completed(futures):
+            result = future.result()
+            results[futures[future]] = result
+            print(f"{result['status']:<8}{result['seconds']:>8.1f}s  {result['image']}")
+            if result["status"] == "failed":
+                print(result["error"], file=sys.stderr)
+    wall_time = time.perf_counter() - start
+
+    slowest = max(result["seconds"] for result in results.values())
+    print(f"wall time {wall_time:.1f}s, slowest image {slowest:.1f}s, sequential total {sum(result['seconds'] for result in results.values()):.1f}s")
+
+    failed = [key for key, result in results.items() if result["status"] == "failed"]
+    if args.manifest_dir:
+        for stage in args.stages:
+            if not any(key[0] == stage for key in failed):
+                write_manifest(args.manifest_dir, stage, hashes[stage], {
+                    architecture: images[(stage, architecture)].rsplit(":", 1)[-1] for architecture in args.architectures
+                })
+    return 1 if failed else None
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+'''
+    Lambda memory/power tuning harness for the training pipeline stages.
+
+    Lambda allocates CPU proportionally to memory (1,769 MB = 1 vCPU, up to 6 vCPUs at 10,240 MB), so every
+    stage handler is executed locally at several memory settings with its CPU and memory limited the way
+    Lambda would limit them:
+
+        - cgroup v2 (cpu.max + memory.max) when the harness is allowed to create cgroups (root / delegated)
+        - otherwise a SIGSTOP/SIGCONT duty cycle that caps the child's CPU share, with runs whose peak RSS
+          exceeds the memory setting counted as out-of-memory failures
+
+    Stage handlers read and write S3 exactly as they do in Lambda; point them at a stand-in (MinIO, moto server)
+    through AWS_ENDPOINT_URL to keep the runs local. A duration model t(m) = a + b / vcpu(m) is fitted per stage,
+    and the recommended memory_size/timeout values are written to stage-tuning.json, which
+    LightweightTrainingStack reads at synth time.
+
+    Usage (from cdk/training-pipeline):
+        AWS_ENDPOINT_URL=http://localhost:9000 python3 tools/power_tuning.py --lambda-dir ../../lambda \
+            --environment test --project regression --memory 256 512 1024 1769 3008 --repeats 3
+'''
+import argparse
+import datetime
+import json
+import math
+import os
+import signal
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from training_pipeline.stages import PIPELINE, iter_stages, StageSpec
+
+
+MB_PER_VCPU = 1769
+MAX_VCPUS = 6
+CGROUP_ROOT = "/sys/fs/cgroup"
+CPU_PERIOD_US = 100000
+
+# USD per GB-second (us-east-1) and per request
+PRICE_PER_GB_SECOND = {"x86_64": 0.0000166667, "arm64": 0.0000133334}
+PRICE_PER_REQUEST = 0.0000002
+
+# Child process: import the stage handler and invoke it once with the run parameters
+RUNNER = '''
+import json, importlib, os, resource, sys, time
+sys.path[:0] = [sys.argv[1], os.path.join(sys.argv[1], "..", "..", "common")]
+module, function = sys.argv[3].rsplit(".", 1)
+lambda_handler = getattr(importlib.import_module(module), function)
+event = {"Input": {"RunParameters": sys.argv[2]}}
+start = time.perf_counter()
+lambda_handler(event, None)
+duration = time.perf_counter() - start
+peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+print(json.dumps({"duration": duration, "peak_memory_mb": peak_mb}))
+'''
+
+
+def vcpus(memory_size: int) -> float:
+    return min(memory_size / MB_PER_VCPU, MAX_VCPUS)
+
+
+class CgroupLimiter:
+    '''
+        Runs a child process inside a dedicated cgroup v2 group with Lambda-equivalent CPU and memory limits.
+    '''
+    def __init__(self, name: str, memory_size: int):
+        self.path = os.path.join(CGROUP_ROOT, "power-tuning", name)
+        os.makedirs(self.path, exist_ok=True)
+        quota = int(vcpus(memory_size) * CPU_PERIOD_US)
+        self._write("cpu.max", f"{quota} {CPU_PERIOD_US}")
+        self._write("memory.max", str(memory_size * 1024 * 1024))
+        self._write("memory.swap.max", "0")
+
+    def _write(self, file_name: str, value: str) -> None:
+        with open(os.path.join(self.path, file_name), "w") as fp:
+            fp.write(value)
+
+    def preexec(self) -> None:
+        self._write("cgroup.procs", str(os.getpid()))
+
+    def supervise(self, process: subprocess.Popen) -> None:
+        process.wait()
+
+    def close(self) -> None:
+        os.rmdir(self.path)
+
+    @staticmethod
+    def available() -> bool:
+        # A real cgroup2 mount exposes cgroup.controllers and populates new groups with interface files
+        if not os.path.exists(os.path.join(CGROUP_ROOT, "cgroup.controllers")):
+            return False
+        try:
+            parent = os.path.join(CGROUP_ROOT, "power-tuning")
+            os.makedirs(parent, exist_ok=True)
+            if not os.path.exists(os.path.join(parent, "cgroup.procs")):
+                return False
+            with open(os.path.join(CGROUP_ROOT, "cgroup.subtree_control"), "w") as fp:
+                fp.write("+cpu +memory")
+            with open(os.path.join(parent, "cgroup.subtree_control"), "w") as fp:
+                fp.write("+cpu +memory")
+            return True
+        except OSError:
+            return False
+
+
+class DutyCycleLimiter:
+    '''
+        Fallback when cgroups are unavailable: pins the child to as many cores as Lambda would expose and
+        throttles its CPU share by alternating SIGCONT/SIGSTOP within a fixed period.
+        Memory is not enforced here; run_trial rejects runs whose peak RSS exceeds the memory setting.
+    '''
+    PERIOD = 0.05
+
+    def __init__(self, name: str, memory_size: int):
+        self.cores = max(1, math.ceil(vcpus(memory_size)))
+        self.share = vcpus(memory_size) / self.cores
+
+    def preexec(self) -> None:
+        if hasattr(os, "sched_setaffinity"):
+            available = sorted(os.sched_getaffinity(0))
+            os.sched_setaffinity(0, available[:self.cores])
+
+    def supervise(self, process: subprocess.Popen) -> None:
+        if self.share >= 1:
+            process.wait()
+            return
+        running = self.PERIOD * self.share
+        stopped = self.PERIOD - running
+        while process.poll() is None:
+            time.sleep(running)
+            try:
+                process.send_signal(signal.SIGSTOP)
+                time.sleep(stopped)
+                process.send_signal(signal.SIGCONT)
+            except ProcessLookupError:
+                break
+        process.wait()
+
+    def close(self) -> None:
+        pass
+
+
+def run_trial(stage: StageSpec, lambda_dir: str, run_parameters: dict, memory_size: int, use_cgroups: bool) -> Optional[dict]:
+    '''
+        Invokes a stage handler once under Lambda-equivalent limits.
+
+        returns:
+            {"duration", "peak_memory_mb"} or None when the handler failed (e.g. out of memory)
+    '''
+    handler_dir = os.path.join(lambda_dir, stage.image_name, "lambda")
+    limiter_class = CgroupLimiter if use_cgroups else DutyCycleLimiter
+    limiter = limiter_class(f"{stage.name}-{memory_size}", memory_size)
+    try:
+        process = subprocess.Popen(
+            [sys.executable, "-c", RUNNER, handler_dir, json.dumps(run_parameters), stage.handler or "lambda_function.lambda_handler"],
+            cwd=handler_dir,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            preexec_fn=limiter.preexec
+        )
+        limiter.supervise(process)
+        stdout, stderr = process.communicate()
+    finally:
+        limiter.close()
+
+    if process.returncode != 0:
+        print(f"  {stage.name} @ {memory_size} MB failed: {stderr.decode(errors='replace').strip().splitlines()[-1:]}")
+        return None
+    result = json.loads(stdout.decode().strip().splitlines()[-1])
+    if result["peak_memory_mb"] > memory_size:
+        print(f"  {stage.name} @ {memory_size} MB failed: peak RSS {result['peak_memory_mb']:.0f} MB")
+        return None
+    return result
+
+
+def fit_duration_model(observations: List[dict]) -> Dict[str, float]:
+    '''
+        Least-squares fit of duration = a + b / vcpu(memory) over successful observations.
+        a captures the fixed (I/O, import) cost, b the CPU-bound work in vCPU-seconds.
+    '''
+    xs = [1 / vcpus(o["memory_size"]) for o in observations]
+    ys = [o["duration"] for o in observations]
+    n = len(xs)
+    mean_x = sum(xs) / n
+    mean_y = sum(ys) / n
+    variance = sum((x - mean_x) ** 2 for x in xs)
+    if n < 2 or variance == 0:
+        return {"a": mean_y, "b": 0.0}
+    b = max(sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / variance, 0.0)
+    return {"a": max(mean_y - b * mean_x, 0.0), "b": b}
+
+
+def predict_duration(fit: Dict[str, float], memory_size: int) -> float:
+    return fit["a"] + fit["b"] / vcpus(memory_size)
+
+
+def invocation_cost(duration: float, memory_size: int, architecture: str) -> float:
+    return PRICE_PER_GB_SECOND[architecture] * memory_size / 1024 * duration + PRICE_PER_REQUEST
+
+
+def recommend(stage: StageSpec, observations: List[dict], candidates: List[int], objective: str, weight: float, timeout_factor: float) -> dict:
+    '''
+        Picks the memory size minimizing the objective over the candidate sizes that did not fail,
+        and a timeout with headroom over the slowest observed run at that size.
+    '''
+    succeeded = [o for o in observations if o["duration"] is not None]
+    if not succeeded:
+        raise RuntimeError(f"Stage {stage.name} failed at every memory setting")
+
+    # Never recommend less memory than the smallest setting that ran successfully, plus 20% headroom over peak RSS
+    floor = max(min(o["memory_size"] for o in succeeded), max(o["peak_memory_mb"] for o in succeeded) * 1.2)
+    fit = fit_duration_model(succeeded)
+    curve = [
+        {
+            "memory_size": m,
+            "duration": predict_duration(fit, m),
+            "cost": invocation_cost(predict_duration(fit, m), m, stage.architecture)
+        }
+        for m in candidates if m >= floor
+    ]
+    if not curve:
+        raise RuntimeError(f"Stage {stage.name} needs more memory than every candidate setting")
+
+    fastest = min(point["duration"] for point in curve)
+    cheapest = min(point["cost"] for point in curve)
+    scores = {
+        "cost": lambda point: point["cost"],
+        "speed": lambda point: point["duration"],
+        "balanced": lambda point: weight * point["cost"] / cheapest + (1 - weight) * point["duration"] / fastest
+    }
+    best = min(curve, key=scores[objective])
+
+    slowest = max(
+        [o["duration"] for o in succeeded if o["memory_size"] == best["memory_size"]] + [best["duration"]]
+    )
+    timeout = min(max(math.ceil(slowest * timeout_factor), 10), 900)
+
+    return {
+        "memory_size": best["memory_size"],
+        "timeout": timeout,
+        "fit": fit,
+        "curve": curve,
+        "observations": observations
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Tune Lambda memory/timeout per training pipeline stage")
+    parser.add_argument("--lambda-dir", default=os.path.join("..", "..", "lambda"))
+    parser.add_argument("--environment", default="test")
+    parser.add_argument("--project", required=True)
+    parser.add_argument("--stages", nargs="*", help="Subset of stage names to tune (default: all, in pipeline order)")
+    parser.add_argument("--memory", nargs="+", type=int, default=[256, 512, 1024, 1769, 3008])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--objective", choices=["cost", "speed", "balanced"], default="balanced")
+    parser.add_argument("--weight", type=float, default=0.5, help="Cost weight of the balanced objective")
+    parser.add_argument("--timeout-factor", type=float, default=3.0)
+    parser.add_argument("--run-parameter", action="append", default=[], metavar="KEY=VALUE",
+                        help="Extra run parameters, e.g. to select a representative dataset")
+    parser.add_argument("--output", default="stage-tuning.json")
+    args = parser.parse_args()
+
+    use_cgroups = CgroupLimiter.available()
+    print(f"CPU/memory limits enforced with {'cgroup v2' if use_cgroups else 'a CPU duty cycle'}")
+
+    run_parameters = {
+        "RunId": "power-tuning",
+        "RunDate": str(datetime.datetime.today().date()),
+        "Environment": args.environment,
+        "Project": args.project
+    }
+    for parameter in args.run_parameter:
+        key, value = parameter.split("=", 1)
+        run_parameters[key] = json.loads(value) if value[:1] in "[{0123456789" else value
+
+    stages = [s for s in iter_stages(PIPELINE) if not args.stages or s.name in args.stages]
+    tuning = {"generated_at": datetime.datetime.utcnow().isoformat() + "Z", "objective": args.objective, "stages": {}}
+
+    # Stages run in pipeline order at every memory size so downstream stages always find their inputs
+    observations = {stage.name: [] for stage in stages}
+    for memory_size in sorted(args.memory, reverse=True):
+        for stage in stages:
+            for _ in range(args.repeats):
+                result = run_trial(stage, args.lambda_dir, run_parameters, memory_size, use_cgroups)
+                observations[stage.name].append({
+                    "memory_size": memory_size,
+                    "duration": result["duration"] if result else None,
+                    "peak_memory_mb": result["peak_memory_mb"] if result else None
+                })
+                if result:
+                    print(f"  {stage.name} @ {memory_size} MB: {result['duration']:.3f}s, peak {result['peak_memory_mb']:.0f} MB")
+
+    # The fitted curve is evaluated on Lambda's 64 MB granularity between the smallest and largest tested sizes
+    candidates = sorted(set(args.memory) | set(range(min(args.memory), max(args.memory) + 1, 64)))
+    for stage in stages:
+        tuning["stages"][stage.name] = recommend(stage, observations[stage.name], candidates, args.objective, args.weight, args.timeout_factor)
+        print(f"{stage.name}: memory_size={tuning['stages'][stage.name]['memory_size']} timeout={tuning['stages'][stage.name]['timeout']}")
+
+    with open(args.output, "w") as fp:
+        json.dump(tuning, fp, indent=2)
+
+
+if __name__ == "__main__":
+    main()
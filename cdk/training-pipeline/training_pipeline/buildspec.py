@@ -0,0 +1,166 @@
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Dict, FrozenSet
+
+import yaml
+
+
+# *********************************************
+# Buildspec templates
+#
+# The lambda-build/*.yml buildspecs are YAML templates with {{ variable }} placeholders. Each file is parsed
+# once, placeholders are substituted in the parsed tree (never in raw text, so words like "repo_name" in a
+# command are left alone), and the rendered buildspec is validated and cached per set of variables.
+#*********************************************
+
+PLACEHOLDER = re.compile(r"\{\{\s*([a-z_][a-z0-9_]*)\s*\}\}")
+
+# Every variable a buildspec may reference and its type
+VARIABLE_TYPES = {
+    "aws_account": str,
+    "aws_region": str,
+    "repo": str,
+    "bucket": str,
+    "project": str,
+    "prod_aws_account": str,
+    "stages": str,
+    "architectures": str,
+    "wheel_cache_prefix": str
+}
+
+BUILDSPEC_VERSION = 0.2
+PHASES = ("install", "pre_build", "build", "post_build")
+
+
+class BuildspecError(ValueError):
+    '''
+        Raised for buildspec templates or rendered buildspecs that are not valid.
+    '''
+
+
+@dataclass(frozen=True, eq=False)
+class BuildspecTemplate:
+    '''
+        Parsed buildspec template; instances are cached per path, so they also serve as render cache keys.
+
+        args:
+            path: buildspec file the template was read from
+            tree: parsed YAML document (never mutated)
+            placeholders: names of the variables the template references
+    '''
+    path: str
+    tree: Dict[str, Any]
+    placeholders: FrozenSet[str]
+
+    def render(self, **variables: Any) -> str:
+        return _render(self, tuple(sorted(variables.items())))
+
+
+def _walk_strings(node: Any):
+    if isinstance(node, str):
+        yield node
+    elif isinstance(node, dict):
+        for key, value in node.items():
+            yield from _walk_strings(key)
+            yield from _walk_strings(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from _walk_strings(value)
+
+
+def _substitute(node: Any, variables: Dict[str, Any]) -> Any:
+    '''
+        Returns a copy of node with placeholders replaced. A scalar that is exactly one placeholder takes the
+        variable's typed value; placeholders inside longer strings are interpolated as text.
+    '''
+    if isinstance(node, str):
+        whole = PLACEHOLDER.fullmatch(node.strip())
+        if whole:
+            return variables[whole.group(1)]
+        return PLACEHOLDER.sub(lambda match: str(variables[match.group(1)]), node)
+    if isinstance(node, dict):
+        return {_substitute(key, variables): _substitute(value, variables) for key, value in node.items()}
+    if isinstance(node, list):
+        return [_substitute(value, variables) for value in node]
+    return node
+
+
+def validate_buildspec(tree: Any, source: str) -> None:
+    '''
+        Structural checks for the parts of the buildspec syntax used by the CodeBuild projects.
+        args:
+            tree: parsed (template or rendered) buildspec
+            source: file name used in error messages
+    '''
+    if not isinstance(tree, dict):
+        raise BuildspecError(f"{source}: buildspec must be a YAML mapping")
+    if tree.get("version") != BUILDSPEC_VERSION:
+        raise BuildspecError(f"{source}: unsupported buildspec version {tree.get('version')!r}")
+
+    phases = tree.get("phases")
+    if not isinstance(phases, dict) or not phases:
+        raise BuildspecError(f"{source}: buildspec has no phases")
+    for name, phase in phases.items():
+        if name not in PHASES:
+            raise BuildspecError(f"{source}: unknown phase {name!r}")
+        commands = (phase or {}).get("commands")
+        if not isinstance(commands, list) or not all(isinstance(command, str) for command in commands):
+            raise BuildspecError(f"{source}: phase {name!r} must have a list of string commands")
+
+    env_variables = tree.get("env", {}).get("variables", {})
+    for name, value in env_variables.items():
+        if not isinstance(value, (str, int, float)) or isinstance(value, bool):
+            raise BuildspecError(f"{source}: environment variable {name} must be a string or number, got {value!r}")
+
+    cache_paths = tree.get("cache", {}).get("paths", [])
+    if not all(isinstance(path, str) for path in cache_paths):
+        raise BuildspecError(f"{source}: cache paths must be strings")
+
+
+@lru_cache(maxsize=None)
+def load_buildspec(path: str) -> BuildspecTemplate:
+    '''
+        Reads and parses a buildspec template once per path.
+        args:
+            path: buildspec YAML file
+        returns:
+            BuildspecTemplate
+    '''
+    with open(path) as file:
+        tree = yaml.safe_load(file)
+    validate_buildspec(tree, path)
+
+    placeholders = frozenset(name for text in _walk_strings(tree) for name in PLACEHOLDER.findall(text))
+    unknown = placeholders - VARIABLE_TYPES.keys()
+    if unknown:
+        raise BuildspecError(f"{path}: unknown buildspec variables {sorted(unknown)}")
+    return BuildspecTemplate(path=path, tree=tree, placeholders=placeholders)
+
+
+class _BuildspecDumper(yaml.SafeDumper):
+    pass
+
+
+# Multi-line commands (shell blocks) are written back as literal block scalars
+_BuildspecDumper.add_representer(str, lambda dumper, value: dumper.represent_scalar(
+    "tag:yaml.org,2002:str", value, style="|" if "\n" in value else None
+))
+
+
+@lru_cache(maxsize=None)
+def _render(template: BuildspecTemplate, variables: tuple) -> str:
+    variables = dict(variables)
+
+    missing = template.placeholders - variables.keys()
+    if missing:
+        raise BuildspecError(f"{template.path}: missing buildspec variables {sorted(missing)}")
+    for name, value in variables.items():
+        if name not in VARIABLE_TYPES:
+            raise BuildspecError(f"{template.path}: unknown buildspec variable {name}")
+        if not isinstance(value, VARIABLE_TYPES[name]) or isinstance(value, bool):
+            raise BuildspecError(f"{template.path}: {name} must be {VARIABLE_TYPES[name].__name__}, got {value!r}")
+
+    rendered = _substitute(template.tree, variables)
+    validate_buildspec(rendered, template.path)
+    return yaml.dump(rendered, Dumper=_BuildspecDumper, sort_keys=False, width=1000)
@@ -11,12 +11,16 @@ from aws_cdk import (
 )
 from constructs import Construct
 import os
+import json
 import boto3
 
+from training_pipeline.buildspec import BuildspecTemplate
+from training_pipeline.stages import ARCHITECTURES, PIPELINE, image_stages
+
 
 class CICDStack(Stack):
 
-    def __init__(self, scope: Construct, construct_id: str, buildspec_yml_build: str, buildspec_yml_factory: str, buildspec_yml_deploy: str, buildspec_yml_prod_factory: str, **kwargs) -> None:
+    def __init__(self, scope: Construct, construct_id: str, buildspec_yml_build: BuildspecTemplate, buildspec_yml_factory: BuildspecTemplate, buildspec_yml_deploy: BuildspecTemplate, buildspec_yml_prod_factory: BuildspecTemplate, **kwargs) -> None:
         super().__init__(scope, construct_id, **kwargs)
         
         cdk_repo = self.node.try_get_context("cdk_repo")
@@ -24,6 +28,7 @@ class CICDStack(Stack):
         project = self.node.try_get_context("project")
         account_id = self.node.try_get_context("account_id")
         region = self.node.try_get_context("region")
+        prod_account_id = self.node.try_get_context("prod_account_id")
         
         if account_id == "test_account_id":
             environment = "test"
@@ -32,6 +37,23 @@ class CICDStack(Stack):
         else:
             print("Unknown AWS account")
         
+        # CodeBuild host architecture; images for the other architecture are built under QEMU emulation
+        build_architecture = self.node.try_get_context("build_architecture") or "x86_64"
+        
+        if build_architecture == "arm64":
+            build_image = "aws/codebuild/amazonlinux2-aarch64-standard:2.0"
+            build_container_type = "ARM_CONTAINER"
+        else:
+            build_image = "aws/codebuild/amazonlinux2-x86_64-standard:2.0"
+            build_container_type = "LINUX_CONTAINER"
+        
+        # Docker layers and the source checkout stay on the build host between builds; the custom cache keeps
+        # the paths listed under cache: in each buildspec (pip wheels, npm packages)
+        build_cache = codebuild.CfnProject.ProjectCacheProperty(
+            type="LOCAL",
+            modes=["LOCAL_DOCKER_LAYER_CACHE", "LOCAL_SOURCE_CACHE", "LOCAL_CUSTOM_CACHE"]
+        )
+        
         
         # ********************************************************************************
         # S3 Bucket
@@ -252,19 +274,31 @@ class CICDStack(Stack):
         # 2x CodeBuild (CI/CD two-part build stage)
         # ********************************************************************************
         
-        def set_buildspec_env_variables(buildspec: str, account_id: str, region: str, repo: str, bucket: str, project: str) -> str:
+        # Image build settings exposed to the buildspecs
+        image_architectures = self.node.try_get_context("image_architectures") or " ".join(ARCHITECTURES)
+        wheel_cache_prefix = self.node.try_get_context("wheel_cache_prefix") or "build-cache/pip-wheels"
+        
+        def set_buildspec_env_variables(buildspec: BuildspecTemplate, bucket: str) -> str:
             '''
+                Render a buildspec template with this stack's variables; rendered output is cached per template and variables.
+                args:
+                    buildspec: template loaded by app.py
+                    bucket: project bucket the build reads and writes (test or prod)
             '''
-            buildspec = buildspec.replace("aws_account_value", account_id)
-            buildspec = buildspec.replace("aws_region_value", region)
-            buildspec = buildspec.replace("repo_name", repo)
-            buildspec = buildspec.replace("bucket_name", bucket)
-            buildspec = buildspec.replace("project_name", project)
-            buildspec = buildspec.replace("prod_aws_account", prod_account_id)
-            return buildspec
+            return buildspec.render(
+                aws_account=account_id,
+                aws_region=region,
+                repo=repo,
+                bucket=bucket,
+                project=project,
+                prod_aws_account=prod_account_id,
+                stages=" ".join(stage.name for stage in image_stages(PIPELINE)),
+                architectures=image_architectures,
+                wheel_cache_prefix=wheel_cache_prefix
+            )
             
         
-        buildspec_build = set_buildspec_env_variables(buildspec_yml_build, account_id, region, repo, s3_bucket.bucket_name, project)
+        buildspec_build = set_buildspec_env_variables(buildspec_yml_build, s3_bucket.bucket_name)
         
         codebuild_build = codebuild.CfnProject(self, "BuildCodeBuild", 
             artifacts=codebuild.CfnProject.ArtifactsProperty(
@@ -272,11 +306,12 @@ class CICDStack(Stack):
             ), 
             environment=codebuild.CfnProject.EnvironmentProperty(
                 compute_type="BUILD_GENERAL1_SMALL", 
-                image="aws/codebuild/amazonlinux2-x86_64-standard:2.0", 
-                type="LINUX_CONTAINER",
+                image=build_image, 
+                type=build_container_type,
                 image_pull_credentials_type="CODEBUILD", 
                 privileged_mode=True
             ), 
+            cache=build_cache,
             service_role=ci_cd_iam_role.attr_arn, 
             source=codebuild.CfnProject.SourceProperty(
                 type="CODEPIPELINE",
@@ -313,7 +348,7 @@ class CICDStack(Stack):
         codebuild_build.cfn_options.condition = deploy_condition
         codebuild_build.add_depends_on(ci_cd_iam_role)
         
-        buildspec_factory = set_buildspec_env_variables(buildspec_yml_factory, account_id, region, repo, s3_bucket.bucket_name, project)
+        buildspec_factory = set_buildspec_env_variables(buildspec_yml_factory, s3_bucket.bucket_name)
         
         codebuild_factory = codebuild.CfnProject(self, "FactoryCodeBuild", 
             artifacts=codebuild.CfnProject.ArtifactsProperty(
@@ -321,11 +356,12 @@ class CICDStack(Stack):
             ), 
             environment=codebuild.CfnProject.EnvironmentProperty(
                 compute_type="BUILD_GENERAL1_SMALL", 
-                image="aws/codebuild/amazonlinux2-x86_64-standard:2.0", 
-                type="LINUX_CONTAINER",
+                image=build_image, 
+                type=build_container_type,
                 image_pull_credentials_type="CODEBUILD", 
                 privileged_mode=True
             ), 
+            cache=build_cache,
             service_role=ci_cd_iam_role.attr_arn, 
             source=codebuild.CfnProject.SourceProperty(
                 type="CODEPIPELINE",
@@ -365,7 +401,7 @@ class CICDStack(Stack):
         # 2x CodeBuild CI/CD cross-account Deploy stage
         # ********************************************************************************
         
-        buildspec_prod_build = set_buildspec_env_variables(buildspec_yml_deploy, account_id, region, repo, f"pr-prod-{project}-bucket", project)
+        buildspec_prod_build = set_buildspec_env_variables(buildspec_yml_deploy, f"pr-prod-{project}-bucket")
         
         codebuild_prod_build = codebuild.CfnProject(self, "DeployCodeBuild", 
             artifacts=codebuild.CfnProject.ArtifactsProperty(
@@ -373,11 +409,12 @@ class CICDStack(Stack):
             ), 
             environment=codebuild.CfnProject.EnvironmentProperty(
                 compute_type="BUILD_GENERAL1_SMALL", 
-                image="aws/codebuild/amazonlinux2-x86_64-standard:2.0", 
-                type="LINUX_CONTAINER",
+                image=build_image, 
+                type=build_container_type,
                 image_pull_credentials_type="CODEBUILD", 
                 privileged_mode=True
             ), 
+            cache=build_cache,
             service_role=ci_cd_iam_role.attr_arn, 
             source=codebuild.CfnProject.SourceProperty(
                 type="CODEPIPELINE",
@@ -414,7 +451,7 @@ class CICDStack(Stack):
         codebuild_prod_build.cfn_options.condition = deploy_condition
         codebuild_prod_build.add_depends_on(ci_cd_iam_role)
         
-        buildspec_prod_factory = set_buildspec_env_variables(buildspec_yml_prod_factory, account_id, region, repo, f"pr-prod-{project}-bucket", project)
+        buildspec_prod_factory = set_buildspec_env_variables(buildspec_yml_prod_factory, f"pr-prod-{project}-bucket")
         
         codebuild_prod_factory = codebuild.CfnProject(self, "ProdFactoryCodeBuild", 
             artifacts=codebuild.CfnProject.ArtifactsProperty(
@@ -422,11 +459,12 @@ class CICDStack(Stack):
             ), 
             environment=codebuild.CfnProject.EnvironmentProperty(
                 compute_type="BUILD_GENERAL1_SMALL", 
-                image="aws/codebuild/amazonlinux2-x86_64-standard:2.0", 
-                type="LINUX_CONTAINER",
+                image=build_image, 
+                type=build_container_type,
                 image_pull_credentials_type="CODEBUILD", 
                 privileged_mode=True
             ), 
+            cache=build_cache,
             service_role=ci_cd_iam_role.attr_arn, 
             source=codebuild.CfnProject.SourceProperty(
                 type="CODEPIPELINE",
@@ -462,6 +500,49 @@ class CICDStack(Stack):
         codebuild_prod_factory.cfn_options.condition = deploy_condition
         codebuild_prod_factory.add_depends_on(codebuild_policy)
         
+        # ********************************************************************************
+        # Image Build Actions (one per pipeline stage, run in parallel)
+        # ********************************************************************************
+        
+        def image_build_actions(project_name: str, action_prefix: str, artifact_prefix: str) -> list:
+            '''
+                One CodeBuild action per stage image, all with the same run_order so CodePipeline runs them in parallel.
+                Every action runs the same project with STAGES overridden to its stage.
+                args:
+                    project_name: CodeBuild project that builds the images
+                    action_prefix: action name prefix, followed by the stage name
+                    artifact_prefix: output artifact name prefix, followed by the stage name
+            '''
+            return [
+                codepipeline.CfnPipeline.ActionDeclarationProperty(
+                    action_type_id=codepipeline.CfnPipeline.ActionTypeIdProperty(
+                        category="Build", 
+                        owner="AWS", 
+                        provider="CodeBuild", 
+                        version="1"
+                    ), 
+                    name=f"{action_prefix}-{stage.name}", 
+                    configuration={
+                        "ProjectName": project_name,
+                        "EnvironmentVariables": json.dumps([
+                            {"name": "STAGES", "value": stage.name, "type": "PLAINTEXT"}
+                        ])
+                    }, 
+                    input_artifacts=[
+                        codepipeline.CfnPipeline.InputArtifactProperty(name="SourceArtifact")
+                    ],
+                    output_artifacts=[
+                        codepipeline.CfnPipeline.OutputArtifactProperty(name=f"{artifact_prefix}-{stage.name}")
+                    ], 
+                    region=region,
+                    run_order=1
+                )
+                for stage in image_stages(PIPELINE)
+            ]
+        
+        image_build_actions_test = image_build_actions(codebuild_build.name, "Build", "BuildArtifact")
+        image_build_actions_prod = image_build_actions(codebuild_prod_build.name, "Prod-Build", "ProdBuildArtifact")
+        
         # ********************************************************************************
         # CodePipeline (CI/CD orchestrator) & IAM Inline Policy
         # ********************************************************************************
@@ -565,26 +646,7 @@ class CICDStack(Stack):
                 ),
                 codepipeline.CfnPipeline.StageDeclarationProperty(
                     actions=[
-                        codepipeline.CfnPipeline.ActionDeclarationProperty(
-                            action_type_id=codepipeline.CfnPipeline.ActionTypeIdProperty(
-                                category="Build", 
-                                owner="AWS", 
-                                provider="CodeBuild", 
-                                version="1"
-                            ), 
-                            name="Build", 
-                            configuration={
-                                "ProjectName": codebuild_build.name
-                            }, 
-                            input_artifacts=[
-                                codepipeline.CfnPipeline.InputArtifactProperty(name="SourceArtifact")
-                            ],
-                            output_artifacts=[
-                                codepipeline.CfnPipeline.OutputArtifactProperty(name="BuildArtifact")
-                            ], 
-                            region=region,
-                            run_order=1
-                        ),
+                        *image_build_actions_test,
                         codepipeline.CfnPipeline.ActionDeclarationProperty(
                             action_type_id=codepipeline.CfnPipeline.ActionTypeIdProperty(
                                 category="Build", 
@@ -636,26 +698,7 @@ class CICDStack(Stack):
                 ),
                 codepipeline.CfnPipeline.StageDeclarationProperty(
                     actions=[
-                        codepipeline.CfnPipeline.ActionDeclarationProperty(
-                            action_type_id=codepipeline.CfnPipeline.ActionTypeIdProperty(
-                                category="Build", 
-                                owner="AWS", 
-                                provider="CodeBuild", 
-                                version="1"
-                            ), 
-                            name="Prod-Build", 
-                            configuration={
-                                "ProjectName": codebuild_prod_build.name
-                            }, 
-                            input_artifacts=[
-                                codepipeline.CfnPipeline.InputArtifactProperty(name="SourceArtifact")
-                            ],
-                            output_artifacts=[
-                                codepipeline.CfnPipeline.OutputArtifactProperty(name="ProdBuildArtifact")
-                            ], 
-                            region=region,
-                            run_order=1
-                        ),
+                        *image_build_actions_prod,
                         codepipeline.CfnPipeline.ActionDeclarationProperty(
                             action_type_id=codepipeline.CfnPipeline.ActionTypeIdProperty(
                                 category="Build", 
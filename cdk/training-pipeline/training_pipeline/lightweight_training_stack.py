@@ -7,11 +7,58 @@ from aws_cdk import (
     aws_iam as iam,
     aws_stepfunctions as sf,
     aws_lambda as lambda_,
-    aws_logs as logs
+    aws_logs as logs,
+    aws_events as events,
+    aws_dynamodb as dynamodb
 )
 from constructs import Construct
 import os
+import json
 import boto3
+from dataclasses import replace
+
+from training_pipeline.stages import (
+    PIPELINE, DEPLOYMENT_STAGE, LINEAGE_STAGE, LEASE_STAGE, StageSpec, iter_stages, fused_stage, build_definition, load_tuning, apply_tuning, use_inline_handoff,
+    use_distributed_training
+)
+
+
+# Inline code of the run parameters Lambda, the first state of the training pipeline. RunId is a ULID (48-bit
+# millisecond timestamp and 80 random bits in Crockford base32): unique across any number of concurrent executions,
+# and run IDs (and registry versions) sort by start time. An execution input with Resume {"RunId", "RunDate"}
+# executes that run again: stages it already completed return their checkpointed results, so it resumes from the
+# first incomplete stage. Runs whose DatasetRows (or Generator Rows) are at or under FUSED_ROW_LIMIT run fused.
+RUN_PARAMETERS_CODE = """\
+import os
+import time
+import datetime
+import json
+
+
+def new_run_id():
+    value = (int(time.time() * 1000) << 80) | int.from_bytes(os.urandom(10), "big")
+    return "".join("0123456789ABCDEFGHJKMNPQRSTVWXYZ"[(value >> shift) & 31] for shift in range(125, -5, -5))
+
+
+def lambda_handler(event, context):
+    event = event if isinstance(event, dict) else {}
+    resume = event.get("Resume") or {}
+    generator = event.get("Generator")
+    rows = event.get("DatasetRows") or (generator or {}).get("Rows")
+    fused_row_limit = int(os.environ["FUSED_ROW_LIMIT"])
+    mode = "fused" if rows is not None and 0 < fused_row_limit and int(rows) <= fused_row_limit else "split"
+    run_parameters = {
+        "RunId": resume.get("RunId") or new_run_id(),
+        "RunDate": resume.get("RunDate") or str(datetime.datetime.today().date()),
+        "Environment": os.environ["ENVIRONMENT"],
+        "Project": os.environ["PROJECT"],
+        "DatasetRows": rows,
+        "ExecutionMode": mode,
+        "TrainingSince": event.get("TrainingSince"),
+        "Generator": generator
+    }
+    return json.dumps(run_parameters)
+"""
 
 
 class LightweightTrainingStack(Stack):
@@ -32,6 +79,39 @@ class LightweightTrainingStack(Stack):
             print("Unknown AWS account")
         
         
+        # ********************************************************************************
+        # Run Lease Table
+        # ********************************************************************************
+        
+        # One item per held run slot of the project (lambda/data-preparation/lambda/leases.py); expired leases are
+        # also removed by DynamoDB TTL
+        lease_table = dynamodb.CfnTable(self, "RunLeaseTable", 
+            table_name=f"pr-{environment}-{project}-run-leases", 
+            key_schema=[
+                dynamodb.CfnTable.KeySchemaProperty(attribute_name="Project", key_type="HASH"),
+                dynamodb.CfnTable.KeySchemaProperty(attribute_name="Slot", key_type="RANGE")
+            ], 
+            attribute_definitions=[
+                dynamodb.CfnTable.AttributeDefinitionProperty(attribute_name="Project", attribute_type="S"),
+                dynamodb.CfnTable.AttributeDefinitionProperty(attribute_name="Slot", attribute_type="N")
+            ], 
+            billing_mode="PAY_PER_REQUEST", 
+            time_to_live_specification=dynamodb.CfnTable.TimeToLiveSpecificationProperty(
+                attribute_name="ExpiresAt",
+                enabled=True
+            ), 
+            tags=[
+                CfnTag(
+                    key="Environment",
+                    value=environment
+                ),
+                CfnTag(
+                    key="Project",
+                    value=project
+                )
+            ]
+        )
+        
         # ********************************************************************************
         # Lambda IAM Role & Policy
         # ********************************************************************************
@@ -54,6 +134,17 @@ class LightweightTrainingStack(Stack):
                             f"arn:aws:s3:::pr-{environment}-{project}-bucket",
                             f"arn:aws:s3:::pr-{environment}-{project}-bucket/*"
                         ]
+                    },
+                    {
+                        "Effect": "Allow",
+                        "Action": [
+                            "dynamodb:Query",
+                            "dynamodb:PutItem",
+                            "dynamodb:DeleteItem"
+                        ],
+                        "Resource": [
+                            lease_table.attr_arn
+                        ]
                     }
                 ]
             }, 
@@ -61,6 +152,8 @@ class LightweightTrainingStack(Stack):
             managed_policy_name=f"pr-{environment}-{project}-lambda-policy"
         )
         
+        lambda_policy.add_depends_on(lease_table)
+        
         lambda_iam_role = iam.CfnRole(self, "LambdaRole", 
             assume_role_policy_document={
               "Version": "2012-10-17",
@@ -95,17 +188,25 @@ class LightweightTrainingStack(Stack):
         
         lambda_iam_role.add_depends_on(lambda_policy)
         
-        inline_string = '''import uuid\nimport datetime\nimport json\ndef lambda_handler(event, context):\n    RunParameters = { 'RunId': str(uuid.uuid4())[:8], 'RunDate': str(datetime.datetime.today().date()), 'Environment': 'environment_name', 'Project': 'project_name' }\n    return json.dumps(RunParameters)'''
-        inline_string = inline_string.replace("environment_name", environment)
-        inline_string = inline_string.replace("project_name", project)
+        # Runs whose execution input gives DatasetRows (or Generator Rows, for synthetic load-test data) at or
+        # under this limit run as the single-process fused pipeline instead of the split stages; 0 disables it
+        fused_row_limit = self.node.try_get_context("fused_row_limit")
+        fused_row_limit = 100000 if fused_row_limit is None else int(fused_row_limit)
         
         sf_init_lambda = lambda_.CfnFunction(self, "SFInitLambda", 
             code=lambda_.CfnFunction.CodeProperty(
-                zip_file=inline_string
+                zip_file=RUN_PARAMETERS_CODE
             ), 
             role=lambda_iam_role.attr_arn, 
-            architectures=["x86_64"],
+            architectures=["arm64"],
             description="Lambda function to initialize training pipeline run parameters to maintain Step Function state", 
+            environment=lambda_.CfnFunction.EnvironmentProperty(
+                variables={
+                    "ENVIRONMENT": environment,
+                    "PROJECT": project,
+                    "FUSED_ROW_LIMIT": str(fused_row_limit)
+                }
+            ),
             function_name=f"pr-{environment}-{project}-run-parameters-lambda", 
             handler="index.lambda_handler",
             memory_size=128, 
@@ -127,113 +228,160 @@ class LightweightTrainingStack(Stack):
         sf_init_lambda.add_depends_on(lambda_iam_role)
         
         # ********************************************************************************
-        # Data Preparation Lambda Function
+        # Pipeline Stage Lambda Functions (generated from the stage registry)
         # ********************************************************************************
         
-        def get_latest_image_uri(lambda_order: int) -> str:
+        def get_latest_image_uri(tag_prefix: str) -> str:
             '''
-                Return the latest ECR image URI for a Lambda function.
+                Return the most recently pushed ECR image URI for a Lambda function and architecture.
+                Only used for stages that have no image manifest yet.
                 args:
-                    lambda_order: Lambda build sequence order according to buildspec
+                    tag_prefix: image tag prefix, <stage>-lambda-<architecture>, according to buildspec
             '''
-            search_expr = f"sort_by(imageDetails, &to_string(imagePushedAt))[{lambda_order}].imageTags"
-           
             filter_iterator = boto3.client('ecr')\
                 .get_paginator('describe_images')\
                 .paginate(repositoryName=f"pr-{environment}-{project}-ecr-repo")\
-                .search(search_expr)
-               
-            image_uri = f"{account_id}.dkr.ecr.{region}.amazonaws.com/pr-{environment}-{project}-ecr-repo:{list(filter_iterator)[0]}"
+                .search(f"imageDetails[?imageTags && starts_with(imageTags[0], '{tag_prefix}-')]")
+            
+            latest_image = max(filter_iterator, key=lambda image: image["imagePushedAt"])
+            image_uri = f"{account_id}.dkr.ecr.{region}.amazonaws.com/pr-{environment}-{project}-ecr-repo:{latest_image['imageTags'][0]}"
             return image_uri
         
-        assert "data-preparation-lambda" in get_latest_image_uri(-3)
-        assert "model-training-lambda" in get_latest_image_uri(-2)
-        assert "model-evaluation-lambda" in get_latest_image_uri(-1)
+        def get_image_uri(stage: StageSpec) -> str:
+            '''
+                Return the ECR image URI for a Lambda function and architecture from the image manifest written by the build
+                stage, so images are resolved by content hash tag rather than by push order.
+                args:
+                    stage: StageSpec of the pipeline stage; its architecture selects the image
+            '''
+            s3_client = boto3.client('s3')
+            try:
+                manifest = json.loads(s3_client.get_object(
+                    Bucket=f"pr-{environment}-{project}-bucket", 
+                    Key=f"build/image-manifest/{stage.image_name}.json"
+                )["Body"].read())
+            except s3_client.exceptions.NoSuchKey:
+                print(f"No image manifest for {stage.image_name}, falling back to the most recently pushed image")
+                return get_latest_image_uri(stage.image_tag_prefix)
+            
+            image_uri = f"{account_id}.dkr.ecr.{region}.amazonaws.com/pr-{environment}-{project}-ecr-repo:{manifest['images'][stage.architecture]}"
+            return image_uri
         
+        # training_workers > 0 trains data-parallel: one worker Lambda per training data shard, tree-reduced
+        training_workers = int(self.node.try_get_context("training_workers") or 0)
+        pipeline = use_distributed_training(PIPELINE, training_workers) if training_workers > 0 else PIPELINE
         
-        data_preparation_lambda = lambda_.CfnFunction(self, "DataPreparationLambda", 
-            code=lambda_.CfnFunction.CodeProperty(
-                image_uri=get_latest_image_uri(-3)
-            ), 
-            role=lambda_iam_role.attr_arn, 
-            architectures=["x86_64"],
-            description="Lambda function to extract, validate, and load small datasets", 
-            function_name=f"pr-{environment}-{project}-data-preparation-lambda",
-            memory_size=512, 
-            package_type="Image",
-            tags=[
-                CfnTag(
-                    key="Environment",
-                    value=environment
-                ),
-                CfnTag(
-                    key="Project",
-                    value=project
-                )
-            ], 
-            timeout=180
-        )
+        # Memory/timeout recommendations from tools/power_tuning.py override the registry defaults;
+        # the architecture context switches every stage between x86_64 and arm64 (Graviton)
+        tuning = load_tuning(self.node.try_get_context("stage_tuning") or "stage-tuning.json")
+        pipeline = apply_tuning(pipeline, tuning, self.node.try_get_context("architecture"))
+        fused = apply_tuning([fused_stage(PIPELINE)], tuning, self.node.try_get_context("architecture"))[0] if fused_row_limit > 0 else None
         
-        data_preparation_lambda.add_depends_on(lambda_iam_role)
+        # EXPRESS runs the pipeline as an Express state machine that hands small datasets from stage to stage
+        # inline in the state instead of through S3; larger datasets still fall back to S3
+        state_machine_type = self.node.try_get_context("state_machine_type") or "STANDARD"
+        if state_machine_type not in ("STANDARD", "EXPRESS"):
+            raise ValueError(f"Unsupported state machine type: {state_machine_type}")
+        if state_machine_type == "EXPRESS":
+            pipeline = use_inline_handoff(pipeline, int(self.node.try_get_context("inline_dataset_limit") or 65536))
         
+        # npy hands datasets between stages through S3 as raw .npy files, read without parsing or extra copies
+        dataset_format = self.node.try_get_context("dataset_format") or "csv"
+        if dataset_format not in ("csv", "npy"):
+            raise ValueError(f"Unsupported dataset format: {dataset_format}")
         
-        # ********************************************************************************
-        # Model Training Lambda Function
-        # ********************************************************************************
+        # Caps the concurrent executions of the project; every execution holds a run slot for its whole duration,
+        # and the lease lifetime is also the state machine timeout (Express executions end after 5 minutes)
+        lease_seconds = self.node.try_get_context("run_lease_seconds") or (300 if state_machine_type == "EXPRESS" else None)
+        lease = apply_tuning([LEASE_STAGE], tuning, self.node.try_get_context("architecture"))[0]
+        lease = replace(lease, environment={
+            **lease.environment,
+            "LEASE_TABLE": lease_table.ref,
+            **({"MAX_CONCURRENT_RUNS": str(self.node.try_get_context("max_concurrent_runs"))} if self.node.try_get_context("max_concurrent_runs") else {}),
+            **({"LEASE_SECONDS": str(lease_seconds)} if lease_seconds else {})
+        })
         
-        model_training_lambda = lambda_.CfnFunction(self, "ModelTrainingLambda", 
-            code=lambda_.CfnFunction.CodeProperty(
-                image_uri=get_latest_image_uri(-2)
-            ), 
-            role=lambda_iam_role.attr_arn, 
-            architectures=["x86_64"],
-            description="Lambda function to train simple models", 
-            function_name=f"pr-{environment}-{project}-model-training-lambda",
-            memory_size=512, 
-            package_type="Image",
-            tags=[
-                CfnTag(
-                    key="Environment",
-                    value=environment
-                ),
-                CfnTag(
-                    key="Project",
-                    value=project
-                )
-            ], 
-            timeout=180
-        )
+        stages = list(iter_stages(pipeline)) + ([fused] if fused else []) + [lease]
+        stage_lambdas = {}
         
-        model_training_lambda.add_depends_on(lambda_iam_role)
+        # The inference router is created with the stage Lambdas but is not invoked by the state machine
+        deployment = apply_tuning([DEPLOYMENT_STAGE], tuning, self.node.try_get_context("architecture"))[0]
+        deployment = replace(deployment, environment={**deployment.environment, "ENVIRONMENT": environment, "PROJECT": project})
+        
+        # The lineage compaction/query function is also created outside the state machine, run on a schedule
+        lineage = apply_tuning([LINEAGE_STAGE], tuning, self.node.try_get_context("architecture"))[0]
+        lineage = replace(lineage, environment={**lineage.environment, "ENVIRONMENT": environment, "PROJECT": project})
+        
+        for stage in stages + [deployment, lineage]:
+            image_uri = get_image_uri(stage)
+            
+            stage_lambda = lambda_.CfnFunction(self, stage.construct_id, 
+                code=lambda_.CfnFunction.CodeProperty(
+                    image_uri=image_uri
+                ), 
+                role=lambda_iam_role.attr_arn, 
+                architectures=[stage.architecture],
+                description=stage.description, 
+                environment=lambda_.CfnFunction.EnvironmentProperty(
+                    variables={
+                        **stage.environment,
+                        **({"INLINE_DATASET_LIMIT": str(stage.inline_dataset_limit)} if stage.inline_dataset_limit else {}),
+                        **({"DATASET_FORMAT": dataset_format} if dataset_format != "csv" else {}),
+                        # Recorded in the stage's lineage records; the content hash tag identifies the image
+                        "IMAGE_URI": image_uri
+                    }
+                ),
+                function_name=f"pr-{environment}-{project}-{stage.name}-lambda",
+                image_config=lambda_.CfnFunction.ImageConfigProperty(
+                    command=[stage.handler]
+                ) if stage.handler else None,
+                memory_size=stage.memory_size, 
+                package_type="Image",
+                reserved_concurrent_executions=stage.reserved_concurrency,
+                tags=[
+                    CfnTag(
+                        key="Environment",
+                        value=environment
+                    ),
+                    CfnTag(
+                        key="Project",
+                        value=project
+                    )
+                ], 
+                timeout=stage.timeout
+            )
+            
+            stage_lambda.add_depends_on(lambda_iam_role)
+            stage_lambdas[stage.name] = stage_lambda
         
         # ********************************************************************************
-        # Model Evaluation Lambda Function
+        # Lineage compaction schedule
         # ********************************************************************************
         
-        model_evaluation_lambda = lambda_.CfnFunction(self, "ModelEvaluationLambda", 
-            code=lambda_.CfnFunction.CodeProperty(
-                image_uri=get_latest_image_uri(-1)
-            ), 
-            role=lambda_iam_role.attr_arn, 
-            architectures=["x86_64"],
-            description="Lambda function to evaluate simple models using small datasets", 
-            function_name=f"pr-{environment}-{project}-model-evaluation-lambda",
-            memory_size=512, 
-            package_type="Image",
-            tags=[
-                CfnTag(
-                    key="Environment",
-                    value=environment
-                ),
-                CfnTag(
-                    key="Project",
-                    value=project
+        # Folds the lineage records logged since the last compaction into the lineage table
+        lineage_rule = events.CfnRule(self, "LineageCompactionRule", 
+            name=f"pr-{environment}-{project}-lineage-compaction-rule", 
+            description=f"Compacts the {project} training pipeline lineage log", 
+            schedule_expression=self.node.try_get_context("lineage_compaction_schedule") or "rate(1 hour)", 
+            state="ENABLED", 
+            targets=[
+                events.CfnRule.TargetProperty(
+                    arn=stage_lambdas[lineage.name].attr_arn, 
+                    id="LineageCompaction"
                 )
-            ], 
-            timeout=180
+            ]
         )
         
-        model_evaluation_lambda.add_depends_on(lambda_iam_role)
+        lineage_rule.add_depends_on(stage_lambdas[lineage.name])
+        
+        lineage_permission = lambda_.CfnPermission(self, "LineageCompactionPermission", 
+            action="lambda:InvokeFunction", 
+            function_name=stage_lambdas[lineage.name].attr_arn, 
+            principal="events.amazonaws.com", 
+            source_arn=lineage_rule.attr_arn
+        )
+        
+        lineage_permission.add_depends_on(lineage_rule)
         
         # ********************************************************************************
         # Step Function State Machine, Log Group, & IAM Role/Policy
@@ -265,13 +413,11 @@ class LightweightTrainingStack(Stack):
                         ],
                         "Resource": [
                             sf_init_lambda.attr_arn,
-                            f"{sf_init_lambda.attr_arn}:*",
-                            data_preparation_lambda.attr_arn,
-                            f"{data_preparation_lambda.attr_arn}:*",
-                            model_training_lambda.attr_arn,
-                            f"{model_training_lambda.attr_arn}:*",
-                            model_evaluation_lambda.attr_arn,
-                            f"{model_evaluation_lambda.attr_arn}:*"
+                            f"{sf_init_lambda.attr_arn}:*"
+                        ] + [
+                            arn
+                            for stage in stages
+                            for arn in (stage_lambdas[stage.name].attr_arn, f"{stage_lambdas[stage.name].attr_arn}:*")
                         ]
                     },
                     {
@@ -305,9 +451,8 @@ class LightweightTrainingStack(Stack):
         )
         
         step_functions_policy.add_depends_on(sf_init_lambda)
-        step_functions_policy.add_depends_on(data_preparation_lambda)
-        step_functions_policy.add_depends_on(model_training_lambda)
-        step_functions_policy.add_depends_on(model_evaluation_lambda)
+        for stage in stages:
+            step_functions_policy.add_depends_on(stage_lambdas[stage.name])
         step_functions_policy.add_depends_on(sf_log_group)
         
         sf_iam_role = iam.CfnRole(self, "StepFunctionsRole", 
@@ -348,59 +493,10 @@ class LightweightTrainingStack(Stack):
         training_step_function = sf.CfnStateMachine(self, "TrainingStepFunction", 
             role_arn=sf_iam_role.attr_arn, 
             definition_string=Fn.sub(
-                body='''{
-                    "StartAt": "Create Run Parameters",
-                    "States": {
-                      "Create Run Parameters": {
-                        "Type": "Task",
-                        "Resource": "${init_lambda_arn}",
-                        "ResultPath": "$.RunParameters",
-                        "Next": "Data Preparation"
-                      },
-                      "Data Preparation": {
-                        "Type": "Task",
-                        "Resource": "arn:aws:states:::lambda:invoke",
-                        "Parameters": {
-                          "FunctionName": "${data_preparation_lambda_arn}",
-                            "Payload": {
-                              "Input.$": "$"
-                            }
-                        },
-                        "ResultPath": null,
-                        "Next": "Model Training"
-                      },
-                      "Model Training": {
-                        "Type": "Task",
-                        "Resource": "arn:aws:states:::lambda:invoke",
-                        "Parameters": {
-                          "FunctionName": "${model_training_lambda_arn}",
-                            "Payload": {
-                              "Input.$": "$"
-                            }
-                        },
-                        "ResultPath": null,
-                        "Next": "Model Evaluation"
-                      },
-                      "Model Evaluation": {
-                          "Type": "Task",
-                          "Resource": "arn:aws:states:::lambda:invoke",
-                          "Parameters": {
-                            "FunctionName": "${model_evaluation_lambda_arn}",
-                            "Payload": {
-                              "Input.$": "$"
-                            }
-                          },
-                          "End": true
-                      }
-                    }
-                } ''', 
+                body=build_definition(pipeline, fused, lease, state_machine_type), 
                 variables={
-                    "environment": environment,
-                    "project": project,
                     "init_lambda_arn": sf_init_lambda.attr_arn,
-                    "data_preparation_lambda_arn": data_preparation_lambda.attr_arn,
-                    "model_training_lambda_arn": model_training_lambda.attr_arn,
-                    "model_evaluation_lambda_arn": model_evaluation_lambda.attr_arn
+                    **{stage.arn_variable: stage_lambdas[stage.name].attr_arn for stage in stages}
                 }
             ),
             logging_configuration=sf.CfnStateMachine.LoggingConfigurationProperty(
@@ -415,7 +511,7 @@ class LightweightTrainingStack(Stack):
                 level="ALL"
             ), 
             state_machine_name=f"pr-{environment}-{project}-training-step-function", 
-            state_machine_type="STANDARD", 
+            state_machine_type=state_machine_type, 
             tags=[
                 sf.CfnStateMachine.TagsEntryProperty(
                     key="Environment",
@@ -429,9 +525,8 @@ class LightweightTrainingStack(Stack):
         )
         
         training_step_function.add_depends_on(sf_init_lambda)
-        training_step_function.add_depends_on(data_preparation_lambda)
-        training_step_function.add_depends_on(model_training_lambda)
-        training_step_function.add_depends_on(model_evaluation_lambda)
+        for stage_lambda in stage_lambdas.values():
+            training_step_function.add_depends_on(stage_lambda)
         training_step_function.add_depends_on(sf_log_group)
         training_step_function.add_depends_on(sf_iam_role)
     
@@ -0,0 +1,639 @@
+from dataclasses import dataclass, field, replace
+from typing import Dict, Iterator, List, Optional, Union
+import json
+import os
+
+
+ARCHITECTURES = ("x86_64", "arm64")
+
+
+# ********************************************************************************
+# Declarative stage registry for the training pipeline
+#
+# Every Lambda stage (and the way stages are chained by the Step Function) is described here once.
+# LightweightTrainingStack generates the Lambda functions, the IAM resource lists, and the ASL definition
+# from PIPELINE, so adding or tuning a stage does not require touching the stack itself.
+# ********************************************************************************
+
+
+@dataclass(frozen=True)
+class StageSpec:
+    '''
+        A single containerized Lambda stage of the training pipeline.
+
+        args:
+            name: stage folder under lambda/ (also used for the image tag prefix and function name)
+            state_name: Step Function state name
+            construct_id: CDK construct id of the Lambda function
+            description: Lambda function description
+            memory_size: Lambda memory in MB (CPU scales linearly with memory)
+            timeout: Lambda timeout in seconds
+            architecture: "x86_64" or "arm64" (Graviton); both variants of every image are built, this selects the runtime
+            reserved_concurrency: optional reserved concurrent executions for the function
+            items_path: when set, the stage fans out as a Map state over this JSONPath
+            max_concurrency: maximum concurrent Map iterations (0 means no limit)
+            environment: Lambda environment variables
+            inline_dataset_limit: datasets up to this many encoded bytes are handed to the next stage inline in the
+                                  state instead of through S3 (Express mode); 0 hands every dataset off through S3
+            image: stage folder whose image the function runs, when it is not the stage's own (defaults to name)
+            handler: image CMD override (module.function) for stages that run another handler of a shared image
+            result_path: when set, the stage's returned payload is kept in the state at this path (e.g. the
+                         items a later Map state fans out over) instead of being discarded
+    '''
+    name: str
+    state_name: str
+    construct_id: str
+    description: str
+    memory_size: int = 512
+    timeout: int = 180
+    architecture: str = "x86_64"
+    reserved_concurrency: Optional[int] = None
+    items_path: Optional[str] = None
+    max_concurrency: int = 0
+    environment: Dict[str, str] = field(default_factory=dict)
+    inline_dataset_limit: int = 0
+    image: Optional[str] = None
+    handler: Optional[str] = None
+    result_path: Optional[str] = None
+
+    @property
+    def image_name(self) -> str:
+        return self.image or self.name
+
+    @property
+    def image_tag_prefix(self) -> str:
+        return f"{self.image_name}-lambda-{self.architecture}"
+
+    @property
+    def arn_variable(self) -> str:
+        return f"{self.name.replace('-', '_')}_lambda_arn"
+
+
+@dataclass(frozen=True)
+class ParallelSpec:
+    '''
+        Runs several chains of steps concurrently; the pipeline continues once every branch has finished.
+
+        args:
+            state_name: Step Function state name
+            branches: list of step chains, each chain being a list of steps
+    '''
+    state_name: str
+    branches: List[List["Step"]] = field(default_factory=list)
+
+
+@dataclass(frozen=True)
+class GateSpec:
+    '''
+        Continues the pipeline only when a boolean in the state is true (e.g. a flag returned by an earlier stage
+        through its result_path); otherwise the execution ends successfully.
+
+        args:
+            state_name: Step Function state name of the Choice state
+            variable: JSONPath of the boolean
+            skipped_state_name: Step Function state name of the Succeed state reached when the gate is closed
+    '''
+    state_name: str
+    variable: str
+    skipped_state_name: str
+
+
+Step = Union[StageSpec, ParallelSpec, GateSpec]
+
+
+PIPELINE: List[Step] = [
+    StageSpec(
+        name="data-preparation",
+        state_name="Data Preparation",
+        construct_id="DataPreparationLambda",
+        description="Lambda function to extract, validate, and load small datasets",
+        architecture="arm64"
+    ),
+    StageSpec(
+        name="drift-detection",
+        state_name="Detect Data Drift",
+        construct_id="DriftDetectionLambda",
+        description="Lambda function to score inference data drift against the champion's training data",
+        architecture="arm64",
+        image="data-preparation",
+        handler="drift.lambda_handler",
+        result_path="$.Drift",
+        environment={
+            "PSI_THRESHOLD": "0.2",
+            "KS_THRESHOLD": "0.1",
+            "RETRAIN_POLICY": "drift"
+        }
+    ),
+    GateSpec(
+        state_name="Retrain Needed",
+        variable="$.Drift.Payload.RetrainNeeded",
+        skipped_state_name="No Retrain Needed"
+    ),
+    StageSpec(
+        name="feature-engineering",
+        state_name="Feature Engineering",
+        construct_id="FeatureEngineeringLambda",
+        description="Lambda function to fit and apply vectorized feature transforms",
+        architecture="arm64",
+        environment={
+            "FEATURE_CONFIG": json.dumps({
+                "dtype": "float64",
+                "transforms": [
+                    {"type": "scale"}
+                ]
+            })
+        }
+    ),
+    StageSpec(
+        name="model-training",
+        state_name="Model Training",
+        construct_id="ModelTrainingLambda",
+        description="Lambda function to train simple models",
+        architecture="arm64"
+    ),
+    StageSpec(
+        name="model-evaluation",
+        state_name="Model Evaluation",
+        construct_id="ModelEvaluationLambda",
+        description="Lambda function to evaluate simple models using small datasets",
+        architecture="arm64"
+    )
+]
+
+
+# Runs every stage of PIPELINE in one process with in-memory handoff (lambda/fused-pipeline); the state machine
+# selects it instead of the split stages when the run's dataset is under the fused row limit
+FUSED_STAGE = StageSpec(
+    name="fused-pipeline",
+    state_name="Fused Pipeline",
+    construct_id="FusedPipelineLambda",
+    description="Lambda function to run data preparation, feature engineering, training, and evaluation in one process",
+    memory_size=1769,
+    timeout=600,
+    architecture="arm64"
+)
+
+
+# Inference router serving the registry champion and challenger rollouts (lambda/model-deployment); it is deployed
+# with the training pipeline but is not a state of the state machine
+DEPLOYMENT_STAGE = StageSpec(
+    name="model-deployment",
+    state_name="Model Deployment",
+    construct_id="ModelDeploymentLambda",
+    description="Lambda function to route inference requests between the champion and challenger models",
+    memory_size=1024,
+    timeout=30,
+    architecture="arm64"
+)
+
+
+# Compacts the lineage log into the columnar lineage table on a schedule and answers lineage queries
+# (lambda/common/lineage.py, shipped in the data-preparation image); it is deployed with the training pipeline but is
+# not a state of the state machine
+LINEAGE_STAGE = StageSpec(
+    name="lineage",
+    state_name="Lineage",
+    construct_id="LineageLambda",
+    description="Lambda function to compact and query the lineage and run-metadata store",
+    memory_size=1024,
+    timeout=300,
+    architecture="arm64",
+    image="data-preparation",
+    handler="lineage.lambda_handler"
+)
+
+
+# Claims the run's concurrency slot before the first stage and releases it after the last one
+# (lambda/data-preparation/lambda/leases.py)
+LEASE_STAGE = StageSpec(
+    name="run-lease",
+    state_name="Acquire Run Lease",
+    construct_id="RunLeaseLambda",
+    description="Lambda function to cap the concurrent training pipeline executions of the project",
+    memory_size=256,
+    timeout=30,
+    architecture="arm64",
+    image="data-preparation",
+    handler="leases.lambda_handler",
+    environment={
+        "MAX_CONCURRENT_RUNS": "10",
+        "LEASE_SECONDS": str(6 * 3600)
+    }
+)
+
+# Executions past the concurrency cap wait for a slot: the acquisition is retried with jittered exponential
+# backoff (capped at five minutes between attempts) for a few hours. Express executions retry at shorter
+# intervals. build_definition trims the attempts (lease_retry) so that the longest possible wait stays within
+# LEASE_WAIT_SHARE of the execution timeout: an execution that never gets a slot fails with LeaseUnavailable
+# instead of being timed out by Step Functions.
+LEASE_RETRY = {
+    "ErrorEquals": ["LeaseUnavailable"],
+    "IntervalSeconds": 30,
+    "BackoffRate": 1.5,
+    "MaxDelaySeconds": 300,
+    "MaxAttempts": 60,
+    "JitterStrategy": "FULL"
+}
+
+EXPRESS_LEASE_RETRY = {
+    **LEASE_RETRY,
+    "IntervalSeconds": 2,
+    "MaxDelaySeconds": 15
+}
+
+LEASE_WAIT_SHARE = 0.5
+
+# Longest duration of an Express execution
+EXPRESS_TIMEOUT_SECONDS = 300
+
+RELEASE_LEASE_STATE = "Release Run Lease"
+
+# Retries of a failed task, for transient errors only: Lambda service errors and throttles, throttled,
+# server-side and connection errors of AWS requests (raised as TransientAWSError by the stage handlers, see
+# lambda/<stage>/lambda/retries.py) and registry write contention. Backoff is exponential with full jitter, so
+# the stages of many executions failing together (e.g. an S3 throttle) do not retry in lockstep. Every other
+# error (AccessDenied, a missing object, a failed data contract, a function timeout) goes straight to the failure
+# catch. Stages are safe to run again: their keys are run-scoped, registry writes are conditional, and a stage
+# that had already completed returns its checkpointed result (checkpoints.py)
+TASK_RETRY = [
+    {
+        "ErrorEquals": [
+            "Lambda.ServiceException",
+            "Lambda.SdkClientException",
+            "Lambda.TooManyRequestsException",
+            "TransientAWSError",
+            "RegistryConflict"
+        ],
+        "IntervalSeconds": 2,
+        "BackoffRate": 2.0,
+        "MaxDelaySeconds": 60,
+        "MaxAttempts": 6,
+        "JitterStrategy": "FULL"
+    }
+]
+
+# A failed execution releases its run slot before it fails
+RELEASE_LEASE_AFTER_FAILURE_STATE = "Release Run Lease After Failure"
+FAILED_STATE = "Pipeline Failed"
+
+
+def retry_seconds(retrier: dict) -> float:
+    '''
+        Longest total wait of a retrier, every jittered delay drawn at its cap.
+    '''
+    return sum(
+        min(retrier["IntervalSeconds"] * retrier["BackoffRate"] ** attempt, retrier.get("MaxDelaySeconds", float("inf")))
+        for attempt in range(retrier["MaxAttempts"])
+    )
+
+
+def lease_retry(state_machine_type: str, timeout_seconds: int) -> dict:
+    '''
+        Retrier of the lease acquisition of a state machine, with as many attempts as fit in LEASE_WAIT_SHARE of
+        its execution timeout.
+
+        args:
+            state_machine_type: "STANDARD" or "EXPRESS"
+            timeout_seconds: execution timeout (the lease lifetime)
+        returns:
+            ASL retrier
+    '''
+    retrier = dict(EXPRESS_LEASE_RETRY if state_machine_type == "EXPRESS" else LEASE_RETRY)
+    while retrier["MaxAttempts"] > 1 and retry_seconds(retrier) > timeout_seconds * LEASE_WAIT_SHARE:
+        retrier["MaxAttempts"] -= 1
+    return retrier
+
+
+def iter_stages(steps: List[Step]) -> Iterator[StageSpec]:
+    '''
+        Yields every StageSpec in a pipeline definition, depth-first and in declaration order.
+    '''
+    for step in steps:
+        if isinstance(step, ParallelSpec):
+            for branch in step.branches:
+                yield from iter_stages(branch)
+        elif isinstance(step, StageSpec):
+            yield step
+
+
+def fused_stage(steps: List[Step]) -> StageSpec:
+    '''
+        The fused pipeline stage for a pipeline definition; it needs the environment of every stage it runs.
+    '''
+    environment = {}
+    for stage in iter_stages(steps):
+        environment.update(stage.environment)
+    return replace(FUSED_STAGE, environment=environment)
+
+
+def image_stages(steps: List[Step]) -> List[StageSpec]:
+    '''
+        Every stage with a container image of its own: the pipeline stages followed by the fused pipeline and the
+        inference router. Stages running another stage's image (image set) share that stage's build.
+    '''
+    stages = list(iter_stages(steps)) + [fused_stage(steps), DEPLOYMENT_STAGE]
+    return [stage for stage in stages if stage.image_name == stage.name]
+
+
+def _task_state(stage: StageSpec) -> dict:
+    task = {
+        "Type": "Task",
+        "Resource": "arn:aws:states:::lambda:invoke",
+        "Parameters": {
+            "FunctionName": f"${{{stage.arn_variable}}}",
+            "Payload": {
+                "Input.$": "$"
+            }
+        },
+        "Retry": TASK_RETRY
+    }
+    if stage.items_path is None:
+        return task
+
+    # Each Map iteration receives the run parameters plus the item it is responsible for
+    task["End"] = True
+    return {
+        "Type": "Map",
+        "ItemsPath": stage.items_path,
+        "MaxConcurrency": stage.max_concurrency,
+        "Parameters": {
+            "RunParameters.$": "$.RunParameters",
+            "Item.$": "$$.Map.Item.Value"
+        },
+        "Iterator": {
+            "StartAt": f"{stage.state_name} Item",
+            "States": {
+                f"{stage.state_name} Item": task
+            }
+        }
+    }
+
+
+def _chain_states(steps: List[Step], next_state: Optional[str], failure_state: Optional[str] = None) -> Dict[str, dict]:
+    '''
+        Generates the ASL states for a chain of steps, linking each step to the next one.
+        The last step transitions to next_state, or ends the chain when next_state is None. Errors left after
+        the retries of a step transition to failure_state when it is given, with the error at $.Error.
+    '''
+    states = {}
+    for index, step in enumerate(steps):
+        following = steps[index + 1].state_name if index + 1 < len(steps) else next_state
+
+        if isinstance(step, GateSpec):
+            # Only a true flag continues to the following step; ending the chain needs a state of its own
+            states[step.state_name] = {
+                "Type": "Choice",
+                "Choices": [
+                    {
+                        "Variable": step.variable,
+                        "BooleanEquals": True,
+                        "Next": following
+                    }
+                ],
+                "Default": step.skipped_state_name
+            }
+            states[step.skipped_state_name] = {"Type": "Succeed"} if next_state is None else {"Type": "Pass", "Next": next_state}
+            continue
+
+        if isinstance(step, ParallelSpec):
+            state = {
+                "Type": "Parallel",
+                "Branches": [
+                    {
+                        "StartAt": branch[0].state_name,
+                        "States": _chain_states(branch, None)
+                    }
+                    for branch in step.branches
+                ]
+            }
+        else:
+            state = _task_state(step)
+
+        if isinstance(step, StageSpec) and step.result_path is not None:
+            # The stage's output feeds later states (e.g. the items of a Map state)
+            state["ResultSelector"] = {"Payload.$": "$.Payload"}
+            state["ResultPath"] = step.result_path
+        elif isinstance(step, StageSpec) and step.inline_dataset_limit and step.items_path is None:
+            # The stage returns its dataset handoff (inline datasets and S3 pointers) for the stages that follow
+            state["ResultSelector"] = {"Datasets.$": "$.Payload.Datasets"}
+            state["ResultPath"] = "$.Handoff"
+        else:
+            # Stage outputs travel through S3, so the state is passed along unchanged
+            state["ResultPath"] = None
+        if failure_state is not None:
+            state["Catch"] = [{"ErrorEquals": ["States.ALL"], "ResultPath": "$.Error", "Next": failure_state}]
+        if following is None:
+            state["End"] = True
+        else:
+            state["Next"] = following
+        states[step.state_name] = state
+    return states
+
+
+def _lease_state(lease: StageSpec, action: str) -> dict:
+    return {
+        "Type": "Task",
+        "Resource": "arn:aws:states:::lambda:invoke",
+        "Parameters": {
+            "FunctionName": f"${{{lease.arn_variable}}}",
+            "Payload": {
+                "Action": action,
+                "Input.$": "$"
+            }
+        }
+    }
+
+
+def build_definition(steps: List[Step], fused: Optional[StageSpec] = None, lease: Optional[StageSpec] = None,
+                     state_machine_type: str = "STANDARD") -> str:
+    '''
+        Generates the Step Function ASL definition (an Fn.sub body) for the pipeline.
+        The run parameters Lambda always runs first; every stage Lambda ARN is left as a
+        ${<stage>_lambda_arn} variable to be substituted at deployment time.
+
+        args:
+            steps: pipeline definition (see PIPELINE)
+            fused: when given, runs this stage instead of the split stages for runs whose
+                   ExecutionMode run parameter is "fused"
+            lease: when given (see LEASE_STAGE), every execution holds one of the project's run slots from
+                   before the first stage to after the last one (or to its failure), and times out when its
+                   lease expires
+            state_machine_type: "STANDARD" or "EXPRESS"; Express executions retry the lease acquisition at
+                                shorter intervals, and their lease cannot outlive EXPRESS_TIMEOUT_SECONDS
+        returns:
+            ASL JSON string
+    '''
+    first = "Read Execution Mode" if fused else steps[0].state_name
+    states = {
+        "Create Run Parameters": {
+            "Type": "Task",
+            "Resource": "${init_lambda_arn}",
+            "ResultPath": "$.RunParameters",
+            "Retry": TASK_RETRY,
+            "Next": lease.state_name if lease else first
+        }
+    }
+    if lease:
+        timeout = int(lease.environment["LEASE_SECONDS"])
+        if state_machine_type == "EXPRESS" and timeout > EXPRESS_TIMEOUT_SECONDS:
+            raise ValueError(f"Express executions end after {EXPRESS_TIMEOUT_SECONDS} seconds, so their run lease cannot last {timeout} seconds")
+        states[lease.state_name] = {
+            **_lease_state(lease, "acquire"),
+            "ResultSelector": {"Payload.$": "$.Payload"},
+            "ResultPath": "$.Lease",
+            "Retry": [lease_retry(state_machine_type, timeout)] + TASK_RETRY,
+            "Next": first
+        }
+        states[RELEASE_LEASE_STATE] = {**_lease_state(lease, "release"), "Retry": TASK_RETRY, "ResultPath": None, "End": True}
+        states[RELEASE_LEASE_AFTER_FAILURE_STATE] = {
+            **_lease_state(lease, "release"),
+            "Retry": TASK_RETRY,
+            "ResultPath": None,
+            "Next": FAILED_STATE
+        }
+        states[FAILED_STATE] = {"Type": "Fail", "ErrorPath": "$.Error.Error", "CausePath": "$.Error.Cause"}
+    last = RELEASE_LEASE_STATE if lease else None
+    failure = RELEASE_LEASE_AFTER_FAILURE_STATE if lease else None
+    if fused:
+        # Run parameters are a JSON string, so they are parsed before the Choice state can read them
+        states["Read Execution Mode"] = {
+            "Type": "Pass",
+            "Parameters": {
+                "RunParameters.$": "States.StringToJson($.RunParameters)"
+            },
+            "ResultPath": "$.Parsed",
+            "Next": "Select Execution Mode"
+        }
+        states["Select Execution Mode"] = {
+            "Type": "Choice",
+            "Choices": [
+                {
+                    "Variable": "$.Parsed.RunParameters.ExecutionMode",
+                    "StringEquals": "fused",
+                    "Next": fused.state_name
+                }
+            ],
+            "Default": steps[0].state_name
+        }
+        states.update(_chain_states([fused], last, failure))
+    states.update(_chain_states(steps, last, failure))
+    definition = {"StartAt": "Create Run Parameters", "States": states}
+    if lease:
+        definition["TimeoutSeconds"] = timeout
+    return json.dumps(definition, indent=2)
+
+
+def use_inline_handoff(steps: List[Step], inline_dataset_limit: int) -> List[Step]:
+    '''
+        Returns a copy of the pipeline definition in which top-level task stages hand small datasets off inline.
+        Stages inside Parallel branches or Map states keep handing datasets off through S3, since their
+        results are not merged back into the state.
+
+        args:
+            steps: pipeline definition
+            inline_dataset_limit: maximum encoded size in bytes of an inline dataset
+        returns:
+            pipeline definition
+    '''
+    return [
+        replace(step, inline_dataset_limit=inline_dataset_limit)
+        if isinstance(step, StageSpec) and step.items_path is None else step
+        for step in steps
+    ]
+
+
+def use_distributed_training(steps: List[Step], workers: int) -> List[Step]:
+    '''
+        Returns a copy of the pipeline definition in which model training is data-parallel: a shard stage
+        partitions the training data in S3, a Map state reduces every partition to the triangular factor R of a
+        QR decomposition in its own worker Lambda, and a reduce stage tree-reduces the factors and solves the model.
+        All three run the model-training image (lambda/model-training/lambda/distributed.py).
+
+        args:
+            steps: pipeline definition
+            workers: number of training data shards, and of concurrent worker Lambdas
+        returns:
+            pipeline definition
+    '''
+    distributed = []
+    for step in steps:
+        if not (isinstance(step, StageSpec) and step.name == "model-training"):
+            distributed.append(step)
+            continue
+        distributed.extend([
+            replace(step,
+                name="model-training-shard",
+                state_name="Shard Training Data",
+                construct_id="ModelTrainingShardLambda",
+                description="Lambda function to partition training data into shards for distributed training",
+                image=step.image_name,
+                handler="distributed.shard_handler",
+                environment={**step.environment, "TRAINING_SHARDS": str(workers)},
+                result_path="$.Shards"
+            ),
+            replace(step,
+                name="model-training-worker",
+                state_name="Shard Statistics",
+                construct_id="ModelTrainingWorkerLambda",
+                description="Lambda function to compute the triangular factor of one training data shard",
+                image=step.image_name,
+                handler="distributed.worker_handler",
+                items_path="$.Shards.Payload.ShardIds",
+                max_concurrency=workers
+            ),
+            replace(step,
+                name="model-training-reduce",
+                state_name="Reduce Shard Statistics",
+                construct_id="ModelTrainingReduceLambda",
+                description="Lambda function to tree-reduce shard statistics and solve for the model coefficients",
+                image=step.image_name,
+                handler="distributed.reduce_handler"
+            )
+        ])
+    return distributed
+
+
+def load_tuning(path: str) -> Dict[str, dict]:
+    '''
+        Reads per-stage recommendations written by tools/power_tuning.py.
+
+        args:
+            path: stage-tuning.json path
+        returns:
+            {stage name: {"memory_size": int, "timeout": int, ...}}, empty when the file does not exist
+    '''
+    if not os.path.exists(path):
+        return {}
+    with open(path) as fp:
+        return json.load(fp)["stages"]
+
+
+def apply_tuning(steps: List[Step], tuning: Dict[str, dict], architecture: Optional[str] = None) -> List[Step]:
+    '''
+        Returns a copy of the pipeline definition with tuned values applied per stage.
+
+        args:
+            steps: pipeline definition
+            tuning: {stage name: {"memory_size": int, "timeout": int, "architecture": str}}, every key optional
+            architecture: when set, overrides the architecture of every stage that has no tuned architecture
+        returns:
+            tuned pipeline definition
+    '''
+    tuned = []
+    for step in steps:
+        if isinstance(step, ParallelSpec):
+            tuned.append(replace(step, branches=[apply_tuning(branch, tuning, architecture) for branch in step.branches]))
+            continue
+        if isinstance(step, GateSpec):
+            tuned.append(step)
+            continue
+
+        overrides = {"architecture": architecture} if architecture else {}
+        overrides.update({
+            key: value for key, value in tuning.get(step.name, {}).items()
+            if key in ("memory_size", "timeout", "architecture")
+        })
+        if overrides.get("architecture", step.architecture) not in ARCHITECTURES:
+            raise ValueError(f"Unsupported architecture for stage {step.name}: {overrides['architecture']}")
+        tuned.append(replace(step, **overrides))
+    return tuned
@@ -0,0 +1,77 @@
+import os
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+
+# *********************************************
+# Asyncio I/O backend
+#
+# boto3 calls block, so they run on a shared thread pool and are awaited from asyncio code: independent S3
+# requests run concurrently, and prefetch() keeps loading the next items of a blocking iterator (e.g. CSV
+# chunks streamed from S3) while the current item is validated, sketched, or scored. aiobotocore is not used:
+# it would add a second S3 client stack (aiohttp) to every image, and socket reads release the GIL anyway.
+#*********************************************
+
+# Threads shared by every blocking call awaited through to_thread
+IO_THREADS = int(os.environ.get("IO_THREADS", "16"))
+
+_EXECUTOR = None
+
+# Marks the end of an iterator in prefetch()
+_DONE = object()
+
+
+def executor() -> ThreadPoolExecutor:
+    global _EXECUTOR
+    if _EXECUTOR is None:
+        _EXECUTOR = ThreadPoolExecutor(max_workers=IO_THREADS, thread_name_prefix="io")
+    return _EXECUTOR
+
+
+async def to_thread(function, *args, **kwargs):
+    '''
+        Awaits a blocking call (e.g. a boto3 request) run on the I/O thread pool.
+    '''
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor(), functools.partial(function, *args, **kwargs))
+
+
+class _Failure:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+async def prefetch(iterator, depth: int = 2):
+    '''
+        Yields the items of a blocking iterator while up to depth further items load on the I/O thread pool.
+
+        args:
+            iterator: blocking iterator or iterable, advanced from one thread at a time
+            depth: items loaded ahead of the one being processed
+    '''
+    iterator = iter(iterator)
+    queue = asyncio.Queue(maxsize=depth)
+
+    async def produce():
+        while True:
+            try:
+                item = await to_thread(next, iterator, _DONE)
+            except Exception as error:
+                await queue.put(_Failure(error))
+                return
+            await queue.put(item)
+            if item is _DONE:
+                return
+
+    producer = asyncio.ensure_future(produce())
+    try:
+        while True:
+            item = await queue.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        producer.cancel()
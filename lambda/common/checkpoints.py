@@ -0,0 +1,140 @@
+import json
+import time
+from botocore.exceptions import ClientError
+
+from ranged import client
+
+
+# *********************************************
+# Stage checkpoints
+#
+# Every stage that completes writes a completion marker for its run:
+#
+#   training-pipeline/checkpoints/<run date>/<run id>/<stage>.json
+#
+# holding the content hashes of the datasets it read and wrote (tracked by its DatasetHandoff), the ETags of the
+# S3 objects it wrote (and of any other objects it depends on), and the task result it returned. When a run is
+# executed again (an execution started with {"Resume": {"RunId": ..., "RunDate": ...}}, or a stage retried after
+# it had already completed), every stage with a marker that still holds returns the recorded result instead of
+# running again, so the pipeline resumes from the first incomplete stage. A marker holds while every object the
+# stage wrote or depends on still has the ETag it had, and every dataset the stage read still has the content
+# hash it had: when an earlier stage ran again and produced different data, the stages after it run again too.
+#
+# Stages of the Express state machine (inline handoff) keep no markers, which saves a GET and a PUT (plus a HEAD
+# per output) per stage: Express runs are short enough to run again from the start, and their inline datasets
+# only exist in the execution that produced them.
+#*********************************************
+
+CHECKPOINT_PREFIX = "training-pipeline/checkpoints"
+
+
+def checkpoint_key(run_parameters: dict, stage: str) -> str:
+    return f"{CHECKPOINT_PREFIX}/{run_parameters['RunDate']}/{run_parameters['RunId']}/{stage}.json"
+
+
+def object_etag(bucket: str, key: str) -> str:
+    '''
+        returns:
+            ETag of an S3 object, or None when it does not exist
+    '''
+    try:
+        return client().head_object(Bucket=bucket, Key=key)["ETag"]
+    except ClientError as error:
+        if error.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+            return None
+        raise
+
+
+class StageCheckpoint:
+    '''
+        Completion marker of one stage of a run.
+
+            checkpoint = StageCheckpoint("model-training", run_parameters, handoff)
+            if checkpoint.completed():
+                return checkpoint.result
+            with StageLineage("model-training", run_parameters, handoff, context) as lineage:
+                lineage.metrics.update(run(run_parameters, handoff))
+            return checkpoint.complete(handoff.output())
+
+        args:
+            stage: stage name
+            run_parameters: run parameters created by the parent Step Function
+            handoff: DatasetHandoff of the stage, which tracks the datasets the stage reads and writes
+            dependencies: S3 keys of other objects the stage reads (e.g. intermediate results of a Map state)
+    '''
+    def __init__(self, stage: str, run_parameters: dict, handoff, dependencies: list = None):
+        self.stage = stage
+        self.run_parameters = run_parameters
+        self.handoff = handoff
+        self.dependencies = list(dependencies or [])
+        self.key = checkpoint_key(run_parameters, stage)
+        self.result = None
+
+    def _input_hash(self, name: str, dataset: dict) -> str:
+        '''
+            Current content hash of a dataset the stage read: from the handoff entry of an inline or in-memory
+            dataset, or from the metadata.json of the prefix it was read from in S3.
+        '''
+        if dataset["key"] is None:
+            return self.handoff.datasets.get(name, {}).get("sha256")
+        stored = self.handoff.stored(name, dataset["key"])
+        return stored["sha256"] if stored else None
+
+    def completed(self) -> bool:
+        '''
+            Whether the stage already completed for this run and its marker still holds; result is then the task
+            result it returned.
+        '''
+        if self.handoff.inline:
+            return False
+        try:
+            body = client().get_object(Bucket=self.handoff.bucket, Key=self.key)["Body"].read()
+        except ClientError as error:
+            if error.response["Error"]["Code"] in ("404", "NoSuchKey"):
+                return False
+            raise
+        marker = json.loads(body)
+
+        for output in marker["outputs"].values():
+            if output["etag"] is not None and object_etag(self.handoff.bucket, output["key"]) != output["etag"]:
+                print(f"{self.stage} runs again: {output['key']} changed since it completed")
+                return False
+        for key, etag in marker["dependencies"].items():
+            if object_etag(self.handoff.bucket, key) != etag:
+                print(f"{self.stage} runs again: {key} changed since it completed")
+                return False
+        for name, dataset in marker["inputs"].items():
+            if dataset["sha256"] is None or self._input_hash(name, dataset) != dataset["sha256"]:
+                print(f"{self.stage} runs again: its input {name} changed since it completed")
+                return False
+
+        print(f"{self.stage} already completed for run {self.run_parameters['RunId']}, resuming after it")
+        self.result = marker["result"]
+        return True
+
+    def complete(self, result):
+        '''
+            Writes the completion marker of the stage.
+
+            args:
+                result: task result the stage returns (JSON-serializable)
+            returns:
+                result
+        '''
+        if self.handoff.inline:
+            return result
+        outputs = {
+            name: {**dataset, "etag": object_etag(self.handoff.bucket, dataset["key"]) if dataset["key"] else None}
+            for name, dataset in self.handoff.outputs.items()
+        }
+        marker = {
+            "run_id": self.run_parameters["RunId"],
+            "stage": self.stage,
+            "completed": int(time.time() * 1000),
+            "inputs": self.handoff.inputs,
+            "outputs": outputs,
+            "dependencies": {key: object_etag(self.handoff.bucket, key) for key in self.dependencies},
+            "result": result
+        }
+        client().put_object(Bucket=self.handoff.bucket, Key=self.key, Body=json.dumps(marker), ContentType="application/json")
+        return result
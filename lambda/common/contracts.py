@@ -0,0 +1,213 @@
+from dataclasses import dataclass, field
+from typing import Iterable, List, Optional
+import numpy as np
+
+
+# *********************************************
+# Declarative dataset contracts
+#
+# A contract states what a dataset must look like (dtype kind, value ranges, null rules, row-count bounds).
+# Checks are vectorized per chunk, so datasets can be validated while they stream in, and every violation
+# is counted instead of stopping at the first failure. Unlike assert, these checks survive python -O.
+#*********************************************
+
+KINDS = {
+    "integer": "iu",
+    "float": "f",
+    "numeric": "iuf",
+    "boolean": "b"
+}
+
+
+class ContractViolation(Exception):
+    '''
+        Raised when a dataset breaks a contract whose on_violation policy is "fail".
+    '''
+    def __init__(self, report: dict):
+        super().__init__(f"Dataset {report['dataset']} violates its contract: {report['violations']}")
+        self.report = report
+
+
+@dataclass(frozen=True)
+class ColumnContract:
+    '''
+        args:
+            kind: allowed dtype kind, one of KINDS
+            min_value: inclusive lower bound (None for unbounded)
+            max_value: inclusive upper bound (None for unbounded)
+            nullable: whether NaN values are allowed
+    '''
+    kind: str = "numeric"
+    min_value: Optional[float] = None
+    max_value: Optional[float] = None
+    nullable: bool = False
+
+
+@dataclass(frozen=True)
+class DatasetContract:
+    '''
+        args:
+            name: dataset name used in reports
+            ndim: 1 for label vectors, 2 for feature matrices
+            columns: per-column contracts; when None every column follows column_rule
+            column_rule: contract for columns not listed in columns
+            n_columns: exact number of columns expected (None to accept any)
+            min_rows: minimum number of rows
+            max_rows: maximum number of rows (None for unbounded)
+            on_violation: "fail" raises ContractViolation once the dataset is fully checked, "warn" only reports
+    '''
+    name: str
+    ndim: int = 2
+    columns: Optional[List[ColumnContract]] = None
+    column_rule: ColumnContract = field(default_factory=ColumnContract)
+    n_columns: Optional[int] = None
+    min_rows: int = 1
+    max_rows: Optional[int] = None
+    on_violation: str = "fail"
+
+    def column(self, index: int) -> ColumnContract:
+        if self.columns is not None and index < len(self.columns):
+            return self.columns[index]
+        return self.column_rule
+
+
+class ContractValidator:
+    '''
+        Accumulates violation statistics for one dataset over any number of chunks.
+    '''
+    def __init__(self, contract: DatasetContract):
+        self.contract = contract
+        self.rows = 0
+        self.violations = {}
+
+    def _count(self, violation: str, count: int) -> None:
+        if count:
+            self.violations[violation] = self.violations.get(violation, 0) + int(count)
+
+    def update(self, chunk: np.ndarray) -> None:
+        contract = self.contract
+        if chunk.ndim != contract.ndim:
+            self._count("ndim", 1)
+            return
+        matrix = chunk.reshape((-1, 1)) if chunk.ndim == 1 else chunk
+        self.rows += matrix.shape[0]
+
+        expected_columns = contract.n_columns or (len(contract.columns) if contract.columns else None)
+        if expected_columns is not None and matrix.shape[1] != expected_columns:
+            self._count("n_columns", 1)
+            return
+        if matrix.shape[0] == 0:
+            return
+
+        # Columns sharing a rule are checked together, one vectorized pass per check over the whole block
+        groups = {}
+        for index in range(matrix.shape[1]):
+            groups.setdefault(contract.column(index), []).append(index)
+
+        for rule, indices in groups.items():
+            block = matrix if len(indices) == matrix.shape[1] else matrix[:, indices]
+
+            if block.dtype.kind not in KINDS[rule.kind]:
+                for index in indices:
+                    self._count(f"column_{index}.dtype", block.shape[0])
+                continue
+
+            null_counts = np.count_nonzero(np.isnan(block), axis=0) if block.dtype.kind == "f" else np.zeros(len(indices))
+            if not rule.nullable:
+                for position in np.flatnonzero(null_counts):
+                    self._count(f"column_{indices[position]}.null", null_counts[position])
+
+            # NaN is ignored by the range checks below
+            if null_counts.any():
+                with np.errstate(invalid="ignore"):
+                    minimums, maximums = np.nanmin(block, axis=0), np.nanmax(block, axis=0)
+            else:
+                minimums, maximums = block.min(axis=0), block.max(axis=0)
+
+            # Column minimum/maximum first; per-row counting only runs on columns that actually cross a bound
+            if rule.min_value is not None:
+                for position in np.flatnonzero(minimums < rule.min_value):
+                    self._count(f"column_{indices[position]}.below_min", np.count_nonzero(block[:, position] < rule.min_value))
+            if rule.max_value is not None:
+                for position in np.flatnonzero(maximums > rule.max_value):
+                    self._count(f"column_{indices[position]}.above_max", np.count_nonzero(block[:, position] > rule.max_value))
+
+    def report(self) -> dict:
+        contract = self.contract
+        if self.rows < contract.min_rows:
+            self._count("rows.below_min", contract.min_rows - self.rows)
+        if contract.max_rows is not None and self.rows > contract.max_rows:
+            self._count("rows.above_max", self.rows - contract.max_rows)
+        return {
+            "dataset": contract.name,
+            "rows": self.rows,
+            "violations": dict(self.violations),
+            "passed": not self.violations
+        }
+
+
+def validate_stream(contract: DatasetContract, chunks: Iterable[np.ndarray]) -> dict:
+    '''
+        Validates a dataset chunk by chunk (e.g. while it is being read from S3).
+
+        args:
+            contract: DatasetContract to check against
+            chunks: iterable of np.array chunks
+        returns:
+            validation report
+    '''
+    validator = ContractValidator(contract)
+    for chunk in chunks:
+        validator.update(chunk)
+    return validator.report()
+
+
+def validate(contract: DatasetContract, dataset: np.ndarray, chunk_rows: int = 1_000_000) -> dict:
+    '''
+        Validates an in-memory dataset in row chunks to bound temporary memory.
+    '''
+    return validate_stream(contract, (dataset[start:start + chunk_rows] for start in range(0, max(len(dataset), 1), chunk_rows)))
+
+
+def enforce(report: dict, contract: DatasetContract) -> dict:
+    '''
+        Raises ContractViolation for failed reports of contracts with the "fail" policy; otherwise prints a warning.
+    '''
+    if not report["passed"]:
+        if contract.on_violation == "fail":
+            raise ContractViolation(report)
+        print(f"WARNING: dataset {report['dataset']} violates its contract: {report['violations']}")
+    return report
+
+
+def enforce_same_rows(*reports: dict) -> None:
+    '''
+        Raises ContractViolation when datasets that must be row-aligned (e.g. features and labels) differ in length.
+    '''
+    rows = {report["dataset"]: report["rows"] for report in reports}
+    if len(set(rows.values())) > 1:
+        raise ContractViolation({
+            "dataset": "+".join(rows),
+            "rows": max(rows.values()),
+            "violations": {"rows.mismatch": rows},
+            "passed": False
+        })
+
+
+# *********************************************
+# Training pipeline dataset contracts
+#*********************************************
+
+RAW_FEATURES = ColumnContract(kind="numeric", nullable=False)
+LABELS = ColumnContract(kind="numeric", nullable=False)
+ENGINEERED_FEATURES = ColumnContract(kind="float", nullable=False)
+
+CONTRACTS = {
+    "train-features": DatasetContract(name="train-features", column_rule=RAW_FEATURES, min_rows=2),
+    "train-labels": DatasetContract(name="train-labels", ndim=1, column_rule=LABELS, min_rows=2),
+    "test-features": DatasetContract(name="test-features", column_rule=RAW_FEATURES, min_rows=1),
+    "test-labels": DatasetContract(name="test-labels", ndim=1, column_rule=LABELS, min_rows=1),
+    "inference-data": DatasetContract(name="inference-data", column_rule=RAW_FEATURES, min_rows=1),
+    "engineered-features": DatasetContract(name="engineered-features", column_rule=ENGINEERED_FEATURES, min_rows=1),
+    "predictions": DatasetContract(name="predictions", ndim=1, column_rule=ColumnContract(kind="float", nullable=False), min_rows=1)
+}
@@ -0,0 +1,82 @@
+import numpy as np
+
+
+# *********************************************
+# Dtype planning
+#
+# NumPy and pandas default to int64/float64, which for small integer codes or float32-exact values doubles
+# (or octuples) the memory and I/O of a dataset. Before a dataset is handed off, the planner picks the smallest
+# dtype per column that holds every value exactly: the narrowest signed integer for integer columns, float32
+# for float columns whose values survive a float32 round trip. Float columns stay floats (contracts check the
+# dtype kind). A NumPy array has one dtype, so the dataset dtype is the promotion of its column dtypes. The
+# promotion is not always exact: integer columns promoted to a float dtype (together with float columns, or a
+# uint64 column together with signed ones) only keep integers up to the float's mantissa (2**53 for float64).
+# When an integer column holds larger values, the plan falls back to the dataset's own dtype for every column,
+# which holds its values as they are. The plan is recorded with the dataset (metadata.json next to it in S3, or
+# its handoff entry), so readers parse each column straight into its planned dtype.
+#*********************************************
+
+INTEGER_DTYPES = ("int8", "int16", "int32", "int64")
+
+
+def plan_column(values: np.array) -> str:
+    '''
+        Smallest dtype holding every value of a column exactly.
+    '''
+    if values.dtype.kind == "b":
+        return "bool"
+    if values.dtype.kind in "iu":
+        if values.size == 0:
+            return "int8"
+        minimum, maximum = int(values.min()), int(values.max())
+        for dtype in INTEGER_DTYPES:
+            limits = np.iinfo(dtype)
+            if limits.min <= minimum and maximum <= limits.max:
+                return dtype
+        return values.dtype.name
+    if values.dtype.kind == "f":
+        if values.dtype.itemsize <= 4:
+            return values.dtype.name
+        with np.errstate(over="ignore", invalid="ignore"):
+            narrowed = values.astype(np.float32)
+        return "float32" if np.array_equal(narrowed.astype(values.dtype), values, equal_nan=True) else values.dtype.name
+    return values.dtype.name
+
+
+def plan_dtypes(dataset: np.array) -> dict:
+    '''
+        args:
+            dataset: 1-D or 2-D array
+        returns:
+            {"dtype": dataset dtype, "columns": [per-column dtype]}
+    '''
+    matrix = dataset.reshape((len(dataset), -1)) if dataset.ndim != 2 else dataset
+    columns = [plan_column(matrix[:, column]) for column in range(matrix.shape[1])]
+    dtype = np.result_type(*columns).name if columns else dataset.dtype.name
+    if np.dtype(dtype).kind == "f" and len(matrix) and not integers_exact(matrix, columns, dtype):
+        return {"dtype": dataset.dtype.name, "columns": [dataset.dtype.name] * len(columns)}
+    return {"dtype": dtype, "columns": columns}
+
+
+def integers_exact(matrix: np.array, columns: list, dtype: str) -> bool:
+    '''
+        Whether every integer column of a matrix is exactly representable in a float dtype.
+    '''
+    limit = 2 ** (np.finfo(dtype).nmant + 1)
+    for column, column_dtype in enumerate(columns):
+        if np.dtype(column_dtype).kind in "iu":
+            values = matrix[:, column]
+            if max(-int(values.min()), int(values.max())) > limit:
+                return False
+    return True
+
+
+def apply_plan(dataset: np.array, plan: dict) -> np.array:
+    return dataset.astype(plan["dtype"], copy=False)
+
+
+def csv_dtypes(plan: dict) -> dict:
+    '''
+        pandas read_csv dtype argument for a CSV written by write_data (columns named "0", "1", ...).
+    '''
+    return {str(column): dtype for column, dtype in enumerate(plan["columns"])} if plan else None
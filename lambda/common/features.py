@@ -0,0 +1,202 @@
+import json
+import numpy as np
+from sklearn.base import BaseEstimator, TransformerMixin
+
+
+# *********************************************
+# Feature transforms
+#
+# Every transform is fitted on the training split and writes its output block directly into a slice
+# of one preallocated output array, so a full pipeline is applied in a single vectorized pass.
+#*********************************************
+
+class Scale:
+    '''
+        Standardizes columns to zero mean and unit variance.
+    '''
+    def __init__(self, columns: list):
+        self.columns = columns
+
+    def fit(self, X: np.ndarray) -> "Scale":
+        self.mean_ = X[:, self.columns].mean(axis=0)
+        std = X[:, self.columns].std(axis=0)
+        self.scale_ = np.where(std == 0, 1.0, std)
+        return self
+
+    def width(self) -> int:
+        return len(self.columns)
+
+    def transform_into(self, X: np.ndarray, out: np.ndarray) -> None:
+        np.subtract(X[:, self.columns], self.mean_, out=out, casting="unsafe")
+        out /= self.scale_.astype(out.dtype)
+
+
+class Polynomial:
+    '''
+        Powers 2..degree of each column (the column itself is left to other transforms).
+    '''
+    def __init__(self, columns: list, degree: int = 2):
+        self.columns = columns
+        self.degree = degree
+
+    def fit(self, X: np.ndarray) -> "Polynomial":
+        return self
+
+    def width(self) -> int:
+        return len(self.columns) * (self.degree - 1)
+
+    def transform_into(self, X: np.ndarray, out: np.ndarray) -> None:
+        base = X[:, self.columns].astype(out.dtype)
+        powers = np.arange(2, self.degree + 1, dtype=out.dtype)
+        # (rows, columns, degree - 1) -> columns laid out as c0^2..c0^d, c1^2..c1^d, ...
+        out[:] = np.power(base[:, :, None], powers).reshape(len(X), -1)
+
+
+class OneHot:
+    '''
+        One-hot encodes categorical columns with the categories seen in the training split.
+        Unseen categories encode as all zeros.
+    '''
+    def __init__(self, columns: list):
+        self.columns = columns
+
+    def fit(self, X: np.ndarray) -> "OneHot":
+        self.categories_ = [np.unique(X[:, column]) for column in self.columns]
+        return self
+
+    def width(self) -> int:
+        return sum(len(categories) for categories in self.categories_)
+
+    def transform_into(self, X: np.ndarray, out: np.ndarray) -> None:
+        out[:] = 0
+        offset = 0
+        rows = np.arange(len(X))
+        for column, categories in zip(self.columns, self.categories_):
+            index = np.clip(np.searchsorted(categories, X[:, column]), 0, len(categories) - 1)
+            seen = categories[index] == X[:, column]
+            out[rows[seen], offset + index[seen]] = 1
+            offset += len(categories)
+
+
+class Hashing:
+    '''
+        Signed hashing trick for high-cardinality integer columns: each value is hashed into n_features buckets.
+    '''
+    def __init__(self, columns: list, n_features: int = 16):
+        self.columns = columns
+        self.n_features = n_features
+
+    def fit(self, X: np.ndarray) -> "Hashing":
+        return self
+
+    def width(self) -> int:
+        return self.n_features
+
+    def transform_into(self, X: np.ndarray, out: np.ndarray) -> None:
+        out[:] = 0
+        rows = np.arange(len(X))
+        for column in self.columns:
+            # Fibonacci multiplicative hash of the 64-bit value, salted by column
+            values = X[:, column].astype(np.int64).view(np.uint64) + np.uint64(column)
+            hashed = values * np.uint64(0x9E3779B97F4A7C15)
+            bucket = (hashed >> np.uint64(32)) % np.uint64(self.n_features)
+            sign = np.where((hashed >> np.uint64(31)) & np.uint64(1), 1, -1).astype(out.dtype)
+            np.add.at(out, (rows, bucket.astype(np.intp)), sign)
+
+
+class Lag:
+    '''
+        Lagged copies of columns along the row (time) axis; rows without history are filled with fill_value.
+    '''
+    def __init__(self, columns: list, lags: list, fill_value: float = 0.0):
+        self.columns = columns
+        self.lags = lags
+        self.fill_value = fill_value
+
+    def fit(self, X: np.ndarray) -> "Lag":
+        return self
+
+    def width(self) -> int:
+        return len(self.columns) * len(self.lags)
+
+    def transform_into(self, X: np.ndarray, out: np.ndarray) -> None:
+        out[:] = self.fill_value
+        base = X[:, self.columns]
+        for position, lag in enumerate(self.lags):
+            block = slice(position * len(self.columns), (position + 1) * len(self.columns))
+            if lag < len(X):
+                out[lag:, block] = base[:len(X) - lag]
+
+
+TRANSFORMS = {
+    "scale": Scale,
+    "polynomial": Polynomial,
+    "one_hot": OneHot,
+    "hashing": Hashing,
+    "lag": Lag
+}
+
+DEFAULT_CONFIG = {
+    "dtype": "float64",
+    "transforms": [
+        {"type": "scale"}
+    ]
+}
+
+
+class FeaturePipeline(BaseEstimator, TransformerMixin):
+    '''
+        Configurable feature engineering pipeline, fitted on the training split.
+
+        Being a scikit-learn transformer, a fitted FeaturePipeline is serialized as the first step of the
+        model's sklearn Pipeline, so evaluation and inference apply exactly the transforms the model was trained with.
+
+        args:
+            config: {"dtype": "float32" | "float64", "transforms": [{"type": <TRANSFORMS key>, "columns": [...], ...}]}
+                    transforms without "columns" apply to every input column
+    '''
+    def __init__(self, config: dict = None):
+        self.config = config
+
+    def fit(self, X: np.ndarray, y: np.ndarray = None) -> "FeaturePipeline":
+        config = self.config or DEFAULT_CONFIG
+        X = np.asarray(X)
+        self.n_features_in_ = X.shape[1]
+        self.dtype_ = np.dtype(config.get("dtype", "float64"))
+        if self.dtype_ not in (np.float32, np.float64):
+            raise ValueError(f"Unsupported feature dtype: {self.dtype_}")
+
+        self.transforms_ = []
+        for spec in config["transforms"]:
+            params = {key: value for key, value in spec.items() if key != "type"}
+            params.setdefault("columns", list(range(self.n_features_in_)))
+            self.transforms_.append(TRANSFORMS[spec["type"]](**params).fit(X))
+        self.n_features_out_ = sum(transform.width() for transform in self.transforms_)
+        return self
+
+    def transform(self, X: np.ndarray) -> np.ndarray:
+        X = np.asarray(X)
+        if X.ndim != 2 or X.shape[1] != self.n_features_in_:
+            raise ValueError(f"Expected {self.n_features_in_} input columns, got shape {X.shape}")
+
+        # One allocation for the whole feature matrix; every transform fills its own column block
+        out = np.empty((X.shape[0], self.n_features_out_), dtype=self.dtype_)
+        offset = 0
+        for transform in self.transforms_:
+            width = transform.width()
+            transform.transform_into(X, out[:, offset:offset + width])
+            offset += width
+        return out
+
+
+def load_config(config_json: str) -> dict:
+    '''
+        Parses the FEATURE_CONFIG environment variable, falling back to DEFAULT_CONFIG.
+    '''
+    if not config_json:
+        return DEFAULT_CONFIG
+    config = json.loads(config_json)
+    for spec in config.get("transforms", []):
+        if spec["type"] not in TRANSFORMS:
+            raise ValueError(f"Unknown feature transform: {spec['type']}")
+    return config
@@ -0,0 +1,304 @@
+import os
+import io
+import json
+import zlib
+import base64
+import hashlib
+import posixpath
+import boto3
+import numpy as np
+from botocore.exceptions import ClientError
+
+from contracts import DatasetContract, validate
+from dtypes import plan_dtypes, apply_plan
+from aio import to_thread
+from utils import read_validated, read_validated_async, read_array, read_array_async, write_data, write_array, write_json, hash_array, encode_csv, MultipartWriter
+
+
+# *********************************************
+# Dataset handoff between pipeline stages
+#
+# By default every dataset travels through S3. When the stage runs in the Express state machine
+# (INLINE_DATASET_LIMIT > 0), datasets whose encoded size is under the limit are instead returned inline in
+# the task result as base64 of a zlib-compressed .npy buffer, and the next stage decodes them from its input.
+# Larger datasets, or datasets that no longer fit in the state payload budget, still fall back to S3.
+# Stages of the Express state machine also skip the S3 writes that only serve Standard runs: checkpoints
+# (checkpoints.py) and the partitioned dataset copies (partitioned.py).
+# In the fused pipeline every stage runs in one process and datasets are handed off as the arrays themselves.
+#
+# Every dataset is narrowed to its planned dtype (dtypes.py) before it is handed off. The plan travels in the
+# dataset's handoff entry and, for datasets in S3, in the metadata.json next to them, so readers parse CSV
+# columns straight into the planned dtypes instead of letting pandas widen them to int64/float64.
+#
+# Datasets go to S3 as CSV by default. With DATASET_FORMAT=npy they are written as raw .npy files instead,
+# which readers load straight into a preallocated array (utils.read_array) without parsing or copying; the key
+# recorded in metadata.json tells readers which format a dataset was written in.
+#
+# Every dataset is hashed once when it is handed off (sha256 in its entry and in metadata.json), and the handoff
+# tracks the datasets a stage reads and writes with their keys and hashes for the stage's lineage record.
+#
+# Datasets too large to hold in memory (e.g. synthetic load-test data) are handed off through a DatasetStream
+# instead: chunks are encoded and uploaded to S3 as they are produced, and the dataset is recorded on close.
+#*********************************************
+
+DATASET_FORMATS = ("csv", "npy")
+
+# Step Functions caps a state's input/output at 256 KB; inline datasets share a budget below that so the
+# run parameters and the rest of the state always fit
+STATE_PAYLOAD_BUDGET = 200_000
+
+
+def encode_array(dataset: np.array) -> str:
+    '''
+        Compact binary encoding of an array (dtype and shape preserved) for a JSON payload.
+    '''
+    buffer = io.BytesIO()
+    np.save(buffer, np.ascontiguousarray(dataset), allow_pickle=False)
+    return base64.b64encode(zlib.compress(buffer.getvalue())).decode("ascii")
+
+
+def decode_array(encoded: str) -> np.array:
+    return np.load(io.BytesIO(zlib.decompress(base64.b64decode(encoded))), allow_pickle=False)
+
+
+class DatasetHandoff:
+    '''
+        Resolves the datasets a stage reads and records the datasets it produces.
+
+        Every entry of the handoff maps a dataset name to {"inline": <encoded array>}, {"s3": <key>, "dtypes": <plan>}
+        or, in a fused run, {"array": <np.array>}, plus the "sha256" of the dataset.
+        Entries received from earlier stages are passed along, so later stages can still resolve them.
+
+        args:
+            event_input: the stage's Step Function input (event['Input'])
+            bucket: project S3 bucket
+            inline_limit: maximum encoded size in bytes of an inline dataset; 0 writes every dataset to S3
+            in_memory: keep every dataset in memory and never write it to S3 (fused pipeline)
+    '''
+    def __init__(self, event_input: dict, bucket: str, inline_limit: int = None, in_memory: bool = False):
+        self.bucket = bucket
+        self.datasets = dict((event_input.get("Handoff") or {}).get("Datasets", {}))
+        self.inline_limit = int(os.environ.get("INLINE_DATASET_LIMIT", "0")) if inline_limit is None else inline_limit
+        self.in_memory = in_memory
+        self.format = os.environ.get("DATASET_FORMAT", "csv")
+        if self.format not in DATASET_FORMATS:
+            raise ValueError(f"Unsupported dataset format: {self.format}")
+        # Fitted objects (feature pipeline, model) handed from stage to stage in a fused run
+        self.artifacts = {}
+        # S3 prefix -> contents of its metadata.json (dataset name -> key, rows, dtype plan, sha256)
+        self.metadata = {}
+        # Datasets read and written by the current stage: name -> {"key", "rows", "sha256"} (lineage.StageLineage)
+        self.inputs = {}
+        self.outputs = {}
+
+    @property
+    def inline(self) -> bool:
+        '''
+            Whether datasets are handed off inline, i.e. the stage runs in the Express state machine.
+        '''
+        return self.inline_limit > 0 and not self.in_memory
+
+    def inline_bytes(self) -> int:
+        return sum(len(entry["inline"]) for entry in self.datasets.values() if "inline" in entry)
+
+    def read(self, name: str, key: str, contract: DatasetContract) -> tuple:
+        '''
+            args:
+                name: dataset name
+                key: S3 key the dataset is read from when it was not handed off inline
+                contract: DatasetContract the data must satisfy
+            returns:
+                (np.array containing the data, validation report)
+        '''
+        entry = self.datasets.get(name, {})
+        if "array" in entry:
+            dataset = entry["array"]
+            self._track_input(name, entry, None, None, dataset)
+            return dataset, validate(contract, dataset)
+        if "inline" in entry:
+            dataset = decode_array(entry["inline"])
+            self._track_input(name, entry, None, None, dataset)
+            return dataset, validate(contract, dataset)
+        stored = self.stored(name, key)
+        key = entry.get("s3") or (stored["key"] if stored else key)
+        if key.endswith(".npy"):
+            dataset = read_array(self.bucket, key)
+            self._track_input(name, entry, stored, key, dataset)
+            return dataset, validate(contract, dataset)
+        dataset, report = read_validated(self.bucket, key, contract, entry.get("dtypes") or (stored["dtypes"] if stored else None))
+        self._track_input(name, entry, stored, key, dataset)
+        return dataset, report
+
+    async def read_async(self, name: str, key: str, contract: DatasetContract) -> tuple:
+        '''
+            read for asyncio code, so a stage can read several datasets (and load models) concurrently.
+        '''
+        entry = self.datasets.get(name, {})
+        if "array" in entry or "inline" in entry:
+            return self.read(name, key, contract)
+        stored = await to_thread(self.stored, name, key)
+        key = entry.get("s3") or (stored["key"] if stored else key)
+        if key.endswith(".npy"):
+            dataset = await read_array_async(self.bucket, key)
+            self._track_input(name, entry, stored, key, dataset)
+            return dataset, validate(contract, dataset)
+        dataset, report = await read_validated_async(self.bucket, key, contract, entry.get("dtypes") or (stored["dtypes"] if stored else None))
+        self._track_input(name, entry, stored, key, dataset)
+        return dataset, report
+
+    def _track_input(self, name: str, entry: dict, stored: dict, key: str, dataset: np.array) -> None:
+        sha256 = entry.get("sha256") or (stored or {}).get("sha256")
+        self.inputs[name] = {"key": key, "rows": int(len(dataset)), "sha256": sha256}
+
+    def _read_metadata(self, prefix: str) -> dict:
+        if prefix not in self.metadata:
+            try:
+                body = boto3.client("s3").get_object(Bucket=self.bucket, Key=f"{prefix}/metadata.json")["Body"].read()
+                self.metadata[prefix] = json.loads(body)
+            except ClientError as error:
+                if error.response["Error"]["Code"] not in ("404", "NoSuchKey"):
+                    raise
+                self.metadata[prefix] = {"datasets": {}}
+        return self.metadata[prefix]
+
+    def stored(self, name: str, key: str) -> dict:
+        '''
+            metadata.json record {"key", "rows", "dtypes", "sha256"} of a dataset written to S3 at key (in either format),
+            or None for datasets written without one.
+        '''
+        dataset = self._read_metadata(posixpath.dirname(key))["datasets"].get(name)
+        if dataset and posixpath.splitext(dataset["key"])[0] == posixpath.splitext(key)[0]:
+            return dataset
+        return None
+
+    def write(self, name: str, dataset: np.array, key: str) -> None:
+        '''
+            Hands a dataset off inline when it fits, otherwise writes it to S3 at key (as .npy with DATASET_FORMAT=npy).
+        '''
+        self.datasets.pop(name, None)
+        plan = plan_dtypes(dataset)
+        dataset = apply_plan(dataset, plan)
+        sha256 = hash_array(dataset)
+        self.outputs[name] = {"key": None, "rows": int(len(dataset)), "sha256": sha256}
+        if self.in_memory:
+            self.datasets[name] = {"array": dataset, "sha256": sha256}
+            return
+        if self.inline_limit > 0:
+            encoded = encode_array(dataset)
+            if len(encoded) <= self.inline_limit and self.inline_bytes() + len(encoded) <= STATE_PAYLOAD_BUDGET:
+                self.datasets[name] = {"inline": encoded, "sha256": sha256}
+                return
+        key = self.format_key(key)
+        if self.format == "npy":
+            write_array(dataset, self.bucket, key)
+        else:
+            write_data(dataset, self.bucket, key)
+        self._record(name, key, int(len(dataset)), plan, sha256)
+
+    def format_key(self, key: str) -> str:
+        '''
+            S3 key of a dataset in the handoff's format (.npy with DATASET_FORMAT=npy).
+        '''
+        return f"{posixpath.splitext(key)[0]}.npy" if self.format == "npy" else key
+
+    def _record(self, name: str, key: str, rows: int, plan: dict, sha256: str) -> None:
+        self.datasets[name] = {"s3": key, "dtypes": plan, "sha256": sha256}
+        self.outputs[name] = {"key": key, "rows": rows, "sha256": sha256}
+
+        prefix = posixpath.dirname(key)
+        metadata = self._read_metadata(prefix)
+        metadata["datasets"][name] = {"key": key, "rows": rows, "dtypes": plan, "sha256": sha256}
+        write_json(metadata, self.bucket, f"{prefix}/metadata.json")
+
+    def stream(self, name: str, key: str, shape: tuple, dtype: str) -> "DatasetStream":
+        '''
+            Opens a DatasetStream handing off a dataset of known shape and dtype chunk by chunk.
+        '''
+        return DatasetStream(self, name, key, shape, dtype)
+
+    def artifact(self, name: str, load):
+        '''
+            Fitted object published by an earlier stage of a fused run, otherwise load() (e.g. from S3).
+        '''
+        if name in self.artifacts:
+            return self.artifacts[name]
+        return load()
+
+    def output(self) -> dict:
+        '''
+            Task result picked up by the state machine (ResultSelector $.Payload.Datasets)
+        '''
+        return {"Datasets": {name: entry for name, entry in self.datasets.items() if "array" not in entry}}
+
+
+class DatasetStream:
+    '''
+        Hands a dataset off chunk by chunk without holding it in memory: every chunk is encoded in the handoff's
+        format (CSV, or .npy whose header is written up front from the known shape) and streamed to S3 through a
+        multipart upload, and the dataset is hashed as it goes (the same sha256 as hash_array of the whole
+        dataset). The dataset is recorded (handoff entry, metadata.json) on close. The dtype plan is the stream's
+        dtype for every column, since narrowing would need every value first. In-memory handoffs, and inline
+        handoffs of datasets that may fit inline, collect the chunks and hand the dataset off whole on close.
+
+        args:
+            handoff: DatasetHandoff the dataset is handed to
+            name: dataset name
+            key: S3 key of the dataset (its extension follows the handoff's format)
+            shape: shape of the whole dataset
+            dtype: dtype of the dataset
+    '''
+    def __init__(self, handoff: DatasetHandoff, name: str, key: str, shape: tuple, dtype: str):
+        self.handoff = handoff
+        self.name = name
+        self.shape = tuple(int(size) for size in shape)
+        self.dtype = np.dtype(dtype)
+        self.rows = 0
+        self.chunks = None
+        self.writer = None
+        nbytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        if handoff.in_memory or 0 < nbytes <= handoff.inline_limit:
+            self.key = key
+            self.chunks = []
+            return
+
+        self.key = handoff.format_key(key)
+        self.writer = MultipartWriter(handoff.bucket, self.key)
+        self.digest = hashlib.sha256()
+        self.digest.update(str((self.shape, self.dtype.str)).encode("utf-8"))
+        if handoff.format == "npy":
+            header = io.BytesIO()
+            np.lib.format.write_array_header_1_0(header, {
+                "descr": np.lib.format.dtype_to_descr(self.dtype),
+                "fortran_order": False,
+                "shape": self.shape
+            })
+            self.writer.write(header.getvalue())
+
+    def write(self, chunk: np.array) -> None:
+        chunk = np.ascontiguousarray(chunk, dtype=self.dtype)
+        if chunk.shape[1:] != self.shape[1:] or self.rows + len(chunk) > self.shape[0]:
+            raise ValueError(f"Chunk of shape {chunk.shape} does not fit {self.name} of shape {self.shape} after {self.rows} rows")
+        if self.chunks is not None:
+            self.chunks.append(chunk)
+        else:
+            self.digest.update(chunk.data)
+            if self.handoff.format == "npy":
+                self.writer.write(chunk.data.cast("B"))
+            else:
+                self.writer.write(encode_csv(chunk, header=self.rows == 0))
+        self.rows += len(chunk)
+
+    def close(self) -> None:
+        if self.rows != self.shape[0]:
+            raise ValueError(f"{self.name} has {self.rows} of {self.shape[0]} rows")
+        if self.chunks is not None:
+            self.handoff.write(self.name, np.concatenate(self.chunks) if self.chunks else np.empty(self.shape, dtype=self.dtype), self.key)
+            return
+        self.writer.close()
+        self.handoff.datasets.pop(self.name, None)
+        plan = {"dtype": self.dtype.name, "columns": [self.dtype.name] * (self.shape[1] if len(self.shape) > 1 else 1)}
+        self.handoff._record(self.name, self.key, self.rows, plan, self.digest.hexdigest())
+
+    def abort(self) -> None:
+        if self.writer is not None:
+            self.writer.abort()
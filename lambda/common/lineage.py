@@ -0,0 +1,455 @@
+import os
+import json
+import time
+import hashlib
+import numpy as np
+from botocore.exceptions import ClientError
+
+from ranged import client, executor, read_into, RangedDownload, use_ranges
+
+
+# *********************************************
+# Lineage and run-metadata store
+#
+# Every stage appends one compact record per execution (inputs and outputs with their content hashes, timings,
+# metrics, image, status) to an append-only log: one immutable object per record under lineage/log/, keyed by
+# the time the stage finished. A compaction job (lambda_handler on a schedule) folds the records logged since its
+# last watermark into a columnar table, rewritten as a new generation under lineage/table/<generation>/:
+#
+#   records/<column>.bin    one row per stage execution, sorted by stage and finish time
+#   edges/<column>.bin      one row per (dataset, stage execution), sorted by dataset id
+#
+# Columns are raw fixed-width arrays, so any row range of a column is one ranged GET. lineage/table/manifest.json
+# points at the current generation and holds the small indexes: each stage's row range with fences (every
+# FENCE_ROWS-th finish time) and fences of the sorted dataset ids. A query reads the manifest, narrows down
+# the rows with the fences, fetches just those row ranges of the columns it needs, and adds the few records
+# logged since the watermark, so it never scans the per-run S3 prefixes or the whole table.
+#*********************************************
+
+LINEAGE_PREFIX = "lineage"
+LOG_PREFIX = f"{LINEAGE_PREFIX}/log"
+TABLE_PREFIX = f"{LINEAGE_PREFIX}/table"
+MANIFEST_KEY = f"{TABLE_PREFIX}/manifest.json"
+
+# Records that finished less than this long ago are left to the next compaction, so a record whose PUT is still
+# in flight is never skipped by the watermark
+GRACE_SECONDS = int(os.environ.get("LINEAGE_GRACE_SECONDS", "300"))
+
+# Rows between two fences of a sorted column
+FENCE_ROWS = 4096
+
+ROLES = ("input", "output")
+STATUSES = ("succeeded", "failed")
+
+DAY_MS = 86400 * 1000
+
+
+def dataset_id(dataset: str) -> int:
+    '''
+        64-bit id of a dataset given by its content hash (the sha256 recorded at handoff) or by its S3 key.
+    '''
+    if len(dataset) == 64 and all(character in "0123456789abcdef" for character in dataset):
+        return int(dataset[:16], 16)
+    return int.from_bytes(hashlib.blake2b(f"s3://{dataset}".encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def log_key(record: dict) -> str:
+    return f"{LOG_PREFIX}/{record['finished']:013d}-{record['run_id']}-{record['stage']}.json"
+
+
+def append(bucket: str, record: dict) -> str:
+    '''
+        Appends a record to the lineage log.
+
+        returns:
+            S3 key of the record
+    '''
+    key = log_key(record)
+    client().put_object(Bucket=bucket, Key=key, Body=json.dumps(record, default=str), ContentType="application/json")
+    return key
+
+
+class StageLineage:
+    '''
+        Times a stage and appends its lineage record when it ends, whether it succeeded or failed.
+
+            with StageLineage("model-training", run_parameters, handoff, context) as lineage:
+                lineage.metrics.update(run(run_parameters, handoff) or {})
+
+        args:
+            stage: stage name
+            run_parameters: run parameters created by the parent Step Function
+            handoff: DatasetHandoff of the stage, which tracks the datasets the stage reads and writes
+            context: Lambda context (function version), None outside Lambda
+            execution_mode: "split" for the stage Lambdas, "fused" for the fused pipeline
+    '''
+    def __init__(self, stage: str, run_parameters: dict, handoff, context=None, execution_mode: str = "split"):
+        self.stage = stage
+        self.run_parameters = run_parameters
+        self.handoff = handoff
+        self.context = context
+        self.execution_mode = execution_mode
+        self.metrics = {}
+        self.key = None
+
+    def __enter__(self) -> "StageLineage":
+        self.handoff.inputs, self.handoff.outputs = {}, {}
+        self.started = int(time.time() * 1000)
+        self.clock = time.perf_counter()
+        return self
+
+    def __exit__(self, kind, error, traceback) -> bool:
+        record = {
+            "run_id": self.run_parameters["RunId"],
+            "run_date": self.run_parameters["RunDate"],
+            "stage": self.stage,
+            "execution_mode": self.execution_mode,
+            "status": STATUSES[error is not None],
+            "error": repr(error) if error is not None else None,
+            "started": self.started,
+            "finished": int(time.time() * 1000),
+            "seconds": round(time.perf_counter() - self.clock, 3),
+            "image": os.environ.get("IMAGE_URI"),
+            "function_version": getattr(self.context, "function_version", None),
+            "inputs": self.handoff.inputs,
+            "outputs": self.handoff.outputs,
+            "metrics": self.metrics
+        }
+        try:
+            self.key = append(self.handoff.bucket, record)
+        except Exception:
+            # A failed stage reports its own error, not the lineage write's
+            if error is None:
+                raise
+        return False
+
+
+# *********************************************
+# Compaction
+#*********************************************
+
+def write_column(bucket: str, key: str, values: np.array) -> None:
+    client().put_object(Bucket=bucket, Key=key, Body=np.ascontiguousarray(values).tobytes())
+
+
+def read_column(bucket: str, key: str, dtype: str, start: int, stop: int) -> np.array:
+    '''
+        Rows [start, stop) of a column, fetched as one byte range (parallel ranges for large slices).
+    '''
+    dtype = np.dtype(dtype)
+    values = np.empty(max(stop - start, 0), dtype=dtype)
+    if values.size == 0:
+        return values
+    # Fixed-width string columns have no byte buffer format of their own
+    buffer = memoryview(values.view(np.uint8))
+    offset = start * dtype.itemsize
+    if use_ranges(values.nbytes):
+        # RangedDownload fetches bytes [offset, size) of the object
+        head = {"size": offset + values.nbytes, "etag": client().head_object(Bucket=bucket, Key=key)["ETag"]}
+        RangedDownload(bucket, key, head, buffer, offset=offset).wait()
+        return values
+    byte_range = f"bytes={offset}-{offset + values.nbytes - 1}"
+    read_into(client().get_object(Bucket=bucket, Key=key, Range=byte_range)["Body"], buffer, key)
+    return values
+
+
+def read_manifest(bucket: str) -> dict:
+    try:
+        return json.loads(client().get_object(Bucket=bucket, Key=MANIFEST_KEY)["Body"].read())
+    except ClientError as error:
+        if error.response["Error"]["Code"] in ("404", "NoSuchKey"):
+            return None
+        raise
+
+
+def list_log(bucket: str, start_after: str = None, before: str = None) -> list:
+    '''
+        Keys of the records logged after start_after (a log key) and before the key prefix before.
+    '''
+    keys = []
+    arguments = {"Bucket": bucket, "Prefix": f"{LOG_PREFIX}/"}
+    if start_after:
+        arguments["StartAfter"] = start_after
+    for page in client().get_paginator("list_objects_v2").paginate(**arguments):
+        for item in page.get("Contents", []):
+            if before is not None and item["Key"] >= before:
+                return keys
+            keys.append(item["Key"])
+    return keys
+
+
+def read_records(bucket: str, keys: list) -> list:
+    futures = [executor().submit(client().get_object, Bucket=bucket, Key=key) for key in keys]
+    return [json.loads(future.result()["Body"].read()) for future in futures]
+
+
+def table_columns(records: list, stages: list, images: list) -> tuple:
+    '''
+        Columns of the records and edges tables for a batch of log records. New stage names and images are
+        appended to the dictionaries.
+    '''
+    def code(dictionary: list, value) -> int:
+        if value not in dictionary:
+            dictionary.append(value)
+        return dictionary.index(value)
+
+    records_rows, edges_rows = [], []
+    for record in records:
+        stage = code(stages, record["stage"])
+        records_rows.append((stage, record["finished"], record["seconds"], record["run_id"], STATUSES.index(record["status"]), code(images, record.get("image"))))
+        for role in ROLES:
+            for name, dataset in record.get(f"{role}s", {}).items():
+                for identity in (dataset.get("sha256"), dataset.get("key")):
+                    if identity:
+                        edges_rows.append((dataset_id(identity), record["finished"], record["run_id"], stage, ROLES.index(role)))
+
+    stage_codes, finished, seconds, runs, statuses, image_codes = zip(*records_rows) if records_rows else ((),) * 6
+    records_columns = {
+        "stage": np.array(stage_codes, dtype=np.int16),
+        "finished": np.array(finished, dtype=np.int64),
+        "seconds": np.array(seconds, dtype=np.float32),
+        "run": np.array(runs, dtype=np.bytes_),
+        "status": np.array(statuses, dtype=np.int8),
+        "image": np.array(image_codes, dtype=np.int32)
+    }
+    dataset_ids, finished, runs, stage_codes, roles = zip(*edges_rows) if edges_rows else ((),) * 5
+    edges_columns = {
+        "dataset": np.array(dataset_ids, dtype=np.uint64),
+        "finished": np.array(finished, dtype=np.int64),
+        "run": np.array(runs, dtype=np.bytes_),
+        "stage": np.array(stage_codes, dtype=np.int16),
+        "role": np.array(roles, dtype=np.int8)
+    }
+    return records_columns, edges_columns
+
+
+def load_table(bucket: str, manifest: dict, table: str) -> dict:
+    columns = manifest["tables"][table]
+    return {
+        name: read_column(bucket, f"{TABLE_PREFIX}/{manifest['generation']}/{table}/{name}.bin", dtype, 0, manifest["rows"][table])
+        for name, dtype in columns.items()
+    }
+
+
+def merge(old: dict, new: dict) -> dict:
+    '''
+        Concatenates two tables column by column (fixed-width strings are widened to the longer of the two).
+    '''
+    if old is None:
+        return new
+    return {name: np.concatenate([old[name], new[name]]) for name in new}
+
+
+def write_table(bucket: str, records: dict, edges: dict, stages: list, images: list, watermark: str, generation: str, previous: str = None) -> dict:
+    '''
+        Sorts the records and edges tables, writes them as a new generation, and points the manifest at it.
+
+        args:
+            bucket: project S3 bucket
+            records: records table columns (table_columns)
+            edges: edges table columns (table_columns)
+            stages: stage names, indexed by the stage codes of the tables
+            images: image URIs, indexed by the image codes of the records table
+            watermark: key of the last log record folded into the tables
+            generation: name of the new generation
+            previous: generation the manifest pointed at until now
+        returns:
+            the new manifest
+    '''
+    order = np.lexsort((records["finished"], records["stage"]))
+    records = {name: values[order] for name, values in records.items()}
+    order = np.lexsort((edges["finished"], edges["dataset"]))
+    edges = {name: values[order] for name, values in edges.items()}
+
+    futures = [
+        executor().submit(write_column, bucket, f"{TABLE_PREFIX}/{generation}/{table}/{name}.bin", values)
+        for table, columns in (("records", records), ("edges", edges))
+        for name, values in columns.items()
+    ]
+    for future in futures:
+        future.result()
+
+    bounds = np.searchsorted(records["stage"], np.arange(len(stages) + 1), side="left")
+    manifest = {
+        "generation": generation,
+        "previous": previous,
+        "watermark": watermark,
+        "rows": {"records": int(len(records["finished"])), "edges": int(len(edges["dataset"]))},
+        "tables": {
+            "records": {name: values.dtype.str for name, values in records.items()},
+            "edges": {name: values.dtype.str for name, values in edges.items()}
+        },
+        "stages": stages,
+        "stage_rows": [
+            {
+                "start": int(bounds[code]),
+                "end": int(bounds[code + 1]),
+                "fences": records["finished"][bounds[code]:bounds[code + 1]:FENCE_ROWS].tolist()
+            }
+            for code in range(len(stages))
+        ],
+        "images": images,
+        "dataset_fences": edges["dataset"][::FENCE_ROWS].tolist()
+    }
+    # The manifest switches readers to the new generation only once all of its columns are written
+    client().put_object(Bucket=bucket, Key=MANIFEST_KEY, Body=json.dumps(manifest), ContentType="application/json")
+    return manifest
+
+
+def compact(bucket: str, now: float = None) -> dict:
+    '''
+        Folds the records logged since the last compaction into a new generation of the lineage table.
+
+        args:
+            bucket: project S3 bucket
+            now: compaction time in seconds since the epoch (defaults to the current time)
+        returns:
+            the new manifest, or the current one when no record was logged since
+    '''
+    now = time.time() if now is None else now
+    manifest = read_manifest(bucket)
+    keys = list_log(bucket, manifest["watermark"] if manifest else None, f"{LOG_PREFIX}/{int((now - GRACE_SECONDS) * 1000):013d}")
+    if not keys:
+        return manifest
+
+    stages = list(manifest["stages"]) if manifest else []
+    images = list(manifest["images"]) if manifest else []
+    records, edges = table_columns(read_records(bucket, keys), stages, images)
+    if manifest:
+        records = merge(load_table(bucket, manifest, "records"), records)
+        edges = merge(load_table(bucket, manifest, "edges"), edges)
+
+    new_manifest = write_table(
+        bucket, records, edges, stages, images, keys[-1], f"{int(now * 1000):013d}", manifest["generation"] if manifest else None
+    )
+
+    # The previous generation stays readable for queries that loaded the old manifest; older ones are removed
+    if manifest and manifest.get("previous"):
+        stale = f"{TABLE_PREFIX}/{manifest['previous']}/"
+        for page in client().get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=stale):
+            objects = [{"Key": item["Key"]} for item in page.get("Contents", [])]
+            if objects:
+                client().delete_objects(Bucket=bucket, Delete={"Objects": objects})
+    return new_manifest
+
+
+# *********************************************
+# Queries
+#*********************************************
+
+class LineageQuery:
+    '''
+        Queries over the compacted lineage table plus the records logged since its last compaction.
+
+        args:
+            bucket: project S3 bucket
+    '''
+    def __init__(self, bucket: str):
+        self.bucket = bucket
+        self.manifest = read_manifest(bucket)
+
+    def _column(self, table: str, name: str, start: int, stop: int) -> np.array:
+        return read_column(
+            self.bucket, f"{TABLE_PREFIX}/{self.manifest['generation']}/{table}/{name}.bin",
+            self.manifest["tables"][table][name], start, stop
+        )
+
+    def tail(self) -> list:
+        '''
+            Records logged since the last compaction.
+        '''
+        return read_records(self.bucket, list_log(self.bucket, self.manifest["watermark"] if self.manifest else None))
+
+    def runs_using(self, dataset: str) -> list:
+        '''
+            Stage executions that read or wrote a dataset.
+
+            args:
+                dataset: content hash (sha256 recorded at handoff) or S3 key of the dataset
+            returns:
+                [{"run_id", "stage", "role", "finished"}], oldest first
+        '''
+        identity = dataset_id(dataset)
+        matches = []
+        if self.manifest and self.manifest["rows"]["edges"]:
+            # The fences bound the block of sorted ids that can hold the dataset; only that block is fetched
+            fences = np.array(self.manifest["dataset_fences"], dtype=np.uint64)
+            first = max(int(np.searchsorted(fences, identity, side="left")) - 1, 0)
+            last = int(np.searchsorted(fences, identity, side="right"))
+            start, stop = first * FENCE_ROWS, min(last * FENCE_ROWS, self.manifest["rows"]["edges"])
+            ids = self._column("edges", "dataset", start, stop)
+            low = start + int(np.searchsorted(ids, identity, side="left"))
+            high = start + int(np.searchsorted(ids, identity, side="right"))
+            if high > low:
+                columns = {
+                    name: future.result() for name, future in {
+                        name: executor().submit(self._column, "edges", name, low, high) for name in ("finished", "run", "stage", "role")
+                    }.items()
+                }
+                stages = self.manifest["stages"]
+                matches = [
+                    {"run_id": run.decode("utf-8"), "stage": stages[stage], "role": ROLES[role], "finished": int(finished)}
+                    for run, stage, role, finished in zip(columns["run"], columns["stage"], columns["role"], columns["finished"])
+                ]
+        for record in self.tail():
+            for role in ROLES:
+                for entry in record.get(f"{role}s", {}).values():
+                    if identity in (dataset_id(value) for value in (entry.get("sha256"), entry.get("key")) if value):
+                        matches.append({"run_id": record["run_id"], "stage": record["stage"], "role": role, "finished": record["finished"]})
+        return sorted(matches, key=lambda match: match["finished"])
+
+    def stage_latency(self, stage: str, days: int = 90, now: float = None) -> list:
+        '''
+            Daily latency of a stage's successful executions over the last days.
+
+            returns:
+                [{"date", "runs", "mean", "p50", "p95", "max"}] per day with executions, oldest first
+        '''
+        now = time.time() if now is None else now
+        since = int((now - days * 86400) * 1000)
+        finished, seconds = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        if self.manifest and stage in self.manifest["stages"]:
+            rows = self.manifest["stage_rows"][self.manifest["stages"].index(stage)]
+            # The stage's rows are sorted by finish time: the fences locate the first block of the window
+            block = max(int(np.searchsorted(rows["fences"], since, side="left")) - 1, 0)
+            start = rows["start"] + block * FENCE_ROWS
+            futures = [executor().submit(self._column, "records", name, start, rows["end"]) for name in ("finished", "seconds", "status")]
+            finished, seconds, status = (future.result() for future in futures)
+            keep = (finished >= since) & (status == STATUSES.index("succeeded"))
+            finished, seconds = finished[keep], seconds[keep]
+        tail = [record for record in self.tail() if record["stage"] == stage and record["status"] == "succeeded" and record["finished"] >= since]
+        finished = np.concatenate([finished, np.array([record["finished"] for record in tail], dtype=np.int64)])
+        seconds = np.concatenate([seconds, np.array([record["seconds"] for record in tail], dtype=np.float32)])
+
+        days_index = finished // DAY_MS
+        trend = []
+        for day in np.unique(days_index):
+            values = seconds[days_index == day]
+            trend.append({
+                "date": time.strftime("%Y-%m-%d", time.gmtime(int(day) * 86400)),
+                "runs": int(values.size),
+                "mean": float(values.mean()),
+                "p50": float(np.percentile(values, 50)),
+                "p95": float(np.percentile(values, 95)),
+                "max": float(values.max())
+            })
+        return trend
+
+
+def lambda_handler(event, context):
+    '''
+        Scheduled events compact the lineage log; direct invocations with a Query run it:
+
+            {"Query": "runs_using", "Dataset": <sha256 or S3 key>}
+            {"Query": "stage_latency", "Stage": <stage>, "Days": 90}
+    '''
+    bucket = f"pr-{os.environ['ENVIRONMENT']}-{os.environ['PROJECT']}-bucket"
+    query = event.get("Query") if isinstance(event, dict) else None
+    if query == "runs_using":
+        return LineageQuery(bucket).runs_using(event["Dataset"])
+    if query == "stage_latency":
+        return LineageQuery(bucket).stage_latency(event["Stage"], int(event.get("Days", 90)))
+    if query is not None:
+        raise ValueError(f"Unsupported lineage query: {query}")
+    manifest = compact(bucket)
+    return {"Generation": manifest["generation"] if manifest else None, "Rows": manifest["rows"] if manifest else None}
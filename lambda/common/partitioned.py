@@ -0,0 +1,355 @@
+import json
+import posixpath
+import numpy as np
+
+from dtypes import plan_column
+from ranged import client, executor, read_into
+from utils import MultipartWriter
+
+
+# *********************************************
+# Partitioned datasets with row-group statistics
+#
+# The flat handoff files of a run are always read whole. A partitioned dataset (e.g. training-pipeline/datasets/
+# test) instead lays the rows of every run out hive-style by date and slice:
+#
+#   <root>/date=<run date>/slice=<slice>/part-<run id>.bin     row groups of column chunks
+#   <root>/_manifests/date=<run date>/run=<run id>.json         files, row groups and column statistics of a run
+#
+# A data file is a sequence of row groups (ROW_GROUP_ROWS rows each); a row group stores every column as one
+# contiguous chunk of raw values in the column's planned dtype (dtypes.plan_column), and the manifest records
+# each chunk's byte offset and length with its minimum, maximum and NaN count. A reader given a column
+# projection and filter predicates prunes in three steps before downloading any data: manifests by the date
+# and run in their keys (one LIST), files by their slice, and row groups whose statistics cannot satisfy the
+# predicates. Only the byte ranges of the chunks of the projected and filtered columns of the remaining row
+# groups are then fetched (adjacent chunks coalesced into one ranged GET, GETs run concurrently), and the
+# predicates are applied exactly to the rows of those row groups.
+#*********************************************
+
+# Partitioned datasets of the pipeline (train, test, inference) live under this prefix of the project bucket
+DATASETS_PREFIX = "training-pipeline/datasets"
+
+# Rows per row group, the unit of statistics-based pruning
+ROW_GROUP_ROWS = 65536
+
+# Partition keys a predicate can name besides a data column
+PARTITION_KEYS = ("date", "run", "slice")
+
+OPERATORS = {
+    "==": lambda values, value: values == value,
+    "!=": lambda values, value: values != value,
+    "<": lambda values, value: values < value,
+    "<=": lambda values, value: values <= value,
+    ">": lambda values, value: values > value,
+    ">=": lambda values, value: values >= value,
+    "in": lambda values, value: np.isin(values, list(value))
+}
+
+
+def may_match(operator: str, value, minimum, maximum, nulls: int = 0) -> bool:
+    '''
+        Whether any value within [minimum, maximum], or any of nulls NaN values, can satisfy a predicate (False
+        prunes the row group). NaN satisfies "!=" only, as in OPERATORS.
+    '''
+    if minimum is None:
+        # Only NaN values
+        return operator == "!="
+    if operator == "==":
+        return minimum <= value <= maximum
+    if operator == "!=":
+        return nulls > 0 or not minimum == maximum == value
+    if operator == "<":
+        return minimum < value
+    if operator == "<=":
+        return minimum <= value
+    if operator == ">":
+        return maximum > value
+    if operator == ">=":
+        return maximum >= value
+    return any(minimum <= item <= maximum for item in value)
+
+
+def matches(operator: str, value, partition_value) -> bool:
+    '''
+        Whether a partition value (date and run are strings, slice an integer) satisfies a predicate.
+    '''
+    return bool(OPERATORS[operator](partition_value, value))
+
+
+def hive_values(key: str) -> dict:
+    '''
+        {name: value} of the name=value segments of an S3 key (the .json or .bin suffix is ignored).
+    '''
+    segments = posixpath.splitext(key)[0].split("/")
+    return dict(segment.split("=", 1) for segment in segments if "=" in segment)
+
+
+def column_statistics(values: np.array) -> dict:
+    present = values[~np.isnan(values)] if values.dtype.kind == "f" else values
+    return {
+        "min": present.min().item() if present.size else None,
+        "max": present.max().item() if present.size else None,
+        "nulls": int(values.size - present.size)
+    }
+
+
+def dataset_root(name: str) -> str:
+    return f"{DATASETS_PREFIX}/{name}"
+
+
+def slice_edges(values: np.array, slices: int) -> list:
+    '''
+        Inner edges splitting values into slices of equal counts (e.g. the training values of the slicing feature).
+    '''
+    return np.unique(np.quantile(np.asarray(values, dtype=np.float64), np.linspace(0, 1, slices + 1)[1:-1])).tolist()
+
+
+def assign_slices(values: np.array, edges: list) -> np.array:
+    '''
+        Slice (0 to len(edges)) of every value.
+    '''
+    return np.searchsorted(np.asarray(edges, dtype=np.float64), np.asarray(values, dtype=np.float64), side="right")
+
+
+class PartitionedDataset:
+    '''
+        A dataset of named columns partitioned by date and slice, written run by run.
+
+        args:
+            bucket: project S3 bucket
+            root: S3 prefix of the dataset
+    '''
+    def __init__(self, bucket: str, root: str):
+        self.bucket = bucket
+        self.root = root
+
+    def manifest_key(self, run_date: str, run_id: str) -> str:
+        return f"{self.root}/_manifests/date={run_date}/run={run_id}.json"
+
+    def write(self, dataset: np.array, columns: list, run_date: str, run_id: str, slices: np.array, row_group_rows: int = ROW_GROUP_ROWS) -> dict:
+        '''
+            Writes the rows of one run, one file per slice.
+
+            args:
+                dataset: 2-D array, one column per name in columns
+                columns: column names
+                run_date: date partition of the rows
+                run_id: run the rows belong to
+                slices: slice (integer) of every row
+                row_group_rows: rows per row group
+            returns:
+                the run's manifest
+        '''
+        dataset = dataset.reshape((len(dataset), -1))
+        dtypes = [plan_column(dataset[:, column]) for column in range(dataset.shape[1])]
+        writer = self.writer(columns, dtypes, run_date, run_id, row_group_rows)
+        try:
+            writer.append(dataset, slices)
+        except BaseException:
+            writer.abort()
+            raise
+        return writer.close()
+
+    def writer(self, columns: list, dtypes: list, run_date: str, run_id: str, row_group_rows: int = ROW_GROUP_ROWS) -> "PartitionedWriter":
+        '''
+            Opens a PartitionedWriter for the rows of one run, appended chunk by chunk.
+        '''
+        return PartitionedWriter(self, columns, dtypes, run_date, run_id, row_group_rows)
+
+    def manifests(self, filters: list = ()) -> list:
+        '''
+            Manifests of the runs whose date and run id can satisfy the filters (pruned from their keys).
+        '''
+        prefix = f"{self.root}/_manifests/"
+        dates = [value for column, operator, value in filters if column == "date" and operator == "=="]
+        if dates:
+            prefix += f"date={dates[0]}/"
+        s3 = client()
+        keys = []
+        for page in s3.get_paginator("list_objects_v2").paginate(Bucket=self.bucket, Prefix=prefix):
+            for item in page.get("Contents", []):
+                partition = hive_values(item["Key"][len(self.root):])
+                if all(matches(operator, value, partition[column]) for column, operator, value in filters if column in ("date", "run")):
+                    keys.append(item["Key"])
+        documents = [executor().submit(s3.get_object, Bucket=self.bucket, Key=key) for key in sorted(keys)]
+        return [json.loads(document.result()["Body"].read()) for document in documents]
+
+    def plan(self, columns: list = None, filters: list = ()) -> dict:
+        '''
+            Selects what a read downloads.
+
+            args:
+                columns: projected column names (None for every column)
+                filters: predicates (column, operator, value), ANDed; column is a data column name or one of
+                    PARTITION_KEYS, operator one of OPERATORS
+            returns:
+                {"columns": projected names, "fetch": names of the fetched columns (projected, then filtered),
+                "row_groups": [{"key", "rows", "chunks", "dtypes"} of the fetched columns of a selected row group],
+                "bytes": bytes to download, "total_bytes": bytes of every row group of the matching runs}
+        '''
+        manifests = self.manifests(filters)
+        names = manifests[-1]["columns"] if manifests else list(columns or [])
+        for manifest in manifests:
+            if manifest["columns"] != names:
+                raise ValueError(f"{self.root} changed columns between runs: {names} and {manifest['columns']}")
+        for column, operator, value in filters:
+            if operator not in OPERATORS:
+                raise ValueError(f"Unsupported operator: {operator}")
+            if manifests and column not in names and column not in PARTITION_KEYS:
+                raise ValueError(f"{self.root} has no column {column}")
+        columns = list(columns) if columns is not None else names
+        # A column filtered by several predicates is fetched once
+        filtered = dict.fromkeys(column for column, _, _ in filters)
+        fetch = columns + [column for column in filtered if column in names and column not in columns]
+        indices = [names.index(column) for column in fetch]
+        row_filters = [(names.index(column), operator, value) for column, operator, value in filters if column in names]
+
+        selected, fetched_bytes, total_bytes = [], 0, 0
+        for manifest in manifests:
+            for file in manifest["files"]:
+                total_bytes += sum(chunk["length"] for group in file["row_groups"] for chunk in group["columns"])
+                if not all(matches(operator, value, file["slice"]) for column, operator, value in filters if column == "slice"):
+                    continue
+                for group in file["row_groups"]:
+                    statistics = group["columns"]
+                    if not all(may_match(operator, value, statistics[index]["min"], statistics[index]["max"], statistics[index]["nulls"]) for index, operator, value in row_filters):
+                        continue
+                    chunks = [statistics[index] for index in indices]
+                    selected.append({
+                        "key": file["key"],
+                        "rows": group["rows"],
+                        "chunks": chunks,
+                        "dtypes": [manifest["dtypes"][index] for index in indices]
+                    })
+                    fetched_bytes += sum(chunk["length"] for chunk in chunks)
+        return {"columns": columns, "fetch": fetch, "row_groups": selected, "bytes": fetched_bytes, "total_bytes": total_bytes}
+
+    def _fetch(self, s3, key: str, offset: int, target: memoryview) -> None:
+        body = s3.get_object(Bucket=self.bucket, Key=key, Range=f"bytes={offset}-{offset + len(target) - 1}")["Body"]
+        read_into(body, target, key)
+
+    def read(self, columns: list = None, filters: list = ()) -> np.array:
+        '''
+            Reads the rows satisfying the filters, projected on columns (see plan), with only the byte ranges of
+            the selected column chunks downloaded.
+
+            returns:
+                2-D np.array with one column per projected name, in the promoted dtype of those columns
+        '''
+        plan = self.plan(columns, filters)
+        if not plan["row_groups"]:
+            return np.empty((0, len(plan["columns"])))
+
+        # The fetched chunks of a row group are laid out in one buffer in file order, so adjacent chunks are
+        # fetched with one ranged GET
+        s3 = client()
+        futures, buffers = [], []
+        for group in plan["row_groups"]:
+            order = sorted(range(len(group["chunks"])), key=lambda position: group["chunks"][position]["offset"])
+            buffer = bytearray(sum(chunk["length"] for chunk in group["chunks"]))
+            view = memoryview(buffer)
+            ranges, positions, position = [], {}, 0
+            for index in order:
+                chunk = group["chunks"][index]
+                positions[index] = position
+                if ranges and ranges[-1][0] + ranges[-1][1] == chunk["offset"]:
+                    ranges[-1][1] += chunk["length"]
+                else:
+                    ranges.append([chunk["offset"], chunk["length"], position])
+                position += chunk["length"]
+            for offset, length, start in ranges:
+                futures.append(executor().submit(self._fetch, s3, group["key"], offset, view[start:start + length]))
+            buffers.append((buffer, positions))
+        for future in futures:
+            future.result()
+
+        fetch = plan["fetch"]
+        parts = []
+        for group, (buffer, positions) in zip(plan["row_groups"], buffers):
+            values = [
+                np.frombuffer(buffer, dtype=dtype, count=group["rows"], offset=positions[index])
+                for index, dtype in enumerate(group["dtypes"])
+            ]
+            mask = np.ones(group["rows"], dtype=bool)
+            for column, operator, value in filters:
+                if column in fetch:
+                    mask &= OPERATORS[operator](values[fetch.index(column)], value)
+            parts.append(np.column_stack(values[:len(plan["columns"])])[mask])
+        return np.concatenate(parts) if len(parts) > 1 else parts[0]
+
+
+class PartitionedWriter:
+    '''
+        Writes the rows of one run chunk by chunk, for runs too large to hold in memory: the rows of each slice of
+        a chunk are appended to that slice's data file as row groups (of up to row_group_rows rows), streamed to S3
+        as a multipart upload. The data files and then the manifest are completed on close.
+
+        args:
+            dataset: PartitionedDataset written to
+            columns: column names
+            dtypes: dtype of every column (e.g. dtypes.plan_column of the whole column)
+            run_date: date partition of the rows
+            run_id: run the rows belong to
+            row_group_rows: maximum rows per row group
+    '''
+    def __init__(self, dataset: PartitionedDataset, columns: list, dtypes: list, run_date: str, run_id: str, row_group_rows: int = ROW_GROUP_ROWS):
+        if len(dtypes) != len(columns):
+            raise ValueError(f"Expected {len(columns)} dtypes, got {len(dtypes)}")
+        self.dataset = dataset
+        self.columns = list(columns)
+        self.dtypes = list(dtypes)
+        self.run_date = run_date
+        self.run_id = run_id
+        self.row_group_rows = row_group_rows
+        # slice -> {"key", "writer", "offset", "rows", "row_groups"}
+        self.files = {}
+
+    def append(self, chunk: np.array, slices: np.array) -> None:
+        '''
+            args:
+                chunk: 2-D array, one column per name in columns
+                slices: slice (integer) of every row of the chunk
+        '''
+        chunk = chunk.reshape((len(chunk), -1))
+        if chunk.shape[1] != len(self.columns):
+            raise ValueError(f"Expected {len(self.columns)} columns, got {chunk.shape[1]}")
+        for slice_value in np.unique(slices).tolist():
+            rows = chunk[slices == slice_value]
+            file = self.files.get(slice_value)
+            if file is None:
+                key = f"{self.dataset.root}/date={self.run_date}/slice={slice_value}/part-{self.run_id}.bin"
+                file = self.files[slice_value] = {"key": key, "writer": MultipartWriter(self.dataset.bucket, key), "offset": 0, "rows": 0, "row_groups": []}
+            for start in range(0, len(rows), self.row_group_rows):
+                group = rows[start:start + self.row_group_rows]
+                statistics = []
+                for column, dtype in enumerate(self.dtypes):
+                    values = np.ascontiguousarray(group[:, column], dtype=dtype)
+                    file["writer"].write(values.data.cast("B"))
+                    statistics.append({"offset": file["offset"], "length": values.nbytes, **column_statistics(values)})
+                    file["offset"] += values.nbytes
+                file["row_groups"].append({"rows": int(len(group)), "columns": statistics})
+                file["rows"] += int(len(group))
+
+    def close(self) -> dict:
+        '''
+            returns:
+                the run's manifest
+        '''
+        # Closed one by one: the writers upload their last parts on the range thread pool
+        for file in self.files.values():
+            file["writer"].close()
+        files = [
+            {"key": file["key"], "slice": slice_value, "rows": file["rows"], "row_groups": file["row_groups"]}
+            for slice_value, file in sorted(self.files.items())
+        ]
+        manifest = {"date": self.run_date, "run": self.run_id, "columns": self.columns, "dtypes": self.dtypes, "files": files}
+        # The manifest is written last: readers never see a run whose data files are incomplete
+        client().put_object(
+            Bucket=self.dataset.bucket, Key=self.dataset.manifest_key(self.run_date, self.run_id),
+            Body=json.dumps(manifest), ContentType="application/json"
+        )
+        return manifest
+
+    def abort(self) -> None:
+        for file in self.files.values():
+            file["writer"].abort()
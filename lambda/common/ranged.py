@@ -0,0 +1,202 @@
+import io
+import os
+import boto3
+from botocore.config import Config
+from concurrent.futures import ThreadPoolExecutor
+
+
+# *********************************************
+# Byte-range parallel downloads
+#
+# One get_object stream is bound to the throughput of one connection (~80-100 MB/s), while a Lambda function
+# sustains several times that over parallel connections. Objects at or above RANGE_THRESHOLD_BYTES are split
+# into RANGE_PART_BYTES byte ranges, fetched over RANGE_CONNECTIONS connections straight into one preallocated
+# buffer (every range reads into its own slice, so nothing is copied or joined afterwards), and consumed in
+# order as the downloaded prefix grows: CSV parsing starts on the first row-aligned chunk while later ranges
+# are still in flight. Ranges run on their own thread pool, not the asyncio I/O pool (aio.py), because the
+# blocking readers that start them are themselves awaited on that pool. Readers do not HEAD an object first:
+# they open it with one plain GET (open_object), whose response carries the size and ETag. Objects below the
+# threshold are read from that response alone; for larger ones, only the first range is read from it and the
+# other ranges are fetched in parallel. Every range is requested with the ETag of the first response, so an
+# object overwritten mid-download fails instead of mixing two versions.
+#*********************************************
+
+# Object size from which readers switch from one get_object stream to parallel byte ranges
+RANGE_THRESHOLD_BYTES = int(os.environ.get("RANGE_THRESHOLD_BYTES", str(64 * 1024 * 1024)))
+
+# Bytes per ranged GET
+RANGE_PART_BYTES = int(os.environ.get("RANGE_PART_BYTES", str(8 * 1024 * 1024)))
+
+# Concurrent ranged GETs (one connection each)
+RANGE_CONNECTIONS = int(os.environ.get("RANGE_CONNECTIONS", "8"))
+
+# Bytes requested per readinto call; urllib3 fills the target through a temporary bytes object of this size
+READ_SLICE_BYTES = 8 * 1024 * 1024
+
+_EXECUTOR = None
+_CLIENT = None
+
+
+def executor() -> ThreadPoolExecutor:
+    global _EXECUTOR
+    if _EXECUTOR is None:
+        _EXECUTOR = ThreadPoolExecutor(max_workers=RANGE_CONNECTIONS, thread_name_prefix="range")
+    return _EXECUTOR
+
+
+def client():
+    '''
+        S3 client shared by the range threads, with a connection pool large enough for all of them.
+    '''
+    global _CLIENT
+    if _CLIENT is None:
+        _CLIENT = boto3.client("s3", config=Config(max_pool_connections=max(RANGE_CONNECTIONS, 10)))
+    return _CLIENT
+
+
+def read_into(body, buffer: memoryview, key: str) -> None:
+    '''
+        Fills buffer from a get_object response body, in READ_SLICE_BYTES slices.
+    '''
+    # Older botocore StreamingBody objects do not implement readinto; their urllib3 stream does
+    readinto = body.readinto if hasattr(body, "readinto") else body._raw_stream.readinto
+    filled = 0
+    while filled < len(buffer):
+        count = readinto(buffer[filled:filled + READ_SLICE_BYTES])
+        if not count:
+            raise ValueError(f"{key} ended after {filled} of {len(buffer)} bytes")
+        filled += count
+
+
+def open_object(bucket: str, key: str) -> tuple:
+    '''
+        GETs a whole S3 object, without a HEAD request first.
+
+        returns:
+            (streaming body of the object, {"size": bytes, "etag": ETag} of the object)
+    '''
+    response = client().get_object(Bucket=bucket, Key=key)
+    return response["Body"], {"size": response["ContentLength"], "etag": response["ETag"]}
+
+
+def use_ranges(size: int) -> bool:
+    return size >= RANGE_THRESHOLD_BYTES
+
+
+class RangedDownload:
+    '''
+        Fetches bytes [offset, head["size"]) of an S3 object as concurrent byte ranges into one buffer.
+
+        args:
+            bucket: S3 bucket name
+            key: S3 path to the object
+            head: {"size", "etag"} of the object (open_object)
+            buffer: writable buffer of exactly size - offset bytes (e.g. an array's memory); a bytearray is
+                allocated when omitted
+            offset: first byte of the object to fetch (e.g. past a .npy header)
+            first: body returned by open_object, read up to offset; the first range is read from it instead of
+                   being requested again, and it is closed after that range
+    '''
+    def __init__(self, bucket: str, key: str, head: dict, buffer=None, offset: int = 0, first=None):
+        self.bucket = bucket
+        self.key = key
+        self.etag = head["etag"]
+        self.data = buffer if buffer is not None else bytearray(head["size"] - offset)
+        self.buffer = memoryview(self.data).cast("B")
+        if len(self.buffer) != head["size"] - offset:
+            raise ValueError(f"{key} has {head['size'] - offset} bytes past offset {offset}, the buffer holds {len(self.buffer)}")
+        self.offset = offset
+        self.ranges = [(start, min(start + RANGE_PART_BYTES, len(self.buffer))) for start in range(0, len(self.buffer), RANGE_PART_BYTES)]
+        s3 = client()
+        self.futures = [
+            executor().submit(self._read_first, first, end) if first is not None and start == 0
+            else executor().submit(self._fetch, s3, start, end)
+            for start, end in self.ranges
+        ]
+        if first is not None and not self.ranges:
+            first.close()
+
+    def _read_first(self, body, end: int) -> None:
+        try:
+            read_into(body, self.buffer[:end], self.key)
+        finally:
+            # The rest of the object comes from the other ranges (this drops the connection of the GET)
+            body.close()
+
+    def _fetch(self, s3, start: int, end: int) -> None:
+        byte_range = f"bytes={self.offset + start}-{self.offset + end - 1}"
+        body = s3.get_object(Bucket=self.bucket, Key=self.key, Range=byte_range, IfMatch=self.etag)["Body"]
+        read_into(body, self.buffer[start:end], self.key)
+
+    def prefixes(self):
+        '''
+            Yields the end of the downloaded prefix of the buffer each time it grows (ranges complete in any order,
+            the prefix only grows once every earlier range is in).
+        '''
+        try:
+            for (_, end), future in zip(self.ranges, self.futures):
+                future.result()
+                yield end
+        finally:
+            for future in self.futures:
+                future.cancel()
+
+    def wait(self) -> memoryview:
+        '''
+            returns:
+                the filled buffer
+        '''
+        for _ in self.prefixes():
+            pass
+        return self.buffer
+
+
+def row_chunks(download: RangedDownload):
+    '''
+        Yields row-aligned slices of a downloading text file (e.g. a CSV written by utils.write_data, which has
+        no quoted line breaks): each slice ends at the last line break of the downloaded prefix, so it can be
+        parsed while later ranges are still downloading.
+    '''
+    start = 0
+    for end in download.prefixes():
+        if end < len(download.buffer):
+            end = download.data.rfind(b"\n", start, end) + 1
+            if end <= start:
+                continue
+        if end > start:
+            yield download.buffer[start:end]
+        start = end
+
+
+class BufferReader(io.RawIOBase):
+    '''
+        Read-only, seekable file object over a buffer, so a downloaded object can be parsed or unpickled in place
+        (io.BytesIO would copy it first).
+    '''
+    def __init__(self, buffer):
+        self.buffer = memoryview(buffer).cast("B")
+        self.position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, target) -> int:
+        count = min(len(target), len(self.buffer) - self.position)
+        target[:count] = self.buffer[self.position:self.position + count]
+        self.position += count
+        return count
+
+    def seek(self, position: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.position, io.SEEK_END: len(self.buffer)}[whence]
+        self.position = max(base + position, 0)
+        return self.position
+
+    def tell(self) -> int:
+        return self.position
+
+
+def open_buffer(buffer) -> io.BufferedReader:
+    return io.BufferedReader(BufferReader(buffer))
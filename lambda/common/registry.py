@@ -0,0 +1,358 @@
+import io
+import copy
+import json
+import time
+import random
+import hashlib
+import datetime
+import boto3
+from botocore.exceptions import ClientError
+from joblib import dump, load
+
+from ranged import open_object, RangedDownload, open_buffer
+
+
+# *********************************************
+# Model registry
+#
+# Every training run registers its model under a versioned key (the run ID), so concurrent runs never
+# overwrite each other and evaluation always loads the model of its own run:
+#
+#   models/registry/<model name>/versions/<version>/model.pkl       immutable model artifact
+#   models/registry/<model name>/versions/<version>/metadata.json   lineage, artifact checksum, metrics
+#   models/registry/<model name>/index.json                         compact index of every version
+#   models/registry/<model name>/champion.json                      champion pointer
+#   models/registry/<model name>/deployment.json                    challenger rollout (canary or shadow)
+#
+# An S3 PUT replaces an object atomically, and a version only appears in the index (or behind the champion
+# pointer) after its artifact has been written, so readers never see a half-written model. Versions are
+# immutable: the artifact and metadata of a version are written with If-None-Match, so registering a version
+# again only succeeds for the same artifact (a retried training stage) and never replaces a registered model. The shared
+# documents (index, champion pointer, drift windows) are updated with compare-and-swap writes conditioned on
+# the ETag that was read (If-Match, or If-None-Match for a new document), so runs updating them at the same
+# time retry on the newer document instead of silently overwriting each other. The champion is
+# resolved with a single GET of champion.json instead of listing S3. Documents are cached in memory with their
+# ETag and revalidated with a conditional GET, and loaded models are cached by version (artifacts are
+# immutable), so warm Lambda containers resolve models without downloading them again.
+#*********************************************
+
+MODEL_NAME = "LinearRegression"
+
+# key -> (ETag, parsed document), shared by every registry in the container
+_DOCUMENTS = {}
+
+# (bucket, key) -> deserialized model
+_MODELS = {}
+
+# Compare-and-swap attempts of a document update before giving up
+UPDATE_ATTEMPTS = 10
+
+# promote() without an expected champion replaces whatever the champion is
+_ANY = object()
+
+# Error codes of a conditional write whose precondition did not hold
+PRECONDITION_FAILED = ("412", "PreconditionFailed", "409", "ConditionalRequestConflict")
+
+
+class RegistryConflict(Exception):
+    '''
+        A registry document was changed by another writer between the read and the conditional write of an update.
+    '''
+
+
+class ChampionChanged(RegistryConflict):
+    '''
+        The champion was replaced after the challenger was compared against it (see ModelRegistry.promote).
+    '''
+
+
+class VersionExists(Exception):
+    '''
+        A model version is already registered with a different artifact (see ModelRegistry.register).
+    '''
+
+
+class ModelRegistry:
+    '''
+        S3-backed registry of the models trained by the pipeline.
+
+        args:
+            bucket: project S3 bucket
+            model_name: registered model name, the registry prefix under models/registry/
+    '''
+    def __init__(self, bucket: str, model_name: str = MODEL_NAME):
+        self.bucket = bucket
+        self.prefix = f"models/registry/{model_name}"
+        self.s3 = boto3.client("s3")
+
+    def artifact_key(self, version: str) -> str:
+        return f"{self.prefix}/versions/{version}/model.pkl"
+
+    def metadata_key(self, version: str) -> str:
+        return f"{self.prefix}/versions/{version}/metadata.json"
+
+    # *********************************************
+    # Documents (index, champion pointer, metadata)
+    #*********************************************
+
+    def _read(self, key: str):
+        '''
+            Reads a JSON document, revalidating the cached copy by ETag. Returns None when it does not exist.
+        '''
+        return self._read_tagged(key)[1]
+
+    def _read_tagged(self, key: str) -> tuple:
+        '''
+            returns:
+                (ETag, document) of a JSON document, or (None, None) when it does not exist
+        '''
+        cached = _DOCUMENTS.get((self.bucket, key))
+        try:
+            if cached:
+                response = self.s3.get_object(Bucket=self.bucket, Key=key, IfNoneMatch=cached[0])
+            else:
+                response = self.s3.get_object(Bucket=self.bucket, Key=key)
+        except ClientError as error:
+            code = error.response["Error"]["Code"]
+            if code in ("304", "NotModified"):
+                return cached
+            if code in ("404", "NoSuchKey"):
+                _DOCUMENTS.pop((self.bucket, key), None)
+                return None, None
+            raise
+        document = json.loads(response["Body"].read())
+        _DOCUMENTS[(self.bucket, key)] = (response["ETag"], document)
+        return response["ETag"], document
+
+    def _write(self, key: str, document: dict, **condition) -> None:
+        '''
+            Writes a JSON document. condition is the IfMatch (ETag) or IfNoneMatch ("*") precondition of a
+            compare-and-swap; RegistryConflict is raised when another writer changed the document first.
+        '''
+        try:
+            response = self.s3.put_object(
+                Bucket=self.bucket, Key=key, Body=json.dumps(document).encode(), ContentType="application/json", **condition
+            )
+        except ClientError as error:
+            if error.response["Error"]["Code"] in PRECONDITION_FAILED:
+                _DOCUMENTS.pop((self.bucket, key), None)
+                raise RegistryConflict(f"{key} was changed by another writer") from error
+            raise
+        _DOCUMENTS[(self.bucket, key)] = (response["ETag"], document)
+
+    def update(self, key: str, update) -> dict:
+        '''
+            Read-modify-write of a JSON document as a compare-and-swap on its ETag. update receives a copy of
+            the current document (None when it does not exist) and returns the new one; it is called again on
+            the newer document whenever a concurrent writer got there first, so no writer's change is lost.
+
+            returns:
+                the written document
+        '''
+        for attempt in range(UPDATE_ATTEMPTS):
+            etag, current = self._read_tagged(key)
+            document = update(copy.deepcopy(current))
+            try:
+                self._write(key, document, **({"IfMatch": etag} if etag else {"IfNoneMatch": "*"}))
+                return document
+            except RegistryConflict:
+                # Jittered backoff, so the writers that collided do not collide again
+                time.sleep(random.uniform(0, 0.05 * 2 ** attempt))
+        raise RegistryConflict(f"Could not update {key} after {UPDATE_ATTEMPTS} attempts")
+
+    def index(self) -> dict:
+        '''
+            returns:
+                {version: index entry}, empty when nothing has been registered
+        '''
+        return (self._read(f"{self.prefix}/index.json") or {}).get("versions", {})
+
+    def _update_index(self, version: str, entry: dict) -> None:
+        '''
+            Adds or replaces one index entry; the per-version metadata stays the source of truth (rebuild_index).
+        '''
+        self.update(
+            f"{self.prefix}/index.json",
+            lambda document: {"versions": {**(document or {}).get("versions", {}), version: entry}}
+        )
+
+    def rebuild_index(self) -> dict:
+        '''
+            Regenerates index.json from the metadata of every registered version.
+        '''
+        versions = {}
+        paginator = self.s3.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=f"{self.prefix}/versions/"):
+            for item in page.get("Contents", []):
+                if item["Key"].endswith("/metadata.json"):
+                    metadata = self._read(item["Key"])
+                    versions[metadata["version"]] = metadata
+        self._write(f"{self.prefix}/index.json", {"versions": versions})
+        return versions
+
+    # *********************************************
+    # Versions
+    #*********************************************
+
+    def register(self, model, version: str, lineage: dict) -> dict:
+        '''
+            Writes a model artifact under its version, then its metadata, then its index entry. Registering a
+            version again with the same artifact (a retried or resumed training stage) returns the registered
+            metadata, metrics included.
+
+            args:
+                model: fitted Scikit-learn model
+                version: model version (the run ID of the training run)
+                lineage: run and training data lineage recorded with the model
+            returns:
+                metadata of the registered version
+            raises:
+                VersionExists when the version is already registered with a different artifact
+        '''
+        buffer = io.BytesIO()
+        dump(model, buffer)
+        artifact = buffer.getvalue()
+        sha256 = hashlib.sha256(artifact).hexdigest()
+
+        key = self.artifact_key(version)
+        try:
+            self.s3.put_object(Bucket=self.bucket, Key=key, Body=artifact, Metadata={"sha256": sha256}, IfNoneMatch="*")
+        except ClientError as error:
+            if error.response["Error"]["Code"] not in PRECONDITION_FAILED:
+                raise
+            registered = self.s3.head_object(Bucket=self.bucket, Key=key)["Metadata"].get("sha256") \
+                or (self._read(self.metadata_key(version)) or {}).get("sha256")
+            if registered != sha256:
+                raise VersionExists(f"Model version {version} is already registered with a different artifact") from error
+        _MODELS[(self.bucket, key)] = model
+
+        metadata = {
+            "version": version,
+            "artifact": key,
+            "sha256": sha256,
+            "registered_at": datetime.datetime.utcnow().isoformat(),
+            "lineage": lineage,
+            "metrics": {}
+        }
+        try:
+            self._write(self.metadata_key(version), metadata, IfNoneMatch="*")
+        except RegistryConflict:
+            metadata = self._read(self.metadata_key(version))
+        self._update_index(version, metadata)
+        return metadata
+
+    def metadata(self, version: str) -> dict:
+        metadata = self.index().get(version) or self._read(self.metadata_key(version))
+        if metadata is None:
+            raise KeyError(f"Model version {version} is not registered")
+        return metadata
+
+    def load(self, version: str):
+        '''
+            Loads a registered model by version, verifying the artifact checksum. The artifact is downloaded into one
+        preallocated buffer (as parallel byte ranges when it is large, see ranged.py), hashed and unpickled in place.
+        '''
+        metadata = self.metadata(version)
+        cache_key = (self.bucket, metadata["artifact"])
+        if cache_key not in _MODELS:
+            body, head = open_object(self.bucket, metadata["artifact"])
+            artifact = RangedDownload(self.bucket, metadata["artifact"], head, first=body).wait()
+            if hashlib.sha256(artifact).hexdigest() != metadata["sha256"]:
+                raise ValueError(f"Model artifact {metadata['artifact']} does not match its registered checksum")
+            _MODELS[cache_key] = load(open_buffer(artifact))
+        return _MODELS[cache_key]
+
+    def record_metrics(self, version: str, metrics: dict) -> dict:
+        '''
+            Adds evaluation metrics to a registered version.
+        '''
+        metadata = dict(self.metadata(version))
+        metadata["metrics"] = {**metadata.get("metrics", {}), **metrics}
+        self._write(self.metadata_key(version), metadata)
+        self._update_index(version, metadata)
+        return metadata
+
+    # *********************************************
+    # Champion
+    #*********************************************
+
+    def champion(self) -> dict:
+        '''
+            returns:
+                champion pointer {"version", "artifact", "sha256", "metrics", "promoted_at", "previous"},
+                or None before the first promotion
+        '''
+        return self._read(f"{self.prefix}/champion.json")
+
+    def promote(self, version: str, expected=_ANY) -> dict:
+        '''
+            Atomically points the champion at a registered version.
+
+            args:
+                version: registered model version
+                expected: champion version the challenger was compared against (None: no champion). The pointer
+                          is only replaced while it still points at that version, so a run can never replace a
+                          champion it was not compared with; ChampionChanged is raised instead
+        '''
+        metadata = self.metadata(version)
+
+        def replace_champion(current: dict) -> dict:
+            if current and current["version"] == version:
+                return current
+            if expected is not _ANY and (current["version"] if current else None) != expected:
+                raise ChampionChanged(f"The champion is {current['version'] if current else None}, not {expected}")
+            return {
+                "version": version,
+                "artifact": metadata["artifact"],
+                "sha256": metadata["sha256"],
+                "metrics": metadata.get("metrics", {}),
+                "promoted_at": datetime.datetime.utcnow().isoformat(),
+                "previous": current["version"] if current else None
+            }
+
+        pointer = self.update(f"{self.prefix}/champion.json", replace_champion)
+        if self.deployment()["challenger"] == version:
+            self.set_deployment(None, None, 0.0)
+        return pointer
+
+    def load_champion(self) -> tuple:
+        '''
+            returns:
+                (champion pointer, model), or (None, None) before the first promotion
+        '''
+        pointer = self.champion()
+        if pointer is None:
+            return None, None
+        return pointer, self.load(pointer["version"])
+
+    # *********************************************
+    # Challenger rollout
+    #*********************************************
+
+    def deployment(self) -> dict:
+        '''
+            returns:
+                {"challenger": version or None, "mode": "canary" or "shadow", "share": float}; a canary serves
+                share of the requests with the challenger, shadow scores share of the requests with it off the
+                response path
+        '''
+        return self._read(f"{self.prefix}/deployment.json") or {"challenger": None, "mode": None, "share": 0.0}
+
+    def set_deployment(self, challenger: str, mode: str, share: float) -> dict:
+        '''
+            Starts (or, with challenger None, ends) the rollout of a registered challenger version.
+        '''
+        if challenger is not None:
+            if mode not in ("canary", "shadow"):
+                raise ValueError(f"Unsupported rollout mode: {mode}")
+            if not 0.0 <= share <= 1.0:
+                raise ValueError(f"Rollout share must be between 0 and 1, got {share}")
+            self.metadata(challenger)
+        deployment = {
+            "challenger": challenger,
+            "mode": mode,
+            "share": share,
+            "updated_at": datetime.datetime.utcnow().isoformat()
+        }
+        self._write(f"{self.prefix}/deployment.json", deployment)
+        return deployment
@@ -0,0 +1,57 @@
+import functools
+from botocore.exceptions import ClientError, EndpointConnectionError, ConnectionClosedError, ReadTimeoutError
+
+
+# *********************************************
+# Transient AWS errors
+#
+# The state machine retries a failed task by the name of the error it raised, and boto3 raises every failed
+# request as ClientError, whether it was throttled (SlowDown), failed on the server side (5xx) or was refused
+# for good (AccessDenied, NoSuchKey, a validation error). Stage handlers are wrapped in retryable, which
+# re-raises throttling, server-side and connection errors as TransientAWSError: only those are retried with
+# backoff (TASK_RETRY in training_pipeline/stages.py), every other error fails the execution right away with
+# its own name and message.
+#*********************************************
+
+TRANSIENT_ERROR_CODES = {
+    "SlowDown",
+    "Throttling",
+    "ThrottlingException",
+    "RequestLimitExceeded",
+    "ProvisionedThroughputExceededException",
+    "InternalError",
+    "ServiceUnavailable",
+    "RequestTimeout"
+}
+
+
+class TransientAWSError(Exception):
+    '''
+        An AWS request was throttled, failed on the server side, or lost its connection. The error name is retried
+        by the state machine.
+    '''
+
+
+def is_transient(error: Exception) -> bool:
+    if isinstance(error, (EndpointConnectionError, ConnectionClosedError, ReadTimeoutError)):
+        return True
+    if isinstance(error, ClientError):
+        status = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode") or 0
+        return error.response.get("Error", {}).get("Code") in TRANSIENT_ERROR_CODES or status >= 500
+    return False
+
+
+def retryable(handler):
+    '''
+        Lambda handler decorator re-raising transient AWS errors as TransientAWSError (the original error is
+        chained as its cause).
+    '''
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        try:
+            return handler(event, context)
+        except Exception as error:
+            if is_transient(error):
+                raise TransientAWSError(f"{type(error).__name__}: {error}") from error
+            raise
+    return wrapper
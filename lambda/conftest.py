@@ -0,0 +1,107 @@
+import os
+import sys
+import json
+import importlib
+import pytest
+
+
+# *********************************************
+# Shared fixtures of the stage tests (lambda/<stage>/tests)
+#
+# Stage code imports its helper modules by bare name (from registry import ModelRegistry), as it does inside
+# its image, where the shared modules of lambda/common sit next to the stage's own code. Several stages ship
+# modules with the same name (utils, lambda_function), and the shared modules import them (handoff imports
+# utils). A test imports a stage through the stage fixture, which puts only that stage's Lambda code directory
+# and lambda/common on sys.path and evicts every module of the previously imported stage (the shared ones
+# included), so each test sees exactly the modules of the image it tests.
+# S3 (and DynamoDB) are moto stand-ins started before any stage module is imported.
+#*********************************************
+
+LAMBDA_DIR = os.path.dirname(os.path.abspath(__file__))
+
+COMMON_DIR = os.path.join(LAMBDA_DIR, "common")
+
+BUCKET = "pr-test-regression-bucket"
+
+
+class StageImage:
+    '''
+        Modules of one stage image, imported on attribute access: stage("model-training").registry.
+    '''
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def __getattr__(self, module: str):
+        return importlib.import_module(module)
+
+
+def stage_modules(directory: str) -> list:
+    return [name[:-3] for name in os.listdir(directory) if name.endswith(".py")]
+
+
+@pytest.fixture
+def aws(monkeypatch):
+    '''
+        moto stand-in for AWS with the project bucket of the "test" environment of the "regression" project.
+    '''
+    from moto import mock_aws
+    import boto3
+
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    monkeypatch.setenv("ENVIRONMENT", "test")
+    monkeypatch.setenv("PROJECT", "regression")
+    with mock_aws():
+        boto3.client("s3").create_bucket(Bucket=BUCKET)
+        yield BUCKET
+
+
+@pytest.fixture
+def stage(aws):
+    '''
+        stage(name) returns the StageImage of lambda/<name>/lambda, replacing the stage imported before it.
+    '''
+    loaded = []
+
+    def evict() -> None:
+        for directory in loaded:
+            for name in stage_modules(directory):
+                sys.modules.pop(name, None)
+            if directory in sys.path:
+                sys.path.remove(directory)
+        loaded.clear()
+
+    def load(name: str) -> StageImage:
+        evict()
+        directory = os.path.join(LAMBDA_DIR, name, "lambda")
+        # Modules of the same names cached by an earlier test (or a bundled copy) are not this image's
+        for module in stage_modules(directory) + stage_modules(COMMON_DIR):
+            sys.modules.pop(module, None)
+        sys.path[:0] = [directory, COMMON_DIR]
+        loaded.extend([directory, COMMON_DIR])
+        return StageImage(directory)
+
+    yield load
+    evict()
+
+
+
+def run_parameters(run_id: str, **parameters) -> dict:
+    return {"RunId": run_id, "RunDate": "2026-10-19", "Environment": "test", "Project": "regression", **parameters}
+
+
+@pytest.fixture
+def run_stage(stage):
+    '''
+        run_stage(name, run_id, event_input=None, handler=..., **parameters) invokes a stage's Lambda handler with
+        the run parameters of run_id (plus parameters) and any other state of the execution input, the way its
+        state machine task does.
+    '''
+    def run(name: str, run_id: str, event_input: dict = None, handler: str = "lambda_function.lambda_handler", **parameters):
+        module, function = handler.rsplit(".", 1)
+        image = stage(name)
+        event = {"Input": {**(event_input or {}), "RunParameters": json.dumps(run_parameters(run_id, **parameters))}}
+        return getattr(getattr(image, module), function)(event, None)
+
+    return run
@@ -0,0 +1,186 @@
+import os
+import json
+import asyncio
+import boto3
+from botocore.exceptions import ClientError
+
+from handoff import DatasetHandoff, decode_array
+from lineage import StageLineage
+from checkpoints import StageCheckpoint
+from retries import retryable
+from registry import ModelRegistry
+from sketches import DatasetSketch, psi, ks
+from utils import read_array, stream_csv, write_json
+
+
+# *********************************************
+# Data drift detection (image CMD override of the data-preparation image)
+#
+# Data preparation records sketches of the training features (sketches.json), and the registry keeps their
+# key in the lineage of every model version. This stage streams the run's inference data through sketches
+# with the same bin edges as the champion's training sketches, merges them into the running inference sketch
+# of the champion (models/registry/<model>/drift/<champion version>/inference-sketches.json), and scores the
+# drift of every feature (PSI and KS). Its RetrainNeeded result drives the "Retrain Needed" Choice state:
+# without a champion, without training sketches, or with a drifted feature the pipeline retrains, otherwise
+# the execution ends.
+#*********************************************
+
+PSI_THRESHOLD = float(os.environ.get("PSI_THRESHOLD", "0.2"))
+KS_THRESHOLD = float(os.environ.get("KS_THRESHOLD", "0.1"))
+
+# Inference rows the running sketch needs before drift is judged; until then the champion is kept
+MIN_DRIFT_ROWS = int(os.environ.get("MIN_DRIFT_ROWS", "1"))
+
+# Run IDs the running sketch remembers, so a retried run does not merge its inference batch twice
+WINDOW_RUNS = 100
+
+# "drift" retrains only on drift (or without a champion to compare with), "always" retrains on every run
+RETRAIN_POLICY = os.environ.get("RETRAIN_POLICY", "drift")
+
+
+def read_sketches(bucket: str, key: str) -> DatasetSketch:
+    '''
+        returns:
+            DatasetSketch stored at key, or None when it does not exist
+    '''
+    try:
+        body = boto3.client("s3").get_object(Bucket=bucket, Key=key)["Body"].read()
+    except ClientError as error:
+        if error.response["Error"]["Code"] in ("404", "NoSuchKey"):
+            return None
+        raise
+    return DatasetSketch.from_dict(json.loads(body))
+
+
+def sketch_inference_data(handoff: DatasetHandoff, key: str, reference: DatasetSketch, chunk_rows: int = 100000) -> DatasetSketch:
+    '''
+        Sketches the inference data over the reference bin edges. CSV data in S3 is streamed in chunks, so memory
+        does not grow with the number of rows, and each chunk is sketched while the next one downloads.
+
+        args:
+            handoff: DatasetHandoff of the run
+            key: S3 key of the inference data when it was not handed off inline
+            reference: training sketches of the champion
+            chunk_rows: rows parsed per chunk
+        returns:
+            DatasetSketch of the inference data
+    '''
+    sketch = reference.empty()
+    entry = handoff.datasets.get("inference-data", {})
+    if "array" in entry:
+        sketch.update(entry["array"])
+    elif "inline" in entry:
+        sketch.update(decode_array(entry["inline"]))
+    else:
+        stored = handoff.stored("inference-data", key)
+        key = entry.get("s3") or (stored["key"] if stored else key)
+        if key.endswith(".npy"):
+            sketch.update(read_array(handoff.bucket, key))
+            return sketch
+        plan = entry.get("dtypes") or (stored["dtypes"] if stored else None)
+
+        async def sketch_chunks() -> None:
+            async for chunk in stream_csv(handoff.bucket, key, plan, chunk_rows):
+                sketch.update(chunk)
+
+        asyncio.run(sketch_chunks())
+    return sketch
+
+
+def drift_scores(reference: DatasetSketch, current: DatasetSketch) -> list:
+    scores = []
+    for column, (expected, actual) in enumerate(zip(reference.features, current.features)):
+        feature_psi, feature_ks = psi(expected, actual), ks(expected, actual)
+        scores.append({
+            "feature": column,
+            "psi": feature_psi,
+            "ks": feature_ks,
+            "drifted": feature_psi > PSI_THRESHOLD or feature_ks > KS_THRESHOLD,
+            "reference": expected.summary(),
+            "inference": actual.summary()
+        })
+    return scores
+
+
+def detect(run_parameters: dict, handoff: DatasetHandoff) -> dict:
+    '''
+        Decides whether the run needs to retrain, recording the inference sketches and a drift report.
+
+        args:
+            run_parameters: run parameters created by the parent Step Function
+            handoff: DatasetHandoff the inference data is read from
+        returns:
+            {"RetrainNeeded": bool, "Reason": str, "ChampionVersion", "InferenceRows", "MaxPsi", "MaxKs"}
+    '''
+    run_id = run_parameters['RunId']
+    run_date = run_parameters['RunDate']
+    project_bucket = f"pr-{run_parameters['Environment']}-{run_parameters['Project']}-bucket"
+    prefix = f"training-pipeline/drift-detection/{run_date}/{run_id}"
+
+    registry = ModelRegistry(project_bucket)
+    pointer = registry.champion()
+    sketches_key = registry.metadata(pointer["version"])["lineage"].get("reference_sketches") if pointer else None
+    reference = read_sketches(project_bucket, sketches_key) if sketches_key else None
+
+    decision = {
+        "RetrainNeeded": True,
+        "ChampionVersion": pointer["version"] if pointer else None,
+        "InferenceRows": None,
+        "MaxPsi": None,
+        "MaxKs": None
+    }
+    if reference is None:
+        decision["Reason"] = "no champion" if pointer is None else "champion has no training sketches"
+        write_json(decision, project_bucket, f"{prefix}/drift-report.json")
+        return decision
+
+    batch = sketch_inference_data(handoff, f"training-pipeline/data-preparation/{run_date}/{run_id}/inference-data.csv", reference)
+    write_json(batch.to_dict(), project_bucket, f"{prefix}/inference-sketches.json")
+
+    # Running sketch of every inference batch seen since the champion was promoted
+    window_key = f"{registry.prefix}/drift/{pointer['version']}/inference-sketches.json"
+    def merge_batch(document: dict) -> dict:
+        # A retried run finds its batch already merged
+        if document and run_id in document.get("runs", []):
+            return document
+        window = DatasetSketch.from_dict(document) if document else reference.empty()
+        window.merge(batch)
+        return {**window.to_dict(), "runs": ((document or {}).get("runs", []) + [run_id])[-WINDOW_RUNS:]}
+
+    # Compare-and-swap merge, so batches of concurrent runs are all counted
+    window = DatasetSketch.from_dict(registry.update(window_key, merge_batch))
+
+    scores = drift_scores(reference, window)
+    drifted = [score["feature"] for score in scores if score["drifted"]]
+    decision["InferenceRows"] = window.rows
+    decision["MaxPsi"] = max(score["psi"] for score in scores)
+    decision["MaxKs"] = max(score["ks"] for score in scores)
+
+    if RETRAIN_POLICY == "always":
+        decision["Reason"] = "retrain policy is always"
+    elif window.rows < MIN_DRIFT_ROWS:
+        decision["RetrainNeeded"], decision["Reason"] = False, f"fewer than {MIN_DRIFT_ROWS} inference rows"
+    elif drifted:
+        decision["Reason"] = f"features {drifted} drifted"
+    else:
+        decision["RetrainNeeded"], decision["Reason"] = False, "no drift"
+
+    write_json({**decision, "window": window_key, "scores": scores}, project_bucket, f"{prefix}/drift-report.json")
+    return decision
+
+
+@retryable
+def lambda_handler(event, context):
+
+    # Reading variables passed in by the parent Step Function
+    run_parameters = json.loads(event['Input']['RunParameters'])
+
+    handoff = DatasetHandoff(event['Input'], f"pr-{run_parameters['Environment']}-{run_parameters['Project']}-bucket")
+    # A resumed run must not merge its inference batch into the drift window twice
+    checkpoint = StageCheckpoint("drift-detection", run_parameters, handoff)
+    if checkpoint.completed():
+        return checkpoint.result
+    with StageLineage("drift-detection", run_parameters, handoff, context) as lineage:
+        decision = detect(run_parameters, handoff)
+        lineage.metrics.update(decision)
+    return checkpoint.complete(decision)
@@ -0,0 +1,143 @@
+from dataclasses import dataclass, asdict
+from typing import Optional
+import numpy as np
+
+
+# *********************************************
+# Synthetic regression data for load and scale testing
+#
+# A run whose run parameters carry a Generator document ({"Rows": 10000000, "Features": 32, "Seed": 7}) prepares
+# a seeded synthetic regression dataset of any size and width instead of the notebook arrays. Features are
+# normal with per-feature means and scales, and labels a linear function of them plus Gaussian noise; the
+# coefficients come from the seed, and every block of a split (CHUNK_BYTES of features) is drawn from its own
+# generator seeded with (seed, split, block index). Chunks of any size (ChunkRows) are cut from those blocks,
+# so a specification always produces the same data whatever its chunking and whatever consumes it. Blocks
+# are generated with vectorized NumPy calls and chunks streamed to the output layout one at a time, so memory
+# is bounded by the chunk and block sizes, not the number of rows.
+#*********************************************
+
+SPLITS = ("train", "test", "inference")
+
+# Bytes of features per generated block, and per chunk when the specification does not set ChunkRows
+CHUNK_BYTES = 16 * 1024 * 1024
+
+
+@dataclass(frozen=True)
+class SyntheticSpec:
+    '''
+        args:
+            rows: training rows
+            features: feature columns
+            test_rows: test rows (a fifth of rows when None)
+            inference_rows: inference rows (a hundredth of rows when None)
+            seed: seed of the coefficients and of every block
+            noise: standard deviation of the label noise
+            chunk_rows: rows per streamed chunk (one block when None); the data does not depend on it
+            dtype: "float64" or "float32"
+    '''
+    rows: int
+    features: int = 1
+    test_rows: Optional[int] = None
+    inference_rows: Optional[int] = None
+    seed: int = 0
+    noise: float = 1.0
+    chunk_rows: Optional[int] = None
+    dtype: str = "float64"
+
+    @classmethod
+    def from_parameters(cls, parameters: dict) -> "SyntheticSpec":
+        '''
+            Specification from the Generator run parameter (Rows, Features, TestRows, InferenceRows, Seed, Noise,
+            ChunkRows, Dtype).
+        '''
+        spec = cls(
+            rows=int(parameters["Rows"]),
+            features=int(parameters.get("Features", 1)),
+            test_rows=int(parameters["TestRows"]) if parameters.get("TestRows") is not None else None,
+            inference_rows=int(parameters["InferenceRows"]) if parameters.get("InferenceRows") is not None else None,
+            seed=int(parameters.get("Seed", 0)),
+            noise=float(parameters.get("Noise", 1.0)),
+            chunk_rows=int(parameters["ChunkRows"]) if parameters.get("ChunkRows") is not None else None,
+            dtype=parameters.get("Dtype", "float64")
+        )
+        if spec.rows < 2 or spec.features < 1:
+            raise ValueError(f"Generator needs at least 2 rows and 1 feature: {parameters}")
+        if spec.dtype not in ("float64", "float32"):
+            raise ValueError(f"Unsupported generator dtype: {spec.dtype}")
+        return spec
+
+    def split_rows(self, split: str) -> int:
+        if split == "train":
+            return self.rows
+        if split == "test":
+            return self.test_rows if self.test_rows is not None else max(self.rows // 5, 1)
+        return self.inference_rows if self.inference_rows is not None else max(self.rows // 100, 1)
+
+    def rows_per_block(self) -> int:
+        return max(CHUNK_BYTES // (self.features * np.dtype(self.dtype).itemsize), 1)
+
+    def rows_per_chunk(self) -> int:
+        return self.chunk_rows if self.chunk_rows is not None else self.rows_per_block()
+
+    def to_dict(self) -> dict:
+        return {**asdict(self), "chunk_rows": self.rows_per_chunk()}
+
+
+def coefficients(spec: SyntheticSpec) -> dict:
+    '''
+        Feature means and scales, weights and intercept of the synthetic regression, drawn from the seed.
+    '''
+    # A stream of its own, distinct from the (seed, split, chunk index) streams of the chunks
+    rng = np.random.default_rng([spec.seed, len(SPLITS)])
+    return {
+        "loc": rng.uniform(-10, 10, spec.features),
+        "scale": rng.uniform(0.5, 5, spec.features),
+        "weights": rng.normal(0, 2, spec.features),
+        "intercept": float(rng.uniform(-10, 10))
+    }
+
+
+def generate_block(spec: SyntheticSpec, split: str, model: dict, index: int) -> tuple:
+    '''
+        (features, labels) of one block of a split, drawn from the generator of (seed, split, block index).
+    '''
+    dtype = np.dtype(spec.dtype)
+    loc, scale, weights = (model[name].astype(dtype) for name in ("loc", "scale", "weights"))
+    rows, block_rows = spec.split_rows(split), spec.rows_per_block()
+    rng = np.random.default_rng([spec.seed, SPLITS.index(split), index])
+    features = rng.standard_normal((min(block_rows, rows - index * block_rows), spec.features), dtype=dtype)
+    features *= scale
+    features += loc
+    if split == "inference":
+        return features, None
+    labels = features @ weights
+    labels += dtype.type(model["intercept"])
+    labels += dtype.type(spec.noise) * rng.standard_normal(len(features), dtype=dtype)
+    return features, labels
+
+
+def generate(spec: SyntheticSpec, split: str):
+    '''
+        Yields (features, labels) chunks of a split; labels is None for the inference split.
+    '''
+    model = coefficients(spec)
+    rows, chunk_rows, block_rows = spec.split_rows(split), spec.rows_per_chunk(), spec.rows_per_block()
+    block, block_index = None, None
+    for start in range(0, rows, chunk_rows):
+        stop = min(start + chunk_rows, rows)
+        parts = []
+        position = start
+        while position < stop:
+            if position // block_rows != block_index:
+                block_index = position // block_rows
+                block = generate_block(spec, split, model, block_index)
+            offset = position - block_index * block_rows
+            end = min(stop - position, len(block[0]) - offset) + offset
+            parts.append((block[0][offset:end], None if block[1] is None else block[1][offset:end]))
+            position += end - offset
+        if len(parts) == 1:
+            # A chunk within one block is a view of it (always, with the default chunking)
+            yield parts[0]
+            continue
+        features = np.concatenate([features for features, _ in parts])
+        yield features, None if split == "inference" else np.concatenate([labels for _, labels in parts])
@@ -1,72 +1,203 @@
-import uuid
+import os
 import json
-from io import StringIO
-import s3fs
-import boto3
-import pandas as pd
+from dataclasses import replace
 import numpy as np
 
+from contracts import CONTRACTS, ContractValidator, validate, enforce, enforce_same_rows
+from utils import write_json
+from handoff import DatasetHandoff
+from lineage import StageLineage
+from checkpoints import StageCheckpoint
+from retries import retryable
+from sketches import DatasetSketch
+from partitioned import PartitionedDataset, dataset_root, slice_edges, assign_slices
+from generator import SPLITS, SyntheticSpec, generate
 
+
+# Slices of the partitioned datasets: quantile bins of one training feature, so every slice holds about the
+# same number of training rows
+SLICES = int(os.environ.get("SLICES", "4"))
+SLICE_FEATURE = int(os.environ.get("SLICE_FEATURE", "0"))
+
+
+@retryable
 def lambda_handler(event, context):
     
+    # Reading variables passed in by the parent Step Function
+    run_parameters = json.loads(event['Input']['RunParameters'])
+    
+    handoff = DatasetHandoff(event['Input'], f"pr-{run_parameters['Environment']}-{run_parameters['Project']}-bucket")
+    checkpoint = StageCheckpoint("data-preparation", run_parameters, handoff)
+    if checkpoint.completed():
+        return checkpoint.result
+    with StageLineage("data-preparation", run_parameters, handoff, context) as lineage:
+        lineage.metrics.update(run(run_parameters, handoff))
+    return checkpoint.complete(handoff.output())
+
+
+def run(run_parameters: dict, handoff: DatasetHandoff) -> dict:
+    '''
+        Data preparation stage, shared by the stage Lambda and the fused pipeline.
+        
+        args:
+            run_parameters: run parameters created by the parent Step Function
+            handoff: DatasetHandoff the prepared datasets are handed to
+        returns:
+            {"rows": {dataset: rows}} of the prepared datasets, recorded as lineage metrics
+    '''
+    
     # *********************************************
     # Extract, Validate, and Load training data to S3
     # Helpful for: Data Lineage, Data Provenance, Debugging, Audits
     #*********************************************
     
-    # Reading variables passed in by the parent Step Function
-    run_id = json.loads(event['Input']['RunParameters'])['RunId']
-    run_date = json.loads(event['Input']['RunParameters'])['RunDate']
-    environment = json.loads(event['Input']['RunParameters'])['Environment']
-    project = json.loads(event['Input']['RunParameters'])['Project']
+    # Load and scale test runs prepare seeded synthetic data instead
+    if run_parameters.get('Generator'):
+        return run_generated(run_parameters, handoff, SyntheticSpec.from_parameters(run_parameters['Generator']))
+    
+    run_id = run_parameters['RunId']
+    run_date = run_parameters['RunDate']
+    environment = run_parameters['Environment']
+    project = run_parameters['Project']
     
     project_bucket = f"pr-{environment}-{project}-bucket"
     prefix = f"training-pipeline/data-preparation/{run_date}/{run_id}"
 
     train_features = np.array([6, 16, 26, 36, 46, 56, 64]).reshape((-1, 1))
-    assert train_features.shape == (7, 1)
-    assert train_features.dtype == "int64"
-
     train_labels = np.array([4, 18, 20, 22, 24, 35, 45])
-    assert train_labels.shape == (7,)
-    assert train_labels.dtype == "int64"
-
-    assert train_features.shape[0] == train_labels.shape[0]
 
     # We need test_features and test_labels for evaluation (canonical test set)
     test_features = np.array([1, 12, 24, 36, 48, 60, 72]).reshape((-1,1))
-    assert test_features.shape == (7, 1)
-    assert test_features.dtype == "int64"
-
     test_labels = np.array([3, 9, 20, 29, 42, 53, 60])
-    assert test_labels.shape == (7,)
-    assert test_labels.dtype == "int64"
-
-    assert test_features.shape[0] == test_labels.shape[0]
 
     # The 1 data point represents inference after the model is already deployed, at which time we do not have labels
     # Save for the end depending on time
     inference_data = np.array([1]).reshape((-1,1))
-    assert inference_data.shape == (1, 1)
-    assert inference_data.dtype == "int64"
-    
-    s3_resource = boto3.resource('s3')
 
-    # Write 3 separate CSV files to S3 for Training microservice consumption
     data = {
-        "train-features.csv": train_features, 
-        "train-labels.csv": train_labels, 
-        "test-features.csv": test_features, 
-        "test-labels.csv": test_labels, 
-        "inference-data.csv": inference_data
+        "train-features": train_features, 
+        "train-labels": train_labels, 
+        "test-features": test_features, 
+        "test-labels": test_labels, 
+        "inference-data": inference_data
     }
 
-    for file_name, dataset in data.items():
-        csv_buffer = StringIO()
-        pd.DataFrame(dataset).to_csv(csv_buffer, index=None)
-        s3_resource.Object(project_bucket, f"{prefix}/{file_name}").put(Body=csv_buffer.getvalue())
-        
     # *********************************************
-    # TODO: Log microservice metadata
+    # Validate every dataset against its contract; all reports are recorded before any failure is raised
     #*********************************************
-    
+
+    n_features = train_features.shape[1]
+    contracts = {
+        name: replace(CONTRACTS[name], n_columns=n_features) if CONTRACTS[name].ndim == 2 else CONTRACTS[name]
+        for name in data
+    }
+    reports = {name: validate(contracts[name], dataset) for name, dataset in data.items()}
+
+    for name, report in reports.items():
+        write_json(report, project_bucket, f"{prefix}/validation/{name}.json")
+
+    for name, report in reports.items():
+        enforce(report, contracts[name])
+
+    enforce_same_rows(reports["train-features"], reports["train-labels"])
+    enforce_same_rows(reports["test-features"], reports["test-labels"])
+
+    # Mergeable sketches of the training features, the reference the drift detection stage compares inference
+    # data with once a model trained on this run is the champion
+    write_json(DatasetSketch.reference(train_features).to_dict(), project_bucket, f"{prefix}/sketches.json")
+
+    # Partitioned copies of the datasets (date=<run date>/slice=<slice>, with row-group statistics), from which
+    # per-slice evaluation and incremental training download only the row groups and columns they need. Express
+    # runs (inline handoff) evaluate the whole test set only and write none
+    if not handoff.inline:
+        edges = slice_edges(train_features[:, SLICE_FEATURE], SLICES)
+        feature_names = [f"feature_{column}" for column in range(n_features)]
+        tables = {
+            "train": (np.column_stack([train_features, train_labels]), feature_names + ["label"], train_features),
+            "test": (np.column_stack([test_features, test_labels]), feature_names + ["label"], test_features),
+            "inference": (inference_data, feature_names, inference_data)
+        }
+        for table, (dataset, columns, features) in tables.items():
+            PartitionedDataset(project_bucket, dataset_root(table)).write(
+                dataset, columns, run_date, run_id, assign_slices(features[:, SLICE_FEATURE], edges)
+            )
+
+    # Hand the datasets off to the downstream microservices: separate CSV files in S3, or inline in the
+    # Step Function state for small datasets in the Express state machine
+    for name, dataset in data.items():
+        handoff.write(name, dataset, f"{prefix}/{name}.csv")
+
+    return {"rows": {name: int(len(dataset)) for name, dataset in data.items()}}
+
+
+def run_generated(run_parameters: dict, handoff: DatasetHandoff, spec: SyntheticSpec) -> dict:
+    '''
+        Data preparation of a synthetic dataset (generator.py), streamed chunk by chunk to the same outputs as a
+        regular run: validation reports, training sketches, partitioned datasets (except in Express runs) and
+        handed-off datasets. Every chunk is validated, sketched, and appended to the multipart uploads of its
+        datasets as soon as it is generated, so only one chunk is held in memory. The uploads are completed once
+        every report passed, so downstream stages never see data that failed validation. The first training chunk
+        stands in for the training set where a full pass would be needed: its quantiles are the slice edges and
+        sketch bin edges.
+        
+        args:
+            run_parameters: run parameters created by the parent Step Function
+            handoff: DatasetHandoff the prepared datasets are handed to
+            spec: SyntheticSpec of the Generator run parameter
+        returns:
+            {"rows": {dataset: rows}, "generator": specification}, recorded as lineage metrics
+    '''
+    run_id = run_parameters['RunId']
+    run_date = run_parameters['RunDate']
+    project_bucket = f"pr-{run_parameters['Environment']}-{run_parameters['Project']}-bucket"
+    prefix = f"training-pipeline/data-preparation/{run_date}/{run_id}"
+
+    names = {"train": ("train-features", "train-labels"), "test": ("test-features", "test-labels"), "inference": ("inference-data", None)}
+    feature_names = [f"feature_{column}" for column in range(spec.features)]
+    validators, streams, partitions = {}, {}, {}
+    edges, sketch = None, None
+    try:
+        for split in SPLITS:
+            rows = spec.split_rows(split)
+            features_name, labels_name = names[split]
+            streams[features_name] = handoff.stream(features_name, f"{prefix}/{features_name}.csv", (rows, spec.features), spec.dtype)
+            validators[features_name] = ContractValidator(replace(CONTRACTS[features_name], n_columns=spec.features))
+            if labels_name:
+                streams[labels_name] = handoff.stream(labels_name, f"{prefix}/{labels_name}.csv", (rows,), spec.dtype)
+                validators[labels_name] = ContractValidator(CONTRACTS[labels_name])
+            columns = feature_names + (["label"] if labels_name else [])
+            if not handoff.inline:
+                partitions[split] = PartitionedDataset(project_bucket, dataset_root(split)).writer(columns, [spec.dtype] * len(columns), run_date, run_id)
+
+            for features, labels in generate(spec, split):
+                if edges is None:
+                    edges = slice_edges(features[:, SLICE_FEATURE], SLICES)
+                    sketch = DatasetSketch.reference(features)
+                elif split == "train":
+                    sketch.update(features)
+                for name, chunk in ((features_name, features), (labels_name, labels)):
+                    if name:
+                        validators[name].update(chunk)
+                        streams[name].write(chunk)
+                if split in partitions:
+                    partitions[split].append(
+                        np.column_stack([features, labels]) if labels_name else features, assign_slices(features[:, SLICE_FEATURE], edges)
+                    )
+
+        reports = {name: validator.report() for name, validator in validators.items()}
+        for name, report in reports.items():
+            write_json(report, project_bucket, f"{prefix}/validation/{name}.json")
+        for name, report in reports.items():
+            enforce(report, validators[name].contract)
+        enforce_same_rows(reports["train-features"], reports["train-labels"])
+        enforce_same_rows(reports["test-features"], reports["test-labels"])
+    except BaseException:
+        for writer in list(streams.values()) + list(partitions.values()):
+            writer.abort()
+        raise
+
+    write_json(sketch.to_dict(), project_bucket, f"{prefix}/sketches.json")
+    for writer in list(partitions.values()) + list(streams.values()):
+        writer.close()
+
+    return {"rows": {name: stream.rows for name, stream in streams.items()}, "generator": spec.to_dict()}
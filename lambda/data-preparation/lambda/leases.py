@@ -0,0 +1,223 @@
+import os
+import json
+import time
+import fcntl
+import random
+import tempfile
+import boto3
+from botocore.exceptions import ClientError
+
+from retries import retryable
+
+
+# *********************************************
+# Run leases (image CMD override of the data-preparation image)
+#
+# A project runs at most MAX_CONCURRENT_RUNS pipeline executions at a time. Every execution holds one of the
+# project's numbered slots while it runs: "Acquire Run Lease" claims a free (or expired) slot with a
+# conditional write before the first stage, and "Release Run Lease" frees it after the last one. An execution
+# that finds every slot taken fails with LeaseUnavailable, which the state machine retries with backoff, so
+# executions past the cap queue instead of competing for Lambda concurrency, S3 request rates, and the
+# registry. Leases expire after LEASE_SECONDS (the state machine timeout), so an execution that never reaches
+# the release still gives its slot back.
+#
+# The slots are items of a DynamoDB table (LEASE_TABLE: partition key Project, sort key Slot, TTL on
+# ExpiresAt; Project is a reserved word, so expressions name attributes through placeholders). Without a
+# table, a JSON file under an exclusive file lock stands in for it with the same conditional semantics, so
+# pipelines run locally (several processes on one machine) are capped the same way.
+#*********************************************
+
+MAX_CONCURRENT_RUNS = int(os.environ.get("MAX_CONCURRENT_RUNS", "10"))
+
+# Lifetime of a lease; the state machine times executions out after as long
+LEASE_SECONDS = int(os.environ.get("LEASE_SECONDS", str(6 * 3600)))
+
+# Local stand-in for the lease table
+LEASE_FILE = os.environ.get("LEASE_FILE", os.path.join(tempfile.gettempdir(), "run-leases.json"))
+
+
+class LeaseUnavailable(Exception):
+    '''
+        Every slot of the project is held by a running execution. The error name is retried by the state machine.
+    '''
+
+
+class DynamoDBLeases:
+    '''
+        Lease slots stored as DynamoDB items, claimed and freed with conditional writes.
+
+        args:
+            table: DynamoDB table name
+    '''
+    def __init__(self, table: str):
+        self.table = table
+        self.dynamodb = boto3.client("dynamodb")
+
+    def holders(self, project: str) -> dict:
+        '''
+            returns:
+                {slot: {"Holder", "ExpiresAt"}} of every slot item of the project, expired ones included
+        '''
+        response = self.dynamodb.query(
+            TableName=self.table,
+            KeyConditionExpression="#project = :project",
+            ExpressionAttributeNames={"#project": "Project"},
+            ExpressionAttributeValues={":project": {"S": project}},
+            ConsistentRead=True
+        )
+        return {
+            int(item["Slot"]["N"]): {"Holder": item["Holder"]["S"], "ExpiresAt": int(item["ExpiresAt"]["N"])}
+            for item in response["Items"]
+        }
+
+    def claim(self, project: str, slot: int, holder: str, expires_at: int, now: int) -> bool:
+        '''
+            Takes a slot that is free, expired, or already held by holder. Returns False when another holder has it.
+        '''
+        try:
+            self.dynamodb.put_item(
+                TableName=self.table,
+                Item={
+                    "Project": {"S": project},
+                    "Slot": {"N": str(slot)},
+                    "Holder": {"S": holder},
+                    "ExpiresAt": {"N": str(expires_at)}
+                },
+                ConditionExpression="attribute_not_exists(#project) OR #expires < :now OR #holder = :holder",
+                ExpressionAttributeNames={"#project": "Project", "#expires": "ExpiresAt", "#holder": "Holder"},
+                ExpressionAttributeValues={":now": {"N": str(now)}, ":holder": {"S": holder}}
+            )
+        except ClientError as error:
+            if error.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                return False
+            raise
+        return True
+
+    def free(self, project: str, slot: int, holder: str) -> bool:
+        '''
+            Frees a slot still held by holder. Returns False when it is not (expired and claimed by another holder).
+        '''
+        try:
+            self.dynamodb.delete_item(
+                TableName=self.table,
+                Key={"Project": {"S": project}, "Slot": {"N": str(slot)}},
+                ConditionExpression="#holder = :holder",
+                ExpressionAttributeNames={"#holder": "Holder"},
+                ExpressionAttributeValues={":holder": {"S": holder}}
+            )
+        except ClientError as error:
+            if error.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                return False
+            raise
+        return True
+
+
+class LocalLeases:
+    '''
+        Stand-in for DynamoDBLeases: lease slots in a JSON file, read and written under an exclusive file lock.
+
+        args:
+            path: lease file, created on first use
+    '''
+    def __init__(self, path: str):
+        self.path = path
+
+    def _locked(self, change):
+        '''
+            Applies change to the {project: {slot: lease}} document of the file while holding its lock.
+        '''
+        with open(self.path, "a+") as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            file.seek(0)
+            text = file.read()
+            leases = json.loads(text) if text else {}
+            result = change(leases)
+            file.seek(0)
+            file.truncate()
+            json.dump(leases, file)
+            return result
+
+    def holders(self, project: str) -> dict:
+        return self._locked(lambda leases: {int(slot): lease for slot, lease in leases.get(project, {}).items()})
+
+    def claim(self, project: str, slot: int, holder: str, expires_at: int, now: int) -> bool:
+        def change(leases: dict) -> bool:
+            lease = leases.setdefault(project, {}).get(str(slot))
+            if lease is not None and lease["ExpiresAt"] >= now and lease["Holder"] != holder:
+                return False
+            leases[project][str(slot)] = {"Holder": holder, "ExpiresAt": expires_at}
+            return True
+        return self._locked(change)
+
+    def free(self, project: str, slot: int, holder: str) -> bool:
+        def change(leases: dict) -> bool:
+            lease = leases.get(project, {}).get(str(slot))
+            if lease is None or lease["Holder"] != holder:
+                return False
+            del leases[project][str(slot)]
+            return True
+        return self._locked(change)
+
+
+def lease_table():
+    '''
+        returns:
+            DynamoDBLeases of LEASE_TABLE, or LocalLeases of LEASE_FILE when no table is configured
+    '''
+    table = os.environ.get("LEASE_TABLE")
+    return DynamoDBLeases(table) if table else LocalLeases(LEASE_FILE)
+
+
+def acquire(table, project: str, holder: str, slots: int = MAX_CONCURRENT_RUNS, seconds: int = LEASE_SECONDS, now: int = None) -> dict:
+    '''
+        Claims one of the project's slots for holder. A holder that already has a slot gets it back, so a retried
+        acquisition never takes a second one.
+
+        args:
+            table: DynamoDBLeases or LocalLeases
+            project: project whose executions are capped
+            holder: run ID of the execution
+            slots: maximum concurrent executions of the project
+            seconds: lease lifetime
+            now: epoch seconds (defaults to the current time)
+        returns:
+            {"Project", "Slot", "Holder", "ExpiresAt"}
+        raises:
+            LeaseUnavailable when every slot is held
+    '''
+    now = int(time.time()) if now is None else now
+    held = table.holders(project)
+    owned = [slot for slot, lease in held.items() if lease["Holder"] == holder and slot < slots]
+    free = [slot for slot in range(slots) if slot not in held or held[slot]["ExpiresAt"] < now]
+    # Executions starting together try the free slots in different orders instead of all racing for the first
+    random.shuffle(free)
+    for slot in owned + free:
+        if table.claim(project, slot, holder, now + seconds, now):
+            return {"Project": project, "Slot": slot, "Holder": holder, "ExpiresAt": now + seconds}
+    raise LeaseUnavailable(f"All {slots} run slots of {project} are held")
+
+
+def release(table, lease: dict) -> bool:
+    '''
+        Frees a lease returned by acquire. Returns False when it had already expired and been claimed again.
+    '''
+    return table.free(lease["Project"], lease["Slot"], lease["Holder"])
+
+
+@retryable
+def lambda_handler(event, context):
+    '''
+        {"Action": "acquire", "Input": state} claims a slot for the run and returns its lease;
+        {"Action": "release", "Input": state} frees the lease the state holds (state["Lease"]["Payload"]).
+    '''
+    table = lease_table()
+    if event["Action"] == "release":
+        lease = event["Input"]["Lease"]["Payload"]
+        released = release(table, lease)
+        print(f"Run slot {lease['Slot']} of {lease['Project']} {'released' if released else 'had already expired'}")
+        return {"Released": released}
+
+    run_parameters = json.loads(event["Input"]["RunParameters"])
+    lease = acquire(table, run_parameters["Project"], run_parameters["RunId"])
+    print(f"Run {lease['Holder']} holds run slot {lease['Slot']} of {lease['Project']}")
+    return lease
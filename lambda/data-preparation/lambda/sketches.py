@@ -0,0 +1,203 @@
+import math
+import numpy as np
+
+
+# *********************************************
+# Mergeable per-feature sketches
+#
+# A feature sketch counts values in fixed bins whose edges are the training quantiles of the feature (the
+# training minimum and maximum are the outermost edges, so values outside the training range land in an
+# underflow or overflow bin), and keeps mean/variance accumulators plus the minimum and maximum. Its size only
+# depends on the number of bins, updating it is one vectorized pass per chunk, and two sketches over the same
+# edges merge exactly by adding counts (Chan et al. for the mean and variance). Sketches of inference batches
+# use the edges of the training sketch, so the two distributions can be compared bin by bin (PSI, KS).
+#*********************************************
+
+# Quantile bins per feature of a training sketch
+DEFAULT_BINS = 20
+
+# Floor of empty bin proportions in PSI, so an empty bin does not make the score infinite
+PSI_EPSILON = 1e-4
+
+
+class FeatureSketch:
+    '''
+        args:
+            edges: increasing bin edges (len(edges) + 1 bins, including underflow and overflow)
+    '''
+    def __init__(self, edges):
+        self.edges = np.asarray(edges, dtype=np.float64)
+        self.counts = np.zeros(len(self.edges) + 1, dtype=np.int64)
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+
+    @classmethod
+    def reference(cls, values: np.array, bins: int = DEFAULT_BINS) -> "FeatureSketch":
+        '''
+            Sketch of a training feature, with edges at its quantiles.
+        '''
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if values.size == 0:
+            raise ValueError("Cannot build a reference sketch from a feature without values")
+        sketch = cls(np.unique(np.quantile(values, np.linspace(0, 1, bins + 1))))
+        sketch.update(values)
+        return sketch
+
+    def empty(self) -> "FeatureSketch":
+        '''
+            An empty sketch over the same edges, e.g. for an inference batch.
+        '''
+        return FeatureSketch(self.edges)
+
+    def update(self, values: np.array) -> None:
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[~np.isnan(values)]
+        if values.size == 0:
+            return
+        bins = np.searchsorted(self.edges, values, side="right")
+        # The training maximum belongs to the last regular bin, not to the overflow bin
+        bins[values == self.edges[-1]] = len(self.edges) - 1
+        self.counts += np.bincount(bins, minlength=len(self.counts))
+        self._combine(values.size, float(values.mean()), float(((values - values.mean()) ** 2).sum()))
+        self.minimum = min(self.minimum, float(values.min()))
+        self.maximum = max(self.maximum, float(values.max()))
+
+    def _combine(self, count: int, mean: float, m2: float) -> None:
+        total = self.count + count
+        delta = mean - self.mean
+        self.m2 += m2 + delta ** 2 * self.count * count / total
+        self.mean += delta * count / total
+        self.count = total
+
+    def merge(self, other: "FeatureSketch") -> None:
+        if not np.array_equal(self.edges, other.edges):
+            raise ValueError("Sketches with different bin edges cannot be merged")
+        if other.count == 0:
+            return
+        self.counts += other.counts
+        self._combine(other.count, other.mean, other.m2)
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+
+    @property
+    def variance(self) -> float:
+        return self.m2 / self.count if self.count else None
+
+    def proportions(self) -> np.array:
+        return self.counts / self.count if self.count else np.zeros(len(self.counts))
+
+    def quantile(self, q: float) -> float:
+        '''
+            returns:
+                estimate of the q-quantile, interpolated within its bin; None for an empty sketch
+        '''
+        if self.count == 0:
+            return None
+        lower = np.concatenate([[min(self.minimum, self.edges[0])], self.edges])
+        upper = np.concatenate([self.edges, [max(self.maximum, self.edges[-1])]])
+        cumulative = np.cumsum(self.counts)
+        rank = q * self.count
+        index = min(int(np.searchsorted(cumulative, rank, side="left")), len(self.counts) - 1)
+        before = cumulative[index - 1] if index else 0
+        within = (rank - before) / self.counts[index] if self.counts[index] else 0.0
+        value = lower[index] + within * (upper[index] - lower[index])
+        return float(min(max(value, self.minimum), self.maximum))
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": self.mean if self.count else None,
+            "std": math.sqrt(self.variance) if self.count else None,
+            "min": self.minimum if self.count else None,
+            "p50": self.quantile(0.5),
+            "max": self.maximum if self.count else None
+        }
+
+    def to_dict(self) -> dict:
+        return {
+            "edges": self.edges.tolist(),
+            "counts": self.counts.tolist(),
+            "count": self.count,
+            "mean": self.mean,
+            "m2": self.m2,
+            "min": self.minimum if self.count else None,
+            "max": self.maximum if self.count else None,
+            "summary": self.summary()
+        }
+
+    @classmethod
+    def from_dict(cls, document: dict) -> "FeatureSketch":
+        sketch = cls(document["edges"])
+        sketch.counts = np.asarray(document["counts"], dtype=np.int64)
+        sketch.count = document["count"]
+        sketch.mean = document["mean"]
+        sketch.m2 = document["m2"]
+        if sketch.count:
+            sketch.minimum = document["min"]
+            sketch.maximum = document["max"]
+        return sketch
+
+
+class DatasetSketch:
+    '''
+        One FeatureSketch per column of a feature matrix.
+
+        args:
+            features: list of FeatureSketch, in column order
+    '''
+    def __init__(self, features: list):
+        self.features = features
+
+    @classmethod
+    def reference(cls, dataset: np.array, bins: int = DEFAULT_BINS) -> "DatasetSketch":
+        dataset = np.asarray(dataset).reshape((len(dataset), -1))
+        return cls([FeatureSketch.reference(dataset[:, column], bins) for column in range(dataset.shape[1])])
+
+    def empty(self) -> "DatasetSketch":
+        return DatasetSketch([feature.empty() for feature in self.features])
+
+    @property
+    def rows(self) -> int:
+        return self.features[0].count if self.features else 0
+
+    def update(self, chunk: np.array) -> None:
+        chunk = np.asarray(chunk).reshape((len(chunk), -1))
+        if chunk.shape[1] != len(self.features):
+            raise ValueError(f"Expected {len(self.features)} columns, got {chunk.shape[1]}")
+        for column, feature in enumerate(self.features):
+            feature.update(chunk[:, column])
+
+    def merge(self, other: "DatasetSketch") -> None:
+        if len(other.features) != len(self.features):
+            raise ValueError("Sketches with different numbers of features cannot be merged")
+        for feature, other_feature in zip(self.features, other.features):
+            feature.merge(other_feature)
+
+    def to_dict(self) -> dict:
+        return {"features": [feature.to_dict() for feature in self.features]}
+
+    @classmethod
+    def from_dict(cls, document: dict) -> "DatasetSketch":
+        return cls([FeatureSketch.from_dict(feature) for feature in document["features"]])
+
+
+def psi(reference: FeatureSketch, current: FeatureSketch) -> float:
+    '''
+        Population stability index of the current distribution against the reference one, over the reference bins
+        (rule of thumb: < 0.1 stable, 0.1 - 0.2 moderate shift, > 0.2 significant shift).
+    '''
+    expected = np.maximum(reference.proportions(), PSI_EPSILON)
+    actual = np.maximum(current.proportions(), PSI_EPSILON)
+    return float(np.sum((actual - expected) * np.log(actual / expected)))
+
+
+def ks(reference: FeatureSketch, current: FeatureSketch) -> float:
+    '''
+        Kolmogorov-Smirnov statistic evaluated at the reference bin edges: the largest gap between the two
+        cumulative distributions.
+    '''
+    return float(np.max(np.abs(np.cumsum(reference.proportions()) - np.cumsum(current.proportions()))))
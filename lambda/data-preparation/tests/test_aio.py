@@ -0,0 +1,100 @@
+import asyncio
+import threading
+import pytest
+
+
+@pytest.fixture
+def aio(stage):
+    return stage("data-preparation").aio
+
+
+class Source:
+    '''
+        Blocking iterator of 0, 1, ... that counts the items pulled from it, optionally failing at one of them.
+    '''
+    def __init__(self, items: int, fail_at: int = None):
+        self.items = items
+        self.fail_at = fail_at
+        self.pulled = 0
+        self.lock = threading.Lock()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        with self.lock:
+            if self.pulled == self.fail_at:
+                raise ValueError(f"item {self.pulled} is corrupt")
+            if self.pulled == self.items:
+                raise StopIteration
+            self.pulled += 1
+            return self.pulled - 1
+
+
+async def settle(source: Source, pulled: int = None) -> None:
+    '''
+        Lets the producer run until it has pulled pulled items (or for a while), then a little longer, so it is
+        blocked on the full queue.
+    '''
+    for _ in range(400):
+        if pulled is not None and source.pulled >= pulled:
+            break
+        await asyncio.sleep(0.005)
+    await asyncio.sleep(0.02)
+
+
+def test_items_arrive_in_order(aio):
+    async def consume():
+        return [item async for item in aio.prefetch(Source(100), depth=3)]
+
+    assert asyncio.run(consume()) == list(range(100))
+
+
+@pytest.mark.parametrize("depth", [1, 2, 4])
+def test_prefetch_stays_within_depth(aio, depth):
+    source = Source(20)
+
+    async def consume():
+        consumed = 0
+        async for _ in aio.prefetch(source, depth=depth):
+            consumed += 1
+            await settle(source, min(consumed + depth + 1, 20))
+            # The queue holds depth items and the producer holds one more waiting for space
+            assert source.pulled <= min(consumed + depth + 1, 20)
+            assert source.pulled == min(consumed + depth + 1, 20)
+        return consumed
+
+    assert asyncio.run(consume()) == 20
+
+
+def test_producer_errors_reach_the_consumer(aio):
+    received = []
+
+    async def consume():
+        async for item in aio.prefetch(Source(10, fail_at=4)):
+            received.append(item)
+
+    with pytest.raises(ValueError, match="item 4 is corrupt"):
+        asyncio.run(consume())
+    assert received == [0, 1, 2, 3]
+
+
+def test_producer_stops_when_the_consumer_stops(aio):
+    source = Source(1000)
+
+    async def consume():
+        stream = aio.prefetch(source, depth=2)
+        async for item in stream:
+            if item == 2:
+                break
+        await stream.aclose()
+        await asyncio.sleep(0.05)
+        stopped_at = source.pulled
+        await asyncio.sleep(0.2)
+        # The producer task was cancelled, not left blocked on the full queue
+        return stopped_at, [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+
+    stopped_at, pending = asyncio.run(consume())
+    assert pending == []
+    assert stopped_at <= 3 + 2 + 1
+    assert source.pulled == stopped_at
@@ -0,0 +1,104 @@
+import boto3
+import numpy as np
+import pytest
+
+RUN = {"RunId": "run-1", "RunDate": "2026-10-19"}
+
+PREPARED = "training-pipeline/run-1/prepared.csv"
+
+FEATURES = "training-pipeline/run-1/features.csv"
+
+
+@pytest.fixture
+def image(stage):
+    return stage("data-preparation")
+
+
+def dataset(offset: float = 0.0) -> np.array:
+    return np.arange(40, dtype=np.float64).reshape(20, 2) + offset
+
+
+def prepare(image, bucket: str, offset: float = 0.0) -> dict:
+    '''
+        First stage: writes the prepared dataset and completes its checkpoint.
+    '''
+    handoff = image.handoff.DatasetHandoff({}, bucket, inline_limit=0)
+    handoff.write("prepared", dataset(offset), PREPARED)
+    return image.checkpoints.StageCheckpoint("prepare", RUN, handoff).complete(handoff.output())
+
+
+def engineer(image, bucket: str, result: dict):
+    '''
+        Second stage: the checkpoint of a stage that reads the prepared dataset and writes features.
+    '''
+    handoff = image.handoff.DatasetHandoff({"Handoff": result}, bucket, inline_limit=0)
+    checkpoint = image.checkpoints.StageCheckpoint("engineer", RUN, handoff)
+    if checkpoint.completed():
+        return checkpoint, None
+    prepared, _ = handoff.read("prepared", PREPARED, image.contracts.DatasetContract("prepared"))
+    handoff.write("features", prepared * 2, FEATURES)
+    return checkpoint, checkpoint.complete(handoff.output())
+
+
+def test_completed_stage_returns_its_result(image, aws):
+    result = prepare(image, aws)
+    _, engineered = engineer(image, aws, result)
+
+    checkpoint, rerun = engineer(image, aws, result)
+    assert rerun is None
+    assert checkpoint.result == engineered
+
+
+def test_overwritten_output_invalidates_the_checkpoint(image, aws):
+    result = prepare(image, aws)
+    engineer(image, aws, result)
+
+    boto3.client("s3").put_object(Bucket=aws, Key=FEATURES, Body=b"0,0\n")
+    _, rerun = engineer(image, aws, result)
+    assert rerun is not None
+
+
+def test_changed_input_invalidates_the_checkpoint(image, aws):
+    engineer(image, aws, prepare(image, aws))
+
+    # The first stage runs again and produces different data
+    result = prepare(image, aws, offset=1.0)
+    _, rerun = engineer(image, aws, result)
+    assert rerun is not None
+
+    _, replay = engineer(image, aws, result)
+    assert replay is None
+
+
+def test_changed_dependency_invalidates_the_checkpoint(image, aws):
+    s3 = boto3.client("s3")
+    s3.put_object(Bucket=aws, Key="training-pipeline/run-1/partial.json", Body=b"{}")
+    handoff = image.handoff.DatasetHandoff({}, aws)
+    checkpoint = lambda: image.checkpoints.StageCheckpoint("reduce", RUN, handoff, dependencies=["training-pipeline/run-1/partial.json"])
+    checkpoint().complete({"done": True})
+    assert checkpoint().completed()
+
+    s3.put_object(Bucket=aws, Key="training-pipeline/run-1/partial.json", Body=b'{"shard": 1}')
+    assert not checkpoint().completed()
+
+
+def test_express_stages_keep_no_marker(image, aws):
+    handoff = image.handoff.DatasetHandoff({}, aws, inline_limit=100_000)
+    handoff.write("prepared", dataset(), PREPARED)
+    checkpoint = image.checkpoints.StageCheckpoint("prepare", RUN, handoff)
+
+    assert checkpoint.complete(handoff.output()) == handoff.output()
+    assert not checkpoint.completed()
+    assert "Contents" not in boto3.client("s3").list_objects_v2(Bucket=aws, Prefix=image.checkpoints.CHECKPOINT_PREFIX)
+
+
+def test_express_data_preparation_writes_no_checkpoint_or_partitions(run_stage, aws, monkeypatch):
+    monkeypatch.setenv("INLINE_DATASET_LIMIT", "65536")
+    result = run_stage("data-preparation", "run-1")
+
+    assert all("inline" in entry for entry in result["Datasets"].values())
+    keys = [item["Key"] for item in boto3.client("s3").list_objects_v2(Bucket=aws)["Contents"]]
+    assert not [key for key in keys if key.startswith(("training-pipeline/checkpoints/", "training-pipeline/datasets/"))]
+    # The audit trail is still written
+    assert any(key.startswith("lineage/") for key in keys)
+    assert any("/validation/" in key for key in keys)
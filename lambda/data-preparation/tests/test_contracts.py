@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def contracts(stage):
+    return stage("data-preparation").contracts
+
+
+def bounded(contracts, **options):
+    rule = contracts.ColumnContract(kind="float", min_value=0.0, max_value=10.0)
+    return contracts.DatasetContract(name="bounded", columns=[rule, contracts.ColumnContract(kind="float", nullable=True)], **options)
+
+
+def test_violations_are_counted_per_column(contracts):
+    dataset = np.array([[1.0, np.nan], [-1.0, 2.0], [np.nan, 3.0], [11.0, np.nan], [12.0, 4.0]])
+    report = contracts.validate(bounded(contracts), dataset)
+
+    assert report == {
+        "dataset": "bounded",
+        "rows": 5,
+        "violations": {"column_0.null": 1, "column_0.below_min": 1, "column_0.above_max": 2},
+        "passed": False
+    }
+
+
+def test_chunked_validation_counts_like_one_pass(contracts):
+    dataset = np.random.default_rng(0).normal(5.0, 4.0, (1_000, 2))
+    dataset[::7, 0] = np.nan
+
+    whole = contracts.validate(bounded(contracts), dataset)
+    assert contracts.validate(bounded(contracts), dataset, chunk_rows=33) == whole
+    assert whole["violations"]["column_0.null"] == len(range(0, 1_000, 7))
+
+
+def test_shape_dtype_and_row_bounds(contracts):
+    rule = contracts.ColumnContract(kind="integer")
+    # A chunk of the wrong shape is not counted as rows
+    assert contracts.validate(contracts.DatasetContract(name="labels", ndim=1), np.zeros((3, 2)))["violations"] == {"ndim": 1, "rows.below_min": 1}
+    assert contracts.validate(contracts.DatasetContract(name="wide", n_columns=3), np.zeros((3, 2)))["violations"] == {"n_columns": 1}
+    assert contracts.validate(contracts.DatasetContract(name="codes", column_rule=rule), np.zeros((4, 2)))["violations"] == {
+        "column_0.dtype": 4, "column_1.dtype": 4
+    }
+    assert contracts.validate(contracts.DatasetContract(name="few", min_rows=5), np.zeros((3, 1)))["violations"] == {"rows.below_min": 2}
+    assert contracts.validate(contracts.DatasetContract(name="many", max_rows=2), np.zeros((3, 1)))["violations"] == {"rows.above_max": 1}
+    assert contracts.validate(contracts.DatasetContract(name="labels", ndim=1, column_rule=rule), np.arange(4))["passed"]
+
+
+def test_enforce_fails_or_warns_by_policy(contracts, capsys):
+    dataset = np.array([[-1.0, 0.0]])
+    report = contracts.validate(bounded(contracts), dataset)
+    with pytest.raises(contracts.ContractViolation) as raised:
+        contracts.enforce(report, bounded(contracts))
+    assert raised.value.report is report
+
+    lenient = bounded(contracts, on_violation="warn")
+    assert contracts.enforce(contracts.validate(lenient, dataset), lenient)["passed"] is False
+    assert "WARNING: dataset bounded" in capsys.readouterr().out
+
+
+def test_row_aligned_datasets_must_match(contracts):
+    features = contracts.validate(contracts.DatasetContract(name="features"), np.zeros((4, 2)))
+    labels = contracts.validate(contracts.DatasetContract(name="labels", ndim=1), np.zeros(4))
+    contracts.enforce_same_rows(features, labels)
+
+    short = contracts.validate(contracts.DatasetContract(name="labels", ndim=1), np.zeros(3))
+    with pytest.raises(contracts.ContractViolation) as raised:
+        contracts.enforce_same_rows(features, short)
+    assert raised.value.report["violations"] == {"rows.mismatch": {"features": 4, "labels": 3}}
@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def dtypes(stage):
+    return stage("data-preparation").dtypes
+
+
+def test_columns_narrow_to_smallest_exact_dtype(dtypes):
+    dataset = np.array([[1, 300, 70000], [-2, -300, 5]], dtype=np.int64)
+    plan = dtypes.plan_dtypes(dataset)
+
+    assert plan == {"dtype": "int32", "columns": ["int8", "int16", "int32"]}
+    np.testing.assert_array_equal(dtypes.apply_plan(dataset, plan), dataset)
+
+
+def test_float_columns_narrow_only_when_float32_exact(dtypes):
+    assert dtypes.plan_dtypes(np.array([[0.5, 1.25], [2.0, -4.0]]))["dtype"] == "float32"
+    assert dtypes.plan_dtypes(np.array([[0.1, 1.25], [2.0, -4.0]]))["columns"] == ["float64", "float32"]
+
+
+def test_integers_beyond_float_mantissa_keep_dataset_dtype(dtypes):
+    # Small codes narrow to int8, and int8 promoted with uint64 is float64, which rounds 2**63 + 1
+    dataset = np.array([[1, 2 ** 63 + 1], [2, 2 ** 63 + 3]], dtype=np.uint64)
+    plan = dtypes.plan_dtypes(dataset)
+
+    assert plan == {"dtype": "uint64", "columns": ["uint64", "uint64"]}
+    np.testing.assert_array_equal(dtypes.apply_plan(dataset, plan), dataset)
+
+
+def test_every_planned_dataset_round_trips(dtypes):
+    rng = np.random.default_rng(0)
+    for dataset in [rng.integers(-100, 100, (50, 3)), rng.normal(size=(50, 3)), rng.integers(0, 2 ** 62, (50, 2)).astype(np.uint64)]:
+        plan = dtypes.plan_dtypes(dataset)
+        np.testing.assert_array_equal(dtypes.apply_plan(dataset, plan).astype(dataset.dtype), dataset)
@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def generator(stage):
+    return stage("data-preparation").generator
+
+
+def collect(generator, spec, split: str) -> tuple:
+    chunks = list(generator.generate(spec, split))
+    labels = None if split == "inference" else np.concatenate([labels for _, labels in chunks])
+    return chunks, np.concatenate([features for features, _ in chunks]), labels
+
+
+@pytest.mark.parametrize("chunk_rows", [1, 7, 64, 100, 1000])
+def test_data_does_not_depend_on_chunking(generator, monkeypatch, chunk_rows):
+    # Blocks of 64 rows of 4 float64 features, so a split spans several blocks
+    monkeypatch.setattr(generator, "CHUNK_BYTES", 64 * 4 * 8)
+    spec = generator.SyntheticSpec(rows=500, features=4, seed=11)
+    chunked = generator.SyntheticSpec(rows=500, features=4, seed=11, chunk_rows=chunk_rows)
+
+    for split in generator.SPLITS:
+        _, features, labels = collect(generator, spec, split)
+        chunks, chunked_features, chunked_labels = collect(generator, chunked, split)
+        np.testing.assert_array_equal(chunked_features, features)
+        if split == "inference":
+            assert labels is None and chunked_labels is None
+        else:
+            np.testing.assert_array_equal(chunked_labels, labels)
+        assert all(len(features) <= chunk_rows for features, _ in chunks)
+        assert len(chunked_features) == spec.split_rows(split)
+
+
+def test_data_does_not_depend_on_consumers(generator):
+    spec = generator.SyntheticSpec(rows=300, features=3, seed=5, chunk_rows=40)
+    _, train, train_labels = collect(generator, spec, "train")
+
+    # Other splits generated first, and two consumers pulling chunks of the same split in turns
+    collect(generator, spec, "inference")
+    first, second = generator.generate(spec, "train"), generator.generate(spec, "train")
+    interleaved = [next(first), next(second), next(second), next(first)]
+    np.testing.assert_array_equal(interleaved[0][0], interleaved[1][0])
+    np.testing.assert_array_equal(interleaved[2][0], interleaved[3][0])
+    np.testing.assert_array_equal(np.concatenate([interleaved[0][0], interleaved[3][0]]), train[:80])
+    np.testing.assert_array_equal(np.concatenate([interleaved[1][1], interleaved[2][1]]), train_labels[:80])
+
+    # The splits are independent draws, and another seed is another dataset
+    _, test, _ = collect(generator, spec, "test")
+    assert not np.array_equal(test, train[:len(test)])
+    _, reseeded, _ = collect(generator, generator.SyntheticSpec(rows=300, features=3, seed=6, chunk_rows=40), "train")
+    assert not np.array_equal(reseeded, train)
+
+
+def test_prepared_datasets_do_not_depend_on_chunking(run_stage, stage, aws, monkeypatch):
+    # npy datasets read back bit for bit
+    monkeypatch.setenv("DATASET_FORMAT", "npy")
+    outputs = [
+        run_stage("data-preparation", f"run-{chunk_rows}", Generator={"Rows": 400, "Features": 3, "Seed": 2, "ChunkRows": chunk_rows})
+        for chunk_rows in (None, 33)
+    ]
+
+    datasets = [output["Datasets"] for output in outputs]
+    assert datasets[0].keys() == datasets[1].keys() == {"train-features", "train-labels", "test-features", "test-labels", "inference-data"}
+    for name in datasets[0]:
+        assert datasets[0][name]["sha256"] == datasets[1][name]["sha256"]
+
+    image = stage("data-preparation")
+    handoff = image.handoff.DatasetHandoff({"Handoff": outputs[1]}, aws)
+    read, _ = handoff.read("train-features", datasets[1]["train-features"]["s3"], image.contracts.CONTRACTS["train-features"])
+    _, features, _ = collect(image.generator, image.generator.SyntheticSpec(rows=400, features=3, seed=2), "train")
+    np.testing.assert_array_equal(read, features)
+
+
+def test_split_rows(generator):
+    spec = generator.SyntheticSpec(rows=1000)
+    assert [spec.split_rows(split) for split in generator.SPLITS] == [1000, 200, 10]
+    # At least one row in every split
+    assert [generator.SyntheticSpec(rows=2).split_rows(split) for split in generator.SPLITS] == [2, 1, 1]
+    spec = generator.SyntheticSpec(rows=1000, test_rows=7, inference_rows=0)
+    assert [spec.split_rows(split) for split in generator.SPLITS] == [1000, 7, 0]
+    assert list(generator.generate(spec, "inference")) == []
+
+
+def test_rows_per_chunk(generator):
+    assert generator.SyntheticSpec(rows=10, features=32).rows_per_chunk() == generator.CHUNK_BYTES // (32 * 8)
+    assert generator.SyntheticSpec(rows=10, features=32, dtype="float32").rows_per_chunk() == generator.CHUNK_BYTES // (32 * 4)
+    assert generator.SyntheticSpec(rows=10, features=32, chunk_rows=5).rows_per_chunk() == 5
+    # Wider than a block: one row per chunk
+    assert generator.SyntheticSpec(rows=10, features=generator.CHUNK_BYTES).rows_per_chunk() == 1
+    assert generator.SyntheticSpec(rows=10, features=32).to_dict()["chunk_rows"] == generator.CHUNK_BYTES // (32 * 8)
+
+
+def test_from_parameters(generator):
+    spec = generator.SyntheticSpec.from_parameters({"Rows": "100", "Features": 4, "Seed": 3, "ChunkRows": 10, "Dtype": "float32"})
+    assert spec == generator.SyntheticSpec(rows=100, features=4, seed=3, chunk_rows=10, dtype="float32")
+    features, labels = next(generator.generate(spec, "train"))
+    assert features.dtype == labels.dtype == np.float32
+    for parameters in ({"Rows": 1}, {"Rows": 100, "Features": 0}, {"Rows": 100, "Dtype": "int64"}):
+        with pytest.raises(ValueError):
+            generator.SyntheticSpec.from_parameters(parameters)
@@ -0,0 +1,48 @@
+import boto3
+import pytest
+
+
+@pytest.fixture
+def leases(stage):
+    return stage("data-preparation").leases
+
+
+@pytest.fixture(params=["dynamodb", "local"])
+def table(request, leases, aws, tmp_path):
+    if request.param == "local":
+        return leases.LocalLeases(str(tmp_path / "run-leases.json"))
+    boto3.client("dynamodb").create_table(
+        TableName="run-leases",
+        KeySchema=[{"AttributeName": "Project", "KeyType": "HASH"}, {"AttributeName": "Slot", "KeyType": "RANGE"}],
+        AttributeDefinitions=[{"AttributeName": "Project", "AttributeType": "S"}, {"AttributeName": "Slot", "AttributeType": "N"}],
+        BillingMode="PAY_PER_REQUEST"
+    )
+    return leases.DynamoDBLeases("run-leases")
+
+
+def test_slots_are_capped(leases, table):
+    first = leases.acquire(table, "regression", "run-1", slots=2, now=1000)
+    second = leases.acquire(table, "regression", "run-2", slots=2, now=1000)
+
+    assert {first["Slot"], second["Slot"]} == {0, 1}
+    with pytest.raises(leases.LeaseUnavailable):
+        leases.acquire(table, "regression", "run-3", slots=2, now=1000)
+    # Other projects have their own slots
+    assert leases.acquire(table, "forecast", "run-3", slots=2, now=1000)["Slot"] in (0, 1)
+
+
+def test_retried_acquisition_keeps_its_slot(leases, table):
+    lease = leases.acquire(table, "regression", "run-1", slots=3, now=1000)
+    assert leases.acquire(table, "regression", "run-1", slots=3, now=1001)["Slot"] == lease["Slot"]
+    assert len(table.holders("regression")) == 1
+
+
+def test_released_and_expired_slots_are_claimed_again(leases, table):
+    lease = leases.acquire(table, "regression", "run-1", slots=1, seconds=60, now=1000)
+    assert leases.release(table, lease)
+    leases.acquire(table, "regression", "run-2", slots=1, seconds=60, now=1000)
+
+    # run-2 outlived its lease: run-3 takes the slot and run-2's late release leaves it alone
+    leases.acquire(table, "regression", "run-3", slots=1, seconds=60, now=1100)
+    assert not leases.release(table, {"Project": "regression", "Slot": 0, "Holder": "run-2"})
+    assert table.holders("regression")[0]["Holder"] == "run-3"
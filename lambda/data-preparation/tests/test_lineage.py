@@ -0,0 +1,140 @@
+import hashlib
+import boto3
+import numpy as np
+import pytest
+
+# 2026-09-01T00:00:00Z
+START_MS = 1788220800000
+
+HOUR_MS = 3600 * 1000
+
+
+@pytest.fixture
+def lineage(stage, monkeypatch):
+    lineage = stage("data-preparation").lineage
+    # Fences every 4 rows, so a few dozen records span many fence blocks
+    monkeypatch.setattr(lineage, "FENCE_ROWS", 4)
+    return lineage
+
+
+def sha(number: int) -> str:
+    return hashlib.sha256(str(number).encode()).hexdigest()
+
+
+def log_run(lineage, bucket: str, number: int, status: str = "succeeded") -> None:
+    '''
+        Logs run number: a prepare stage writing dataset <number> and, an hour later, a train stage reading it.
+        Runs start 6 hours apart; train takes number + 0.5 seconds.
+    '''
+    finished = START_MS + number * 6 * HOUR_MS
+    dataset = {"data": {"key": f"training-pipeline/{number}/data.csv", "rows": 10, "sha256": sha(number)}}
+    for stage, offset, role, seconds in (("prepare", 0, "outputs", 1.0), ("train", HOUR_MS, "inputs", number + 0.5)):
+        lineage.append(bucket, {
+            "run_id": f"run-{number:03d}", "run_date": "2026-09-01", "stage": stage, "status": status, "error": None,
+            "started": finished + offset - 1000, "finished": finished + offset, "seconds": seconds, "image": "image:1",
+            "inputs": {}, "outputs": {}, **{role: dataset}
+        })
+
+
+def after(number: int) -> float:
+    '''
+        Compaction time (seconds) at which every record of runs up to number is past the grace period.
+    '''
+    return (START_MS + number * 6 * HOUR_MS + HOUR_MS) / 1000 + 600
+
+
+def expected_uses(number: int) -> list:
+    finished = START_MS + number * 6 * HOUR_MS
+    return [
+        {"run_id": f"run-{number:03d}", "stage": "prepare", "role": "output", "finished": finished},
+        {"run_id": f"run-{number:03d}", "stage": "train", "role": "input", "finished": finished + HOUR_MS}
+    ]
+
+
+def keys(bucket: str, prefix: str) -> list:
+    return [item["Key"] for item in boto3.client("s3").list_objects_v2(Bucket=bucket, Prefix=prefix).get("Contents", [])]
+
+
+def test_tail_only_queries(lineage, aws):
+    for number in range(3):
+        log_run(lineage, aws, number)
+
+    query = lineage.LineageQuery(aws)
+    assert query.manifest is None
+    assert query.runs_using(sha(1)) == expected_uses(1)
+    assert query.runs_using("training-pipeline/2/data.csv") == expected_uses(2)
+    assert query.runs_using(sha(99)) == []
+    assert [day["runs"] for day in query.stage_latency("train", now=after(2))] == [3]
+
+
+def test_compaction_across_generations(lineage, aws):
+    for number in range(20):
+        log_run(lineage, aws, number)
+    first = lineage.compact(aws, now=after(19))
+    assert first["rows"] == {"records": 40, "edges": 80}
+    assert first["previous"] is None
+
+    for number in range(20, 30):
+        log_run(lineage, aws, number)
+    # Records within the grace period are left to the next compaction
+    second = lineage.compact(aws, now=after(27))
+    assert second["previous"] == first["generation"]
+    assert second["rows"] == {"records": 56, "edges": 112}
+    assert lineage.compact(aws, now=after(27)) == second
+
+    # Every dataset is found whether its edges are in the table, the tail or both
+    query = lineage.LineageQuery(aws)
+    for number in range(30):
+        assert query.runs_using(sha(number)) == expected_uses(number), number
+        assert query.runs_using(f"training-pipeline/{number}/data.csv") == expected_uses(number), number
+
+    # The third generation removes the first one, the second stays readable for queries that loaded its manifest
+    third = lineage.compact(aws, now=after(29))
+    assert third["rows"] == {"records": 60, "edges": 120}
+    assert keys(aws, f"{lineage.TABLE_PREFIX}/{first['generation']}/") == []
+    assert keys(aws, f"{lineage.TABLE_PREFIX}/{second['generation']}/") != []
+    assert query.runs_using(sha(5)) == expected_uses(5)
+
+
+def test_dataset_ids_on_fences(lineage, aws):
+    for number in range(30):
+        log_run(lineage, aws, number)
+    # A third use of one dataset (by its hash only), so the pairs of edges of the other ids do not all align with
+    # the 4-row fence blocks
+    lineage.append(aws, {
+        "run_id": "run-audit", "run_date": "2026-09-01", "stage": "audit", "status": "succeeded", "error": None,
+        "started": START_MS, "finished": START_MS + 1000, "seconds": 1.0, "image": None,
+        "inputs": {"data": {"key": None, "rows": 10, "sha256": sha(0)}}, "outputs": {}
+    })
+    manifest = lineage.compact(aws, now=after(29))
+    ids = {lineage.dataset_id(sha(number)): number for number in range(30)}
+    query = lineage.LineageQuery(aws)
+    edges = query._column("edges", "dataset", 0, manifest["rows"]["edges"])
+
+    on_fence = [ids[fence] for fence in manifest["dataset_fences"] if fence in ids]
+    straddling = [ids[int(edges[row])] for row in range(4, len(edges), 4) if edges[row] == edges[row - 1] and int(edges[row]) in ids]
+    assert on_fence and straddling
+    for number in on_fence + straddling:
+        uses = expected_uses(number) if number else [{"run_id": "run-audit", "stage": "audit", "role": "input", "finished": START_MS + 1000}] + expected_uses(0)
+        assert query.runs_using(sha(number)) == sorted(uses, key=lambda use: use["finished"]), number
+    assert query.runs_using(sha(1000)) == []
+
+
+def test_stage_latency(lineage, aws):
+    for number in range(24):
+        log_run(lineage, aws, number)
+    log_run(lineage, aws, 24, status="failed")
+    lineage.compact(aws, now=after(19))
+    query = lineage.LineageQuery(aws)
+
+    # Runs 0-23 finish over six days, four a day; the window starts within day two
+    trend = query.stage_latency("train", days=4, now=after(23) - 600)
+    dates = [day["date"] for day in trend]
+    assert dates == ["2026-09-02", "2026-09-03", "2026-09-04", "2026-09-05", "2026-09-06"]
+    since = int((after(23) - 600 - 4 * 86400) * 1000)
+    first_day = [number + 0.5 for number in range(4, 8) if START_MS + number * 6 * HOUR_MS + HOUR_MS >= since]
+    assert trend[0]["runs"] == len(first_day)
+    assert trend[0]["mean"] == pytest.approx(np.mean(first_day))
+    # Days up to the fifth are compacted, the last day's runs (20-23) come from the tail; the failed run 24 is left out
+    assert trend[-1] == {"date": "2026-09-06", "runs": 4, "mean": 22.0, "p50": 22.0, "p95": pytest.approx(np.percentile([20.5, 21.5, 22.5, 23.5], 95)), "max": 23.5}
+    assert query.stage_latency("missing", now=after(23)) == []
@@ -0,0 +1,110 @@
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def partitioned(stage):
+    return stage("data-preparation").partitioned
+
+
+@pytest.fixture
+def ranges(partitioned):
+    '''
+        Range headers of the GetObject requests sent through the shared range client.
+    '''
+    sent = []
+
+    def record(model, params, **kwargs):
+        if model.name == "GetObject" and "Range" in params["headers"]:
+            sent.append(params["headers"]["Range"])
+
+    partitioned.client().meta.events.register("before-call.s3", record)
+    return sent
+
+
+def rows() -> np.array:
+    '''
+        40 rows: a counts up (so row groups of 10 rows have disjoint ranges), b cycles 0-3, c is a label.
+    '''
+    a = np.arange(40, dtype=np.float64)
+    return np.column_stack([a, a % 4, a * 10 + 1])
+
+
+def write(partitioned, bucket: str, run_date: str = "2026-10-01", run_id: str = "run-1", slices=None):
+    dataset = partitioned.PartitionedDataset(bucket, partitioned.dataset_root("test"))
+    values = rows()
+    slices = np.zeros(len(values), dtype=int) if slices is None else slices
+    dataset.write(values, ["a", "b", "c"], run_date, run_id, slices, row_group_rows=10)
+    return dataset, values
+
+
+def test_row_groups_are_pruned_by_statistics(partitioned, aws):
+    dataset, values = write(partitioned, aws)
+
+    plan = dataset.plan(["c"], [("a", ">=", 25), ("a", "<", 32)])
+    # Only the row groups [20, 30) and [30, 40) can hold matching rows
+    assert len(plan["row_groups"]) == 2
+    assert plan["fetch"] == ["c", "a"]
+    assert plan["bytes"] < plan["total_bytes"]
+    np.testing.assert_array_equal(dataset.read(["c"], [("a", ">=", 25), ("a", "<", 32)]).ravel(), values[25:32, 2])
+
+    assert dataset.plan(filters=[("a", ">", 100)])["row_groups"] == []
+    assert dataset.read(["a", "c"], [("a", ">", 100)]).shape == (0, 2)
+
+
+def test_in_filter(partitioned, aws):
+    dataset, values = write(partitioned, aws)
+
+    filters = [("a", "in", [3, 4, 37])]
+    assert len(dataset.plan(filters=filters)["row_groups"]) == 2
+    np.testing.assert_array_equal(dataset.read(filters=filters), values[[3, 4, 37]])
+
+
+def test_not_equal_keeps_row_groups_with_nulls(partitioned, aws):
+    dataset = partitioned.PartitionedDataset(aws, partitioned.dataset_root("inference"))
+    # Every present value of the only row group equals 5, but NaN != 5
+    values = np.array([[5.0], [np.nan], [5.0], [np.nan]])
+    dataset.write(values, ["a"], "2026-10-01", "run-1", np.zeros(4, dtype=int), row_group_rows=10)
+
+    assert len(dataset.plan(filters=[("a", "!=", 5.0)])["row_groups"]) == 1
+    assert np.isnan(dataset.read(filters=[("a", "!=", 5.0)])).all()
+    assert dataset.read(filters=[("a", "!=", 5.0)]).shape == (2, 1)
+    assert partitioned.may_match("!=", 5.0, 5.0, 5.0) is False
+    assert partitioned.may_match("!=", 5.0, 5.0, 5.0, nulls=2) is True
+
+
+def test_adjacent_chunks_are_fetched_with_one_get(partitioned, aws, ranges):
+    dataset, values = write(partitioned, aws)
+    ranges.clear()
+
+    # a and b are stored next to each other in every row group: one GET per row group
+    np.testing.assert_array_equal(dataset.read(["a", "b"]), values[:, :2])
+    assert len(ranges) == 4
+    ranges.clear()
+
+    # a and c are not: two GETs per row group, each of one chunk
+    np.testing.assert_array_equal(dataset.read(["c", "a"]), values[:, [2, 0]])
+    assert len(ranges) == 8
+    first, last = (int(bound) for bound in sorted(ranges)[0][len("bytes="):].split("-"))
+    assert last - first + 1 == dataset.plan(["a"])["row_groups"][0]["chunks"][0]["length"]
+
+
+def test_partition_key_filters(partitioned, aws):
+    slices = np.repeat([0, 1], 20)
+    dataset, values = write(partitioned, aws, "2026-10-01", "run-1", slices)
+    write(partitioned, aws, "2026-10-02", "run-2", slices)
+    write(partitioned, aws, "2026-10-02", "run-3", slices)
+
+    assert len(dataset.manifests([("date", "==", "2026-10-02")])) == 2
+    assert [manifest["run"] for manifest in dataset.manifests([("run", "in", ["run-1", "run-3"])])] == ["run-1", "run-3"]
+    assert [manifest["run"] for manifest in dataset.manifests([("date", "==", "2026-10-02"), ("run", "!=", "run-2")])] == ["run-3"]
+
+    plan = dataset.plan(["a"], [("date", "==", "2026-10-01"), ("slice", "==", 1)])
+    assert {group["key"] for group in plan["row_groups"]} == {f"{dataset.root}/date=2026-10-01/slice=1/part-run-1.bin"}
+    np.testing.assert_array_equal(dataset.read(["a"], [("date", "==", "2026-10-01"), ("slice", "==", 1)]).ravel(), values[20:, 0])
+    assert dataset.read(["a"], [("slice", ">", 0)]).shape == (60, 1)
+
+    with pytest.raises(ValueError, match="has no column"):
+        dataset.plan(filters=[("d", "==", 1)])
+    with pytest.raises(ValueError, match="Unsupported operator"):
+        dataset.plan(filters=[("a", "~", 1)])
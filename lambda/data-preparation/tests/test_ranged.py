@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+from botocore.exceptions import ClientError
+
+
+@pytest.fixture
+def image(stage):
+    return stage("data-preparation")
+
+
+@pytest.fixture
+def requests(image):
+    '''
+        Names of the S3 operations sent through the shared range client.
+    '''
+    sent = []
+    image.ranged.client().meta.events.register("before-call.s3", lambda model, **kwargs: sent.append(model.name))
+    return sent
+
+
+def dataset() -> np.array:
+    rng = np.random.default_rng(1)
+    values = rng.standard_normal((3000, 5))
+    values[:, 2] = np.arange(3000)
+    return values
+
+
+def test_small_reads_take_one_get(image, aws, requests):
+    image.utils.write_data(dataset(), aws, "small.csv")
+    image.utils.write_array(dataset(), aws, "small.npy")
+    requests.clear()
+
+    np.testing.assert_allclose(image.utils.read_data(aws, "small.csv"), dataset())
+    np.testing.assert_array_equal(image.utils.read_array(aws, "small.npy"), dataset())
+    assert requests == ["GetObject", "GetObject"]
+
+
+def test_large_reads_fan_out_from_the_first_get(image, aws, requests, monkeypatch):
+    image.utils.write_data(dataset(), aws, "large.csv")
+    image.utils.write_array(dataset(), aws, "large.npy")
+    monkeypatch.setattr(image.ranged, "RANGE_THRESHOLD_BYTES", 1)
+    monkeypatch.setattr(image.ranged, "RANGE_PART_BYTES", 4099)
+    requests.clear()
+
+    np.testing.assert_allclose(image.utils.read_data(aws, "large.csv"), dataset())
+    np.testing.assert_array_equal(image.utils.read_array(aws, "large.npy"), dataset())
+    assert "HeadObject" not in requests
+    assert requests.count("GetObject") > 2
+
+
+def test_overwritten_object_fails_mid_download(image, aws, monkeypatch):
+    image.utils.write_data(dataset(), aws, "moving.csv")
+    monkeypatch.setattr(image.ranged, "RANGE_PART_BYTES", 4099)
+
+    body, head = image.ranged.open_object(aws, "moving.csv")
+    image.utils.write_data(dataset()[:10], aws, "moving.csv")
+    with pytest.raises(ClientError) as raised:
+        image.utils.read_data_ranged(aws, "moving.csv", head, body)
+    assert raised.value.response["Error"]["Code"] in ("412", "PreconditionFailed")
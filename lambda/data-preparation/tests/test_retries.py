@@ -0,0 +1,54 @@
+import boto3
+import pytest
+from botocore.exceptions import ClientError, EndpointConnectionError
+
+
+def client_error(code: str, status: int) -> ClientError:
+    return ClientError({"Error": {"Code": code, "Message": code}, "ResponseMetadata": {"HTTPStatusCode": status}}, "GetObject")
+
+
+@pytest.fixture
+def retries(stage):
+    return stage("data-preparation").retries
+
+
+@pytest.mark.parametrize("error", [
+    client_error("SlowDown", 503),
+    client_error("InternalError", 500),
+    client_error("ServiceUnavailable", 503),
+    client_error("ThrottlingException", 400),
+    EndpointConnectionError(endpoint_url="https://s3.amazonaws.com")
+])
+def test_transient_errors_are_retryable(retries, error):
+    @retries.retryable
+    def handler(event, context):
+        raise error
+
+    with pytest.raises(retries.TransientAWSError) as raised:
+        handler({}, None)
+    assert raised.value.__cause__ is error
+
+
+@pytest.mark.parametrize("error", [
+    client_error("AccessDenied", 403),
+    client_error("NoSuchKey", 404),
+    client_error("InvalidArgument", 400),
+    ValueError("dataset contract failed")
+])
+def test_permanent_errors_keep_their_name(retries, error):
+    @retries.retryable
+    def handler(event, context):
+        raise error
+
+    with pytest.raises(type(error)):
+        handler({}, None)
+
+
+def test_missing_object_is_not_retried(retries, aws):
+    @retries.retryable
+    def handler(event, context):
+        return boto3.client("s3").get_object(Bucket=aws, Key="missing.csv")
+
+    with pytest.raises(ClientError) as raised:
+        handler({}, None)
+    assert raised.value.response["Error"]["Code"] == "NoSuchKey"
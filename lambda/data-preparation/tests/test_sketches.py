@@ -0,0 +1,55 @@
+import json
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def sketches(stage):
+    return stage("data-preparation").sketches
+
+
+def test_merged_chunks_match_one_pass(sketches):
+    values = np.random.default_rng(5).normal(2.0, 3.0, 10_000)
+    whole = sketches.FeatureSketch.reference(values)
+
+    merged = whole.empty()
+    for chunk in np.array_split(values, 7):
+        part = whole.empty()
+        part.update(chunk)
+        merged.merge(part)
+
+    np.testing.assert_array_equal(merged.counts, whole.counts)
+    assert merged.count == whole.count == 10_000
+    assert merged.mean == pytest.approx(values.mean())
+    assert merged.variance == pytest.approx(values.var())
+    assert (merged.minimum, merged.maximum) == (values.min(), values.max())
+
+
+def test_sketches_over_different_edges_do_not_merge(sketches):
+    left = sketches.FeatureSketch.reference(np.arange(100.0))
+    right = sketches.FeatureSketch.reference(np.arange(100.0) * 2)
+    with pytest.raises(ValueError):
+        left.merge(right)
+
+
+def test_psi_and_ks_flag_a_shift(sketches):
+    rng = np.random.default_rng(6)
+    reference = sketches.FeatureSketch.reference(rng.normal(0.0, 1.0, 20_000))
+    same, shifted = reference.empty(), reference.empty()
+    same.update(rng.normal(0.0, 1.0, 5_000))
+    shifted.update(rng.normal(1.0, 1.0, 5_000))
+
+    assert sketches.psi(reference, same) < 0.1
+    assert sketches.psi(reference, shifted) > 0.2
+    assert sketches.ks(reference, same) < 0.05 < sketches.ks(reference, shifted)
+
+
+def test_dataset_sketch_round_trips_through_json(sketches):
+    dataset = np.random.default_rng(7).normal(size=(1_000, 3))
+    sketch = sketches.DatasetSketch.reference(dataset)
+    restored = sketches.DatasetSketch.from_dict(json.loads(json.dumps(sketch.to_dict())))
+
+    assert restored.rows == 1_000
+    for original, feature in zip(sketch.features, restored.features):
+        np.testing.assert_array_equal(feature.counts, original.counts)
+        assert feature.quantile(0.5) == pytest.approx(original.quantile(0.5))
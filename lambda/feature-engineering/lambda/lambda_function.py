@@ -0,0 +1,102 @@
+import os
+import json
+import asyncio
+from dataclasses import replace
+
+from contracts import CONTRACTS, validate, enforce
+from features import FeaturePipeline, load_config
+from utils import write_json, hash_array, save_model_to_s3_async, load_model_from_s3
+from handoff import DatasetHandoff
+from lineage import StageLineage
+from checkpoints import StageCheckpoint
+from retries import retryable
+
+
+@retryable
+def lambda_handler(event, context):
+
+    # Reading variables passed in by the parent Step Function
+    run_parameters = json.loads(event['Input']['RunParameters'])
+
+    handoff = DatasetHandoff(event['Input'], f"pr-{run_parameters['Environment']}-{run_parameters['Project']}-bucket")
+    checkpoint = StageCheckpoint("feature-engineering", run_parameters, handoff)
+    if checkpoint.completed():
+        return checkpoint.result
+    with StageLineage("feature-engineering", run_parameters, handoff, context) as lineage:
+        lineage.metrics.update(run(run_parameters, handoff))
+    return checkpoint.complete(handoff.output())
+
+
+def run(run_parameters: dict, handoff: DatasetHandoff) -> dict:
+    '''
+        Feature engineering stage, shared by the stage Lambda and the fused pipeline.
+        
+        args:
+            run_parameters: run parameters created by the parent Step Function
+            handoff: DatasetHandoff the raw datasets are read from and the engineered datasets are handed to
+        returns:
+            {"feature_pipeline_cached", "n_features_out"}, recorded as lineage metrics
+    '''
+
+    # *********************************************
+    # Read the prepared datasets from S3
+    #*********************************************
+
+    run_id = run_parameters['RunId']
+    run_date = run_parameters['RunDate']
+    environment = run_parameters['Environment']
+    project = run_parameters['Project']
+
+    project_bucket = f"pr-{environment}-{project}-bucket"
+    input_prefix = f"training-pipeline/data-preparation/{run_date}/{run_id}"
+    output_prefix = f"training-pipeline/feature-engineering/{run_date}/{run_id}"
+
+    config = load_config(os.environ.get("FEATURE_CONFIG"))
+
+    train_features, train_report = handoff.read("train-features", f"{input_prefix}/train-features.csv", CONTRACTS["train-features"])
+    write_json(train_report, project_bucket, f"{output_prefix}/validation/train-features.json")
+    enforce(train_report, CONTRACTS["train-features"])
+
+    # *********************************************
+    # Fit the transforms on the training split, reusing the fitted state if this exact
+    # training data and config were seen before (keyed by content hash)
+    #*********************************************
+
+    cache_key = f"feature-store/{hash_array(train_features, json.dumps(config, sort_keys=True))}/feature-pipeline.pkl"
+
+    feature_pipeline = load_model_from_s3(project_bucket, cache_key)
+    uploads = []
+    if feature_pipeline is None:
+        feature_pipeline = FeaturePipeline(config).fit(train_features)
+        uploads.append(cache_key)
+
+    # The model training stage serializes this fitted pipeline together with the model; both uploads run concurrently
+    uploads.append(f"{output_prefix}/feature-pipeline.pkl")
+
+    async def upload() -> None:
+        await asyncio.gather(*(save_model_to_s3_async(feature_pipeline, project_bucket, key) for key in uploads))
+
+    asyncio.run(upload())
+    handoff.artifacts["feature-pipeline"] = feature_pipeline
+
+    # *********************************************
+    # Transform every split in one vectorized pass and hand the engineered features off (S3 or inline)
+    #*********************************************
+
+    datasets = {"train-features": train_features}
+    for name in ("test-features", "inference-data"):
+        contract = replace(CONTRACTS[name], n_columns=train_features.shape[1])
+        datasets[name], report = handoff.read(name, f"{input_prefix}/{name}.csv", contract)
+        write_json(report, project_bucket, f"{output_prefix}/validation/{name}.json")
+        enforce(report, contract)
+
+    engineered_contract = replace(CONTRACTS["engineered-features"], n_columns=feature_pipeline.n_features_out_)
+
+    for name, dataset in datasets.items():
+        engineered = feature_pipeline.transform(dataset)
+        report = validate(engineered_contract, engineered)
+        write_json(report, project_bucket, f"{output_prefix}/validation/engineered-{name}.json")
+        enforce(report, engineered_contract)
+        handoff.write(f"engineered-{name}", engineered, f"{output_prefix}/{name}.csv")
+
+    return {"feature_pipeline_cached": cache_key not in uploads, "n_features_out": int(feature_pipeline.n_features_out_)}
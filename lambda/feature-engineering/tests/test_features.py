@@ -0,0 +1,109 @@
+import json
+import numpy as np
+import pytest
+from sklearn.preprocessing import StandardScaler
+
+
+@pytest.fixture
+def image(stage):
+    return stage("feature-engineering")
+
+
+@pytest.fixture
+def features(image):
+    return image.features
+
+
+def raw(rows: int = 50, seed: int = 0) -> np.array:
+    rng = np.random.default_rng(seed)
+    return np.column_stack([rng.normal(5.0, 2.0, rows), rng.integers(0, 4, rows), rng.integers(0, 10_000, rows)]).astype(np.float64)
+
+
+def transformed(transform, X: np.array, dtype=np.float64) -> np.array:
+    out = np.empty((len(X), transform.width()), dtype=dtype)
+    transform.transform_into(X, out)
+    return out
+
+
+def test_scale_matches_standard_scaler(features):
+    X = raw()
+    X[:, 1] = 3.0
+    scale = features.Scale([0, 1]).fit(X)
+
+    np.testing.assert_allclose(transformed(scale, X)[:, 0], StandardScaler().fit_transform(X[:, [0]])[:, 0])
+    # A constant column is centred but not divided by a zero deviation
+    np.testing.assert_array_equal(transformed(scale, X)[:, 1], 0.0)
+
+
+def test_polynomial_lays_out_powers_per_column(features):
+    X = np.array([[2.0, 3.0]])
+    polynomial = features.Polynomial([0, 1], degree=3).fit(X)
+    np.testing.assert_array_equal(transformed(polynomial, X), [[4.0, 8.0, 9.0, 27.0]])
+
+
+def test_one_hot_encodes_training_categories_only(features):
+    one_hot = features.OneHot([1]).fit(np.array([[0.0, 1.0], [0.0, 3.0], [0.0, 1.0]]))
+
+    assert one_hot.width() == 2
+    np.testing.assert_array_equal(transformed(one_hot, np.array([[9.0, 3.0], [9.0, 1.0], [9.0, 2.0]])), [[0, 1], [1, 0], [0, 0]])
+
+
+def test_hashing_is_deterministic_and_signed(features):
+    X = raw(rows=500)
+    hashing = features.Hashing([2], n_features=8).fit(X)
+    out = transformed(hashing, X)
+
+    np.testing.assert_array_equal(out, transformed(hashing, X.copy()))
+    # One column hashes every row into exactly one bucket, with a sign of +1 or -1
+    np.testing.assert_array_equal(np.abs(out).sum(axis=1), 1.0)
+    assert set(np.unique(out)) == {-1.0, 0.0, 1.0}
+    equal = X[:, 2][:, None] == X[:, 2][None, :]
+    assert all((out[i] == out[j]).all() for i, j in zip(*np.nonzero(equal)))
+
+
+def test_lag_shifts_rows_and_fills_history(features):
+    X = np.arange(10.0).reshape(5, 2)
+    lag = features.Lag([0], lags=[1, 2], fill_value=-1.0).fit(X)
+    np.testing.assert_array_equal(transformed(lag, X), [[-1, -1], [0, -1], [2, 0], [4, 2], [6, 4]])
+
+
+def test_pipeline_fills_one_block_per_transform(features):
+    X = raw()
+    config = {"dtype": "float32", "transforms": [{"type": "scale", "columns": [0]}, {"type": "one_hot", "columns": [1]}, {"type": "lag", "columns": [0], "lags": [1]}]}
+    pipeline = features.FeaturePipeline(config).fit(X)
+    out = pipeline.transform(X)
+
+    assert out.dtype == np.float32
+    assert out.shape == (50, pipeline.n_features_out_) == (50, 1 + len(np.unique(X[:, 1])) + 1)
+    np.testing.assert_allclose(out[:, 0], transformed(features.Scale([0]).fit(X), X)[:, 0], rtol=1e-6)
+    np.testing.assert_array_equal(out[:, 1:-1].sum(axis=1), 1.0)
+    np.testing.assert_allclose(out[1:, -1], X[:-1, 0], rtol=1e-6)
+    with pytest.raises(ValueError):
+        pipeline.transform(X[:, :2])
+
+
+def test_config_is_validated(features):
+    assert features.load_config("") == features.DEFAULT_CONFIG
+    with pytest.raises(ValueError):
+        features.load_config(json.dumps({"transforms": [{"type": "cube"}]}))
+    with pytest.raises(ValueError):
+        features.FeaturePipeline({"dtype": "int32", "transforms": []}).fit(raw())
+
+
+def run_feature_engineering(image, aws, run_id: str, X: np.array) -> dict:
+    handoff = image.handoff.DatasetHandoff({}, aws, in_memory=True)
+    for name in ("train-features", "test-features", "inference-data"):
+        handoff.datasets[name] = {"array": X}
+    parameters = {"RunId": run_id, "RunDate": "2026-10-19", "Environment": "test", "Project": "regression"}
+    return image.lambda_function.run(parameters, handoff)
+
+
+def test_fitted_pipeline_is_cached_by_training_data_and_config(image, aws, monkeypatch):
+    X = raw()
+    assert not run_feature_engineering(image, aws, "run-1", X)["feature_pipeline_cached"]
+    assert run_feature_engineering(image, aws, "run-2", X)["feature_pipeline_cached"]
+
+    # A different training split or config fits again
+    assert not run_feature_engineering(image, aws, "run-3", raw(seed=1))["feature_pipeline_cached"]
+    monkeypatch.setenv("FEATURE_CONFIG", json.dumps({"transforms": [{"type": "polynomial"}]}))
+    assert not run_feature_engineering(image, aws, "run-4", X)["feature_pipeline_cached"]
@@ -0,0 +1,172 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import importlib.util
+import boto3
+import numpy as np
+from botocore.exceptions import ClientError
+
+# The shared helper modules (lambda/common) are copied into the image; a local run imports them from the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "common"))
+
+from retries import retryable
+
+
+# *********************************************
+# Fused training pipeline
+#
+# Runs data preparation, feature engineering, model training and model evaluation in a single process for
+# small and medium datasets. Each stage's own run() is imported from its bundled Lambda code (bundle/<stage>),
+# and the datasets and fitted objects are handed from stage to stage in memory: nothing is written to S3
+# between stages, only the stage outputs (validation reports, model, metrics) and a lineage record. Each stage
+# also appends its record to the lineage log (lineage.py) with the "fused" execution mode. The run's lineage
+# record (the stages' datasets and hashes) is written once every stage has completed, so it is also the run's
+# completion marker: a resumed or retried fused run that finds it returns it instead of running again.
+#*********************************************
+
+STAGES = ["data-preparation", "feature-engineering", "model-training", "model-evaluation"]
+
+BUNDLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bundle")
+
+# Helper modules whose contents differ between stages; evicted before each stage so it imports its own copy.
+# The shared helpers (lambda/common: contracts, handoff, features, lineage, ...) exist once in the image and are
+# imported once, so objects fitted by one stage (e.g. the feature pipeline) keep a single importable class across the run
+STAGE_MODULES = ["utils"]
+
+
+def load_stage(stage_dir: str, stage: str):
+    '''
+        Imports a stage's lambda_function module from its Lambda code directory.
+        args:
+            stage_dir: directory containing the stage's lambda_function.py and helper modules
+            stage: stage name, used as a unique module name
+        returns:
+            stage module
+    '''
+    for name in STAGE_MODULES:
+        sys.modules.pop(name, None)
+    sys.path.insert(0, stage_dir)
+    try:
+        spec = importlib.util.spec_from_file_location(f"{stage.replace('-', '_')}_stage", os.path.join(stage_dir, "lambda_function.py"))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        sys.path.remove(stage_dir)
+    return module
+
+
+def dataset_lineage(datasets: dict) -> dict:
+    '''
+        Shape, dtype and content hash of every dataset held in memory by the handoff.
+    '''
+    lineage = {}
+    for name, entry in datasets.items():
+        if "array" in entry:
+            dataset = np.ascontiguousarray(entry["array"])
+            lineage[name] = {
+                "shape": list(dataset.shape),
+                "dtype": str(dataset.dtype),
+                "sha256": entry.get("sha256") or hashlib.sha256(dataset.tobytes()).hexdigest()
+            }
+    return lineage
+
+
+def run_fused(run_parameters: dict, stage_dirs: dict) -> dict:
+    '''
+        Runs every stage in order with one in-memory DatasetHandoff.
+        args:
+            run_parameters: run parameters created by the parent Step Function
+            stage_dirs: stage name -> directory of its Lambda code
+        returns:
+            lineage record (stage durations, datasets produced by each stage)
+    '''
+    project_bucket = f"pr-{run_parameters['Environment']}-{run_parameters['Project']}-bucket"
+
+    handoff = None
+    stages = []
+    for stage in STAGES:
+        module = load_stage(stage_dirs[stage], stage)
+        if handoff is None:
+            handoff = sys.modules["handoff"].DatasetHandoff({}, project_bucket, in_memory=True)
+
+        # Every stage appends its own record to the lineage log, as the split stages do
+        start = time.perf_counter()
+        with sys.modules["lineage"].StageLineage(stage, run_parameters, handoff, execution_mode="fused") as lineage:
+            lineage.metrics.update(module.run(run_parameters, handoff))
+        stages.append({
+            "stage": stage,
+            "seconds": round(time.perf_counter() - start, 3),
+            "datasets": dataset_lineage(handoff.datasets),
+            "metrics": lineage.metrics
+        })
+        print(f"{stage} completed in {stages[-1]['seconds']} seconds")
+
+    return {
+        "RunId": run_parameters["RunId"],
+        "RunDate": run_parameters["RunDate"],
+        "ExecutionMode": "fused",
+        "Stages": stages
+    }
+
+
+def lineage_key(run_parameters: dict) -> str:
+    return f"training-pipeline/fused-pipeline/{run_parameters['RunDate']}/{run_parameters['RunId']}/lineage.json"
+
+
+def write_lineage(lineage: dict, run_parameters: dict) -> str:
+    project_bucket = f"pr-{run_parameters['Environment']}-{run_parameters['Project']}-bucket"
+    key = lineage_key(run_parameters)
+    boto3.client("s3").put_object(Bucket=project_bucket, Key=key, Body=json.dumps(lineage, indent=2).encode())
+    return key
+
+
+def read_lineage(run_parameters: dict) -> dict:
+    '''
+        returns:
+            lineage record of a completed fused run, or None when the run has not completed
+    '''
+    project_bucket = f"pr-{run_parameters['Environment']}-{run_parameters['Project']}-bucket"
+    try:
+        body = boto3.client("s3").get_object(Bucket=project_bucket, Key=lineage_key(run_parameters))["Body"].read()
+    except ClientError as error:
+        if error.response["Error"]["Code"] in ("404", "NoSuchKey"):
+            return None
+        raise
+    return json.loads(body)
+
+
+@retryable
+def lambda_handler(event, context):
+
+    # Reading variables passed in by the parent Step Function
+    run_parameters = json.loads(event['Input']['RunParameters'])
+
+    lineage = read_lineage(run_parameters)
+    if lineage is not None:
+        print(f"Fused run {run_parameters['RunId']} already completed")
+        key = lineage_key(run_parameters)
+    else:
+        lineage = run_fused(run_parameters, {stage: os.path.join(BUNDLE_DIR, stage) for stage in STAGES})
+        key = write_lineage(lineage, run_parameters)
+
+    return {"Lineage": key, "Stages": [{"stage": stage["stage"], "seconds": stage["seconds"]} for stage in lineage["Stages"]]}
+
+
+if __name__ == "__main__":
+
+    # Local fused run against the repository layout (lambda/<stage>/lambda), e.g.
+    # python3 lambda/fused-pipeline/lambda/lambda_function.py --lambda-dir lambda --environment test --project regression
+    parser = argparse.ArgumentParser(description="Run the training pipeline stages in a single process")
+    parser.add_argument("--lambda-dir", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+    parser.add_argument("--environment", default="test")
+    parser.add_argument("--project", default="regression")
+    parser.add_argument("--run-id", default="local")
+    parser.add_argument("--run-date", default=time.strftime("%Y-%m-%d"))
+    args = parser.parse_args()
+
+    parameters = {"RunId": args.run_id, "RunDate": args.run_date, "Environment": args.environment, "Project": args.project}
+    record = run_fused(parameters, {stage: os.path.join(args.lambda_dir, stage, "lambda") for stage in STAGES})
+    print(json.dumps({"Lineage": write_lineage(record, parameters), "Stages": record["Stages"]}, indent=2))
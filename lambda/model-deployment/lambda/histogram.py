@@ -0,0 +1,123 @@
+import math
+
+
+# *********************************************
+# Streaming histograms
+#
+# Log-bucketed histograms with a fixed relative error: a value v is counted in bucket ceil(log_gamma(|v|)), so
+# every quantile estimate is within relative_accuracy of the true value, memory grows with the logarithm of the
+# value range instead of the number of observations, recording a value is O(1), and histograms recorded in
+# different containers merge exactly by adding bucket counts. Negative values (e.g. metric deltas) are kept in
+# a mirrored set of buckets.
+#*********************************************
+
+
+class StreamingHistogram:
+    '''
+        args:
+            relative_accuracy: maximum relative error of quantile estimates
+    '''
+    def __init__(self, relative_accuracy: float = 0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.positive = {}
+        self.negative = {}
+        self.zeros = 0
+        self.count = 0
+        self.total = 0.0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+
+    def _index(self, value: float) -> int:
+        return math.ceil(math.log(value) / self.log_gamma)
+
+    def _value(self, index: int) -> float:
+        # Midpoint (in relative terms) of the bucket (gamma^(index - 1), gamma^index]
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def add(self, value: float) -> None:
+        if value > 0:
+            index = self._index(value)
+            self.positive[index] = self.positive.get(index, 0) + 1
+        elif value < 0:
+            index = self._index(-value)
+            self.negative[index] = self.negative.get(index, 0) + 1
+        else:
+            self.zeros += 1
+        self.count += 1
+        self.total += value
+        self.minimum = min(self.minimum, value)
+        self.maximum = max(self.maximum, value)
+
+    def quantile(self, q: float) -> float:
+        '''
+            returns:
+                estimate of the q-quantile (0 <= q <= 1), None for an empty histogram
+        '''
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for index in sorted(self.negative, reverse=True):
+            seen += self.negative[index]
+            if seen > rank:
+                return max(-self._value(index), self.minimum)
+        seen += self.zeros
+        if seen > rank:
+            return 0.0
+        for index in sorted(self.positive):
+            seen += self.positive[index]
+            if seen > rank:
+                return min(self._value(index), self.maximum)
+        return self.maximum
+
+    def merge(self, other: "StreamingHistogram") -> None:
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Histograms with different relative accuracies cannot be merged")
+        for index, count in other.positive.items():
+            self.positive[index] = self.positive.get(index, 0) + count
+        for index, count in other.negative.items():
+            self.negative[index] = self.negative.get(index, 0) + count
+        self.zeros += other.zeros
+        self.count += other.count
+        self.total += other.total
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else None,
+            "min": self.minimum if self.count else None,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+            "max": self.maximum if self.count else None
+        }
+
+    def to_dict(self) -> dict:
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "positive": {str(index): count for index, count in self.positive.items()},
+            "negative": {str(index): count for index, count in self.negative.items()},
+            "zeros": self.zeros,
+            "count": self.count,
+            "total": self.total,
+            "min": self.minimum if self.count else None,
+            "max": self.maximum if self.count else None,
+            "summary": self.summary()
+        }
+
+    @classmethod
+    def from_dict(cls, document: dict) -> "StreamingHistogram":
+        histogram = cls(document["relative_accuracy"])
+        histogram.positive = {int(index): count for index, count in document["positive"].items()}
+        histogram.negative = {int(index): count for index, count in document["negative"].items()}
+        histogram.zeros = document["zeros"]
+        histogram.count = document["count"]
+        histogram.total = document["total"]
+        if histogram.count:
+            histogram.minimum = document["min"]
+            histogram.maximum = document["max"]
+        return histogram
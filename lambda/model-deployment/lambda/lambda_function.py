@@ -0,0 +1,293 @@
+import os
+import json
+import time
+import uuid
+import queue
+import zlib
+import datetime
+import threading
+import urllib.request
+import boto3
+import numpy as np
+
+from registry import ModelRegistry
+from histogram import StreamingHistogram
+
+
+# *********************************************
+# Inference router with canary and shadow traffic splitting
+#
+# The champion and the challenger under rollout come from the model registry (champion.json, deployment.json).
+# In a canary, a stable hash of the routing key sends a share of the requests to the challenger. In shadow mode
+# every response comes from the champion, and a share of the requests is also scored by the challenger in a
+# background thread: the request is only put on a bounded queue (never waited on, dropped when the queue is
+# full), so shadow scoring adds nothing to the primary response's latency.
+#
+# Per-variant latencies and challenger-minus-champion prediction deltas are recorded in streaming histograms
+# and flushed to S3 off the response path as well.
+#*********************************************
+
+# Registry documents are re-read at most this often
+REFRESH_SECONDS = float(os.environ.get("ROUTER_REFRESH_SECONDS", "30"))
+
+# Pending shadow requests; further shadow requests are dropped (and counted) while it is full
+SHADOW_QUEUE_SIZE = int(os.environ.get("SHADOW_QUEUE_SIZE", "256"))
+
+METRICS_FLUSH_SECONDS = float(os.environ.get("METRICS_FLUSH_SECONDS", "60"))
+
+
+def routing_fraction(routing_key: str) -> float:
+    '''
+        Stable position of a routing key in [0, 1), so a caller always sees the same variant during a rollout.
+    '''
+    return zlib.crc32(routing_key.encode()) / 2 ** 32
+
+
+class RouterMetrics:
+    '''
+        Streaming histograms per series (e.g. "latency_ms/champion", "delta/challenger"), safe to record from the
+        request path and the shadow thread at the same time.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+
+    def record(self, series: str, value: float) -> None:
+        with self.lock:
+            if series not in self.histograms:
+                self.histograms[series] = StreamingHistogram()
+            self.histograms[series].add(value)
+
+    def increment(self, counter: str) -> None:
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + 1
+
+    def drain(self) -> dict:
+        '''
+            Returns the recorded histograms and counters and starts new ones (each flush covers one interval).
+        '''
+        with self.lock:
+            histograms, counters = self.histograms, self.counters
+            self.histograms, self.counters = {}, {}
+        return {
+            "histograms": {series: histogram.to_dict() for series, histogram in histograms.items()},
+            "counters": counters
+        }
+
+
+class ShadowScorer:
+    '''
+        Scores shadow requests with the challenger off the response path and flushes the router metrics to S3.
+
+        In Lambda the scorer registers as an internal extension (Extensions API) and drains the queue after each
+        invocation's response has been returned; Lambda only freezes the container once the extension asks for
+        the next event, so shadow scoring runs after the caller has its response. Elsewhere (local runs) a
+        daemon thread drains the queue whenever no request is being served.
+
+        args:
+            metrics: RouterMetrics shared with the request path
+            bucket: project S3 bucket
+            prefix: S3 prefix of the metric flushes
+    '''
+    def __init__(self, metrics: RouterMetrics, bucket: str, prefix: str):
+        self.metrics = metrics
+        self.bucket = bucket
+        self.prefix = prefix
+        self.container_id = uuid.uuid4().hex[:12]
+        self.sequence = 0
+        self.flushed_at = time.monotonic()
+        self.requests = queue.Queue(maxsize=SHADOW_QUEUE_SIZE)
+
+        # Set while no request is being served (local runs); released once per served request (Lambda)
+        self.idle = threading.Event()
+        self.idle.set()
+        self.served = threading.Semaphore(0)
+
+        runtime_api = os.environ.get("AWS_LAMBDA_RUNTIME_API")
+        self.extension = bool(runtime_api)
+        if runtime_api:
+            # Internal extensions have to register during the Init phase, so this happens before the thread starts
+            self.extension_api = f"http://{runtime_api}/2020-01-01/extension"
+            registration = urllib.request.Request(
+                f"{self.extension_api}/register", data=json.dumps({"events": ["INVOKE"]}).encode(),
+                headers={"Lambda-Extension-Name": "shadow-scorer"}, method="POST"
+            )
+            with urllib.request.urlopen(registration) as response:
+                self.extension_id = response.headers["Lambda-Extension-Identifier"]
+            target = self._run_extension
+        else:
+            target = self._run_local
+        self.thread = threading.Thread(target=target, daemon=True)
+        self.thread.start()
+
+    def request_started(self) -> None:
+        self.idle.clear()
+
+    def request_finished(self) -> None:
+        self.idle.set()
+        if self.extension:
+            self.served.release()
+
+    def submit(self, challenger, version: str, instances: np.array, primary_predictions: np.array) -> None:
+        '''
+            Never blocks: the shadow request is dropped when the queue is full.
+        '''
+        try:
+            self.requests.put_nowait((challenger, version, instances, primary_predictions))
+        except queue.Full:
+            self.metrics.increment("shadow_dropped")
+
+    def _run_extension(self) -> None:
+        while True:
+            next_event = urllib.request.Request(
+                f"{self.extension_api}/event/next", headers={"Lambda-Extension-Identifier": self.extension_id}
+            )
+            with urllib.request.urlopen(next_event) as response:
+                response.read()
+            # Wait for this invocation's response, then score everything queued so far
+            self.served.acquire()
+            while True:
+                try:
+                    self._score(*self.requests.get_nowait())
+                except queue.Empty:
+                    break
+            if time.monotonic() - self.flushed_at >= METRICS_FLUSH_SECONDS:
+                self.flush()
+
+    def _run_local(self) -> None:
+        while True:
+            self.idle.wait()
+            try:
+                task = self.requests.get(timeout=METRICS_FLUSH_SECONDS)
+            except queue.Empty:
+                self.flush()
+                continue
+            # One shadow request at a time, so a request arriving meanwhile waits for at most one shadow prediction
+            self._score(*task)
+            if time.monotonic() - self.flushed_at >= METRICS_FLUSH_SECONDS:
+                self.flush()
+
+    def _score(self, challenger, version: str, instances: np.array, primary_predictions: np.array) -> None:
+        try:
+            start = time.perf_counter()
+            predictions = np.asarray(challenger.predict(instances)).reshape(primary_predictions.shape)
+            self.metrics.record("latency_ms/shadow", (time.perf_counter() - start) * 1000)
+            for delta in (predictions - primary_predictions).ravel():
+                self.metrics.record("delta/shadow", float(delta))
+            self.metrics.increment("shadow_scored")
+        except Exception as error:
+            print(f"Shadow scoring with model version {version} failed: {error!r}")
+            self.metrics.increment("shadow_failed")
+
+    def flush(self) -> None:
+        self.flushed_at = time.monotonic()
+        snapshot = self.metrics.drain()
+        if not snapshot["histograms"] and not snapshot["counters"]:
+            return
+        self.sequence += 1
+        now = datetime.datetime.utcnow()
+        key = f"{self.prefix}/{now:%Y-%m-%d}/{now:%H%M%S}-{self.container_id}-{self.sequence:06d}.json"
+        try:
+            boto3.client("s3").put_object(Bucket=self.bucket, Key=key, Body=json.dumps({
+                "container": self.container_id,
+                "flushed_at": now.isoformat(),
+                **snapshot
+            }).encode())
+        except Exception as error:
+            print(f"Router metrics flush failed: {error!r}")
+
+
+class TrafficRouter:
+    '''
+        Routes inference requests between the registry champion and the challenger under rollout.
+
+        args:
+            registry: model registry
+            scorer: ShadowScorer for shadow requests
+            metrics: RouterMetrics of the request path
+    '''
+    def __init__(self, registry: ModelRegistry, scorer: ShadowScorer, metrics: RouterMetrics):
+        self.registry = registry
+        self.scorer = scorer
+        self.metrics = metrics
+        self.checked_at = -float("inf")
+        self.champion = None
+        self.deployment = None
+        self.models = {}
+
+    def refresh(self) -> None:
+        '''
+            Re-reads the champion pointer and rollout at most every REFRESH_SECONDS; models load once per version.
+        '''
+        if time.monotonic() - self.checked_at < REFRESH_SECONDS:
+            return
+        champion = self.registry.champion()
+        if champion is None:
+            raise RuntimeError("No champion model has been promoted yet")
+        deployment = self.registry.deployment()
+        versions = {champion["version"], deployment["challenger"]} - {None}
+        self.models = {version: self.models.get(version) or self.registry.load(version) for version in versions}
+        self.champion, self.deployment = champion, deployment
+        self.checked_at = time.monotonic()
+
+    def predict(self, instances: np.array, routing_key: str) -> dict:
+        self.refresh()
+        champion_version = self.champion["version"]
+        challenger_version = self.deployment["challenger"]
+        in_rollout = challenger_version is not None and routing_fraction(routing_key) < self.deployment["share"]
+
+        variant, version = "champion", champion_version
+        if in_rollout and self.deployment["mode"] == "canary":
+            variant, version = "challenger", challenger_version
+
+        start = time.perf_counter()
+        predictions = np.asarray(self.models[version].predict(instances))
+        self.metrics.record(f"latency_ms/{variant}", (time.perf_counter() - start) * 1000)
+        self.metrics.increment(f"requests/{variant}")
+
+        if in_rollout and self.deployment["mode"] == "shadow":
+            self.scorer.submit(self.models[challenger_version], challenger_version, instances, predictions)
+
+        return {"predictions": predictions.tolist(), "model_version": version, "variant": variant}
+
+
+_ROUTERS = {}
+
+
+def get_router(bucket: str) -> TrafficRouter:
+    '''
+        One router (and shadow scorer) per container, reused by warm invocations.
+    '''
+    if bucket not in _ROUTERS:
+        metrics = RouterMetrics()
+        registry = ModelRegistry(bucket)
+        scorer = ShadowScorer(metrics, bucket, f"{registry.prefix}/deployment-metrics")
+        _ROUTERS[bucket] = TrafficRouter(registry, scorer, metrics)
+    return _ROUTERS[bucket]
+
+
+def project_bucket() -> str:
+    return f"pr-{os.environ['ENVIRONMENT']}-{os.environ['PROJECT']}-bucket"
+
+
+def lambda_handler(event, context):
+    '''
+        Request: {"instances": [[feature values], ...], "routing_key": optional caller/session id}
+        Response: {"predictions": [...], "model_version": str, "variant": "champion" or "challenger"}
+    '''
+    router = get_router(project_bucket())
+    # Every invocation has to be marked finished, failed ones included: the extension waits for it before
+    # asking for the next event
+    router.scorer.request_started()
+    try:
+        request = json.loads(event["body"]) if isinstance(event.get("body"), str) else event
+        routing_key = request.get("routing_key") or getattr(context, "aws_request_id", None) or uuid.uuid4().hex
+        return router.predict(np.asarray(request["instances"]), str(routing_key))
+    finally:
+        router.scorer.request_finished()
+
+
+# In Lambda the router is created during Init, when the shadow scorer's extension has to register
+if os.environ.get("AWS_LAMBDA_RUNTIME_API"):
+    get_router(project_bucket())
@@ -0,0 +1,65 @@
+import json
+
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def histogram(stage):
+    return stage("model-deployment").histogram
+
+
+def record(histogram, values, relative_accuracy: float = 0.01):
+    recorded = histogram.StreamingHistogram(relative_accuracy)
+    for value in values:
+        recorded.add(float(value))
+    return recorded
+
+
+@pytest.mark.parametrize("relative_accuracy", [0.01, 0.05])
+def test_quantiles_are_within_relative_accuracy(histogram, relative_accuracy):
+    rng = np.random.default_rng(0)
+    # Latencies spanning several orders of magnitude, and deltas of both signs with exact zeros
+    for values in (rng.lognormal(mean=2.0, sigma=1.5, size=5000), np.concatenate([rng.normal(size=5000), np.zeros(100)])):
+        recorded = record(histogram, values, relative_accuracy)
+        ordered = np.sort(values)
+        for q in (0.0, 0.01, 0.25, 0.5, 0.75, 0.9, 0.99, 1.0):
+            exact = ordered[int(q * (len(values) - 1))]
+            assert abs(recorded.quantile(q) - exact) <= relative_accuracy * abs(exact) + 1e-12, q
+
+
+def test_empty_histogram(histogram):
+    empty = histogram.StreamingHistogram()
+    assert empty.quantile(0.5) is None
+    assert empty.summary() == {"count": 0, "mean": None, "min": None, "p50": None, "p90": None, "p99": None, "max": None}
+
+
+def test_merge_equals_recording_everything_in_one(histogram):
+    rng = np.random.default_rng(1)
+    values = rng.normal(scale=10.0, size=3000)
+    merged = record(histogram, values[:1000])
+    merged.merge(record(histogram, values[1000:]))
+    single = record(histogram, values)
+
+    assert merged.positive == single.positive
+    assert merged.negative == single.negative
+    assert (merged.zeros, merged.count, merged.minimum, merged.maximum) == (single.zeros, single.count, single.minimum, single.maximum)
+    assert merged.total == pytest.approx(single.total)
+    assert merged.summary() == pytest.approx(single.summary())
+
+    with pytest.raises(ValueError):
+        merged.merge(histogram.StreamingHistogram(0.05))
+
+
+@pytest.mark.parametrize("values", [[], [0.0], [-3.5, 0.0, 0.25, 12.0, 12.0, 9000.0]])
+def test_dict_round_trip(histogram, values):
+    recorded = record(histogram, values)
+    # As flushed to and read back from S3
+    restored = histogram.StreamingHistogram.from_dict(json.loads(json.dumps(recorded.to_dict())))
+
+    assert restored.to_dict() == recorded.to_dict()
+    for q in (0.0, 0.5, 0.99, 1.0):
+        assert restored.quantile(q) == recorded.quantile(q)
+    restored.add(1.0)
+    recorded.add(1.0)
+    assert restored.summary() == recorded.summary()
@@ -0,0 +1,109 @@
+import json
+import time
+import boto3
+import pytest
+import numpy as np
+from sklearn.linear_model import LinearRegression
+from sklearn.pipeline import Pipeline
+
+
+def register_pipeline_models(stage, bucket: str) -> tuple:
+    '''
+        Registers a champion and a challenger the way the training stage does (a Pipeline whose first step is a
+        fitted features.FeaturePipeline), from the model-training image.
+    '''
+    training = stage("model-training")
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(200, 3))
+    y = X @ np.array([1.0, -2.0, 0.5]) + 3.0
+
+    registry = training.registry.ModelRegistry(bucket)
+    models = {}
+    for version, config in [("champion-run", None), ("challenger-run", {"transforms": [{"type": "scale"}, {"type": "polynomial"}]})]:
+        feature_pipeline = training.features.FeaturePipeline(config).fit(X)
+        model = Pipeline([("features", feature_pipeline), ("regressor", LinearRegression())]).fit(X, y)
+        registry.register(model, version, {"run_id": version})
+        models[version] = model
+    registry.promote("champion-run")
+    return X, models
+
+
+def router(deployment, bucket: str):
+    metrics = deployment.lambda_function.RouterMetrics()
+    registry = deployment.registry.ModelRegistry(bucket)
+    scorer = deployment.lambda_function.ShadowScorer(metrics, bucket, f"{registry.prefix}/deployment-metrics")
+    return deployment.lambda_function.TrafficRouter(registry, scorer, metrics), registry
+
+
+def test_router_serves_registered_pipeline(stage, aws, monkeypatch):
+    monkeypatch.setenv("METRICS_FLUSH_SECONDS", "3600")
+    X, models = register_pipeline_models(stage, aws)
+
+    # A fresh deployment image: the registered models are unpickled with its own modules only
+    traffic_router, _ = router(stage("model-deployment"), aws)
+    response = traffic_router.predict(X[:5], "caller-1")
+
+    assert response["model_version"] == "champion-run"
+    assert response["variant"] == "champion"
+    np.testing.assert_allclose(response["predictions"], models["champion-run"].predict(X[:5]))
+
+
+def test_router_canary_serves_challenger(stage, aws, monkeypatch):
+    monkeypatch.setenv("METRICS_FLUSH_SECONDS", "3600")
+    X, models = register_pipeline_models(stage, aws)
+
+    traffic_router, registry = router(stage("model-deployment"), aws)
+    registry.set_deployment("challenger-run", "canary", 1.0)
+    response = traffic_router.predict(X[:5], "caller-1")
+
+    assert response["model_version"] == "challenger-run"
+    assert response["variant"] == "challenger"
+    np.testing.assert_allclose(response["predictions"], models["challenger-run"].predict(X[:5]))
+
+
+def test_router_shadow_scores_challenger_off_the_response(stage, aws, monkeypatch):
+    monkeypatch.setenv("METRICS_FLUSH_SECONDS", "3600")
+    X, models = register_pipeline_models(stage, aws)
+
+    deployment = stage("model-deployment")
+    traffic_router, registry = router(deployment, aws)
+    registry.set_deployment("challenger-run", "shadow", 1.0)
+    response = traffic_router.predict(X[:5], "caller-1")
+
+    # The response is the champion's; the challenger is scored by the background thread
+    assert response["model_version"] == "champion-run"
+    assert response["variant"] == "champion"
+    np.testing.assert_allclose(response["predictions"], models["champion-run"].predict(X[:5]))
+    deadline = time.monotonic() + 30
+    while traffic_router.metrics.counters.get("shadow_scored", 0) < 1:
+        assert time.monotonic() < deadline, "shadow request was not scored"
+        time.sleep(0.01)
+
+    traffic_router.scorer.flush()
+    s3 = boto3.client("s3")
+    keys = [item["Key"] for item in s3.list_objects_v2(Bucket=aws, Prefix=traffic_router.scorer.prefix)["Contents"]]
+    assert len(keys) == 1
+    flushed = json.loads(s3.get_object(Bucket=aws, Key=keys[0])["Body"].read())
+    assert flushed["counters"] == {"requests/champion": 1, "shadow_scored": 1}
+    deltas = deployment.histogram.StreamingHistogram.from_dict(flushed["histograms"]["delta/shadow"])
+    expected = models["challenger-run"].predict(X[:5]) - models["champion-run"].predict(X[:5])
+    assert deltas.count == 5
+    assert deltas.total == pytest.approx(expected.sum())
+
+
+@pytest.mark.parametrize("event", [{"body": "not json"}, {"body": "{}"}, {"routing_key": "caller-1"}])
+def test_handler_finishes_failed_requests(stage, aws, monkeypatch, event):
+    monkeypatch.setenv("METRICS_FLUSH_SECONDS", "3600")
+    register_pipeline_models(stage, aws)
+
+    deployment = stage("model-deployment")
+    traffic_router, _ = router(deployment, aws)
+    # As in Lambda, where the extension thread waits on served after each INVOKE event
+    traffic_router.scorer.extension = True
+    monkeypatch.setitem(deployment.lambda_function._ROUTERS, aws, traffic_router)
+
+    with pytest.raises((ValueError, KeyError)):
+        deployment.lambda_function.lambda_handler(event, None)
+
+    assert traffic_router.scorer.served.acquire(blocking=False)
+    assert traffic_router.scorer.idle.is_set()
@@ -0,0 +1,154 @@
+import io
+import os
+import json
+import math
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+import numpy as np
+from botocore.exceptions import ClientError
+from sklearn.metrics import mean_squared_error, mean_absolute_error
+
+from registry import ModelRegistry, ChampionChanged
+from utils import hash_array
+
+
+# *********************************************
+# Champion/challenger comparison
+#
+# The challenger (this run's model) and the registry champion are scored on the same canonical test set.
+# A champion's predictions and metrics on a test set never change, so they are cached in S3 (and in memory
+# for warm containers) under the champion version and the test set hash, and only recomputed when either
+# changes. Challenger scoring runs concurrently with champion loading/scoring (or with reading the cache).
+# A promotion only replaces the champion the challenger was compared against, so of several runs finishing
+# at the same time the best model ends up champion, whatever their order.
+#*********************************************
+
+# Comparisons against a newer champion promoted by a concurrent run before the challenger gives up
+PROMOTION_ATTEMPTS = 5
+
+# (champion version, test set hash) -> cached champion scores
+_CHAMPION_SCORES = {}
+
+
+def score(model, features: np.array, labels: np.array) -> dict:
+    '''
+        args:
+            model: fitted model
+            features: test features
+            labels: test labels
+        returns:
+            {"predictions": np.array, "metrics": {"rmse", "mae", "rows"}}
+    '''
+    predictions = np.asarray(model.predict(features))
+    labels = labels.flatten()
+    return {
+        "predictions": predictions,
+        "metrics": {
+            "rmse": math.sqrt(mean_squared_error(labels, predictions.flatten())),
+            "mae": float(mean_absolute_error(labels, predictions.flatten())),
+            "rows": int(labels.shape[0])
+        }
+    }
+
+
+def champion_scores(registry: ModelRegistry, version: str, features: np.array, labels: np.array, test_hash: str) -> dict:
+    '''
+        Champion scores on a test set, from the cache when this (champion version, test set) was scored before.
+
+        returns:
+            {"predictions", "metrics", "cached": bool}
+    '''
+    if (version, test_hash) in _CHAMPION_SCORES:
+        return {**_CHAMPION_SCORES[(version, test_hash)], "cached": True}
+
+    s3 = boto3.client("s3")
+    key = f"{registry.prefix}/scores/{version}/{test_hash}.npz"
+    try:
+        body = s3.get_object(Bucket=registry.bucket, Key=key)["Body"].read()
+        with np.load(io.BytesIO(body), allow_pickle=False) as cached:
+            scores = {"predictions": cached["predictions"], "metrics": json.loads(str(cached["metrics"]))}
+        cached = True
+    except ClientError as error:
+        if error.response["Error"]["Code"] not in ("404", "NoSuchKey"):
+            raise
+        scores = score(registry.load(version), features, labels)
+        buffer = io.BytesIO()
+        np.savez(buffer, predictions=scores["predictions"], metrics=np.array(json.dumps(scores["metrics"])))
+        s3.put_object(Bucket=registry.bucket, Key=key, Body=buffer.getvalue())
+        cached = False
+
+    _CHAMPION_SCORES[(version, test_hash)] = scores
+    return {**scores, "cached": cached}
+
+
+def compare(registry: ModelRegistry, challenger_version: str, challenger, features: np.array, labels: np.array) -> dict:
+    '''
+        Scores the challenger and the current champion on the test set and decides whether to promote.
+
+        With a champion, the challenger is promoted when its test RMSE is lower. Without one (first
+        deployment), it is promoted when its RMSE is within MAX_RMSE, the maximum RMSE agreed with product
+        management (unset: no limit).
+
+        args:
+            registry: model registry holding the champion
+            challenger_version: registered version of the challenger
+            challenger: challenger model
+            features: canonical test features
+            labels: canonical test labels
+        returns:
+            comparison report; report["challenger_predictions"] holds the challenger's predictions
+    '''
+    test_hash = hash_array(features, hash_array(labels))
+    pointer = registry.champion()
+    champion_version = pointer["version"] if pointer and pointer["version"] != challenger_version else None
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        challenger_future = executor.submit(score, challenger, features, labels)
+        champion_future = executor.submit(champion_scores, registry, champion_version, features, labels, test_hash) if champion_version else None
+        challenger_scores = challenger_future.result()
+        champion = champion_future.result() if champion_future else None
+
+    report = {
+        "test_set_sha256": test_hash,
+        "challenger_version": challenger_version,
+        "challenger": challenger_scores["metrics"],
+        "champion_version": champion_version,
+        "champion": champion["metrics"] if champion else None,
+        "champion_cached": champion["cached"] if champion else None
+    }
+    if champion:
+        # Share of test rows on which the challenger's absolute error is lower than the champion's
+        labels_flat = labels.flatten()
+        challenger_errors = np.abs(challenger_scores["predictions"].flatten() - labels_flat)
+        champion_errors = np.abs(champion["predictions"].flatten() - labels_flat)
+        report["challenger_win_rate"] = float(np.mean(challenger_errors < champion_errors))
+        report["promote"] = challenger_scores["metrics"]["rmse"] < champion["metrics"]["rmse"]
+    else:
+        report["promote"] = challenger_scores["metrics"]["rmse"] <= float(os.environ.get("MAX_RMSE", "inf"))
+
+    report["challenger_predictions"] = challenger_scores["predictions"]
+    return report
+
+
+def promote(registry: ModelRegistry, comparison: dict, challenger, features: np.array, labels: np.array) -> dict:
+    '''
+        Promotes a challenger that won its comparison. When a concurrent run promoted another version since the
+        comparison, the challenger is compared again against the new champion and only promoted if it still wins.
+
+        args:
+            registry: model registry holding the champion
+            comparison: compare() report of the challenger
+            challenger: challenger model
+            features: canonical test features
+            labels: canonical test labels
+        returns:
+            champion pointer, or None when a newer champion beats the challenger
+    '''
+    for _ in range(PROMOTION_ATTEMPTS):
+        try:
+            return registry.promote(comparison["challenger_version"], expected=comparison["champion_version"])
+        except ChampionChanged:
+            comparison = compare(registry, comparison["challenger_version"], challenger, features, labels)
+            if not comparison["promote"]:
+                return None
+    raise ChampionChanged(f"The champion kept changing during the promotion of {comparison['challenger_version']}")
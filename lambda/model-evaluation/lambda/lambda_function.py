@@ -1,90 +1,167 @@
-import uuid
-import s3fs
+import os
+import asyncio
 import json
-import numpy as np
-import math
-from sklearn.metrics import mean_squared_error
+from dataclasses import replace
 
-from utils import read_data, load_model_from_s3
+from contracts import CONTRACTS, validate, enforce, enforce_same_rows
+from aio import to_thread
+from utils import write_json, write_json_async
+from handoff import DatasetHandoff
+from lineage import StageLineage
+from checkpoints import StageCheckpoint
+from retries import retryable
+from registry import ModelRegistry
+from champion_challenger import compare, promote, score
+from partitioned import PartitionedDataset, dataset_root
 
 
+# Slices scored on their own (comma-separated slice numbers); every slice of the run's test set when unset
+EVALUATION_SLICES = os.environ.get("EVALUATION_SLICES", "")
+
+
+@retryable
 def lambda_handler(event, context):
     
+    # Reading variables passed in by the parent Step Function
+    run_parameters = json.loads(event['Input']['RunParameters'])
+    
+    handoff = DatasetHandoff(event['Input'], f"pr-{run_parameters['Environment']}-{run_parameters['Project']}-bucket")
+    # The evaluation holds only while the registered model version it evaluated (and its recorded metrics) is unchanged
+    registry = ModelRegistry(handoff.bucket)
+    checkpoint = StageCheckpoint("model-evaluation", run_parameters, handoff, dependencies=[
+        registry.artifact_key(run_parameters['RunId']), registry.metadata_key(run_parameters['RunId'])
+    ])
+    if checkpoint.completed():
+        return checkpoint.result
+    with StageLineage("model-evaluation", run_parameters, handoff, context) as lineage:
+        lineage.metrics.update(run(run_parameters, handoff))
+    return checkpoint.complete(handoff.output())
+
+
+def evaluate_slices(model, bucket: str, run_date: str, run_id: str) -> dict:
+    '''
+        Metrics of a model on every slice of a run's test set. Each slice is read on its own from the partitioned
+        test dataset, so only the row groups of that slice are downloaded.
+        
+        args:
+            model: fitted model
+            bucket: project S3 bucket
+            run_date: date of the run
+            run_id: run whose test rows are scored
+        returns:
+            {slice: {"rmse", "mae", "rows"}}, empty when the run has no partitioned test dataset
+    '''
+    dataset = PartitionedDataset(bucket, dataset_root("test"))
+    run_filters = [("date", "==", run_date), ("run", "==", run_id)]
+    slices = sorted(file["slice"] for manifest in dataset.manifests(run_filters) for file in manifest["files"])
+    if EVALUATION_SLICES:
+        slices = [slice_value for slice_value in slices if str(slice_value) in EVALUATION_SLICES.split(",")]
+    metrics = {}
+    for slice_value in slices:
+        rows = dataset.read(filters=run_filters + [("slice", "==", slice_value)])
+        metrics[str(slice_value)] = score(model, rows[:, :-1], rows[:, -1])["metrics"]
+    return metrics
+
+
+def run(run_parameters: dict, handoff: DatasetHandoff) -> dict:
+    '''
+        Model evaluation stage, shared by the stage Lambda and the fused pipeline.
+        
+        args:
+            run_parameters: run parameters created by the parent Step Function
+            handoff: DatasetHandoff the evaluation datasets are read from
+        returns:
+            {"test_rmse", "test_mae", "promoted"} of the challenger, recorded as lineage metrics
+    '''
+    
     # *********************************************
     # Read evaluation data from S3
     #*********************************************
     
-    # Reading variables passed in by the parent Step Function
-    run_id = json.loads(event['Input']['RunParameters'])['RunId']
-    run_date = json.loads(event['Input']['RunParameters'])['RunDate']
-    environment = json.loads(event['Input']['RunParameters'])['Environment']
-    project = json.loads(event['Input']['RunParameters'])['Project']
+    run_id = run_parameters['RunId']
+    run_date = run_parameters['RunDate']
+    environment = run_parameters['Environment']
+    project = run_parameters['Project']
     
     project_bucket = f"pr-{environment}-{project}-bucket"
     prefix = f"training-pipeline/data-preparation/{run_date}/{run_id}"
     
-    test_features = read_data(project_bucket, f"{prefix}/test-features.csv")
-    assert test_features.shape == (7, 1)
-    assert test_features.dtype == "int64"
-
-    test_labels = read_data(project_bucket, f"{prefix}/test-labels.csv").flatten()
-    assert test_labels.shape == (7,)
-    assert test_labels.dtype == "int64"
-
-    assert test_features.shape[0] == test_labels.shape[0]
+    validation_prefix = f"training-pipeline/model-evaluation/{run_date}/{run_id}/validation"
+    
+    async def read_dataset(name: str, contract) -> tuple:
+        dataset, report = await handoff.read_async(name, f"{prefix}/{name}.csv", contract)
+        await write_json_async(report, project_bucket, f"{validation_prefix}/{name}.json")
+        return dataset, enforce(report, contract)
 
     # *********************************************
-    # Load serialized model from S3 so it's accessible inside this Lambda container
+    # Load this run's model version from the model registry so it's accessible inside this Lambda container,
+    # while the test datasets download
     #*********************************************
 
-    model = load_model_from_s3(project_bucket, "models/LinearRegression_Model.pkl")
+    registry = ModelRegistry(project_bucket)
 
-    evaluation_predictions = model.predict(test_features)
+    async def read_inputs() -> tuple:
+        return await asyncio.gather(
+            read_dataset("test-features", CONTRACTS["test-features"]),
+            read_dataset("test-labels", CONTRACTS["test-labels"]),
+            to_thread(handoff.artifact, "model", lambda: registry.load(run_id))
+        )
 
-    assert type(evaluation_predictions) == np.ndarray
-    assert evaluation_predictions.shape == (7,)
+    (test_features, test_features_report), (test_labels, test_labels_report), model = asyncio.run(read_inputs())
+    enforce_same_rows(test_features_report, test_labels_report)
     
     # *********************************************
-    # Add a test for the accuracy of the model (JD)
+    # Champion/challenger comparison on the test set
     #*********************************************
     
-    test_rmse = math.sqrt(mean_squared_error(test_labels.flatten(), evaluation_predictions))
-    
     '''
-        If there is an existing deployed model, we load its RMSE and compare it against this 
-        "challenger" model's RMSE to decide whether this challenger model will replace the champion model.
-        
-        If there is no model in production yet (1st time deployment), obtain a maximum RMSE from product management.
-        If we meet or exceed it, we deploy the model to production. Otherwise, improve model performance iteratively.
+        This "challenger" model and the deployed champion model (from the model registry) are scored in parallel
+        on the test set, reusing the champion's cached scores when it was already scored on this test set, to decide
+        whether this challenger model will replace the champion model.
         
-        In practice, we perform model evaluation on distinct slices of the test set, 
-        weigh them by importance/business impact, and produce a weighted sum for the final model evaluation score.
+        If there is no model in production yet (1st time deployment), the maximum RMSE from product management
+        (MAX_RMSE) applies. If we meet or exceed it, we deploy the model to production. Otherwise, improve model
+        performance iteratively.
         
-        For now, testing the model "against itself" by obtaining a RMSE on the train set. 
-        This train_rmse mocks the baseline RMSE.
+        The challenger is also scored on every slice of the test set (partitions of the partitioned test dataset),
+        so slices can be weighed by importance/business impact into a weighted evaluation score.
     '''
     
-    train_features = read_data(project_bucket, f"{prefix}/train-features.csv")
-    train_labels = read_data(project_bucket, f"{prefix}/train-labels.csv")
+    comparison = compare(registry, run_id, model, test_features, test_labels)
+    evaluation_predictions = comparison.pop("challenger_predictions")
+    # Express runs write no partitioned test dataset (see data preparation)
+    comparison["challenger_slices"] = {} if handoff.inline else evaluate_slices(model, project_bucket, run_date, run_id)
     
-    baseline_predictions = model.predict(train_features)
-    train_rmse = math.sqrt(mean_squared_error(train_labels.flatten(), baseline_predictions))
+    predictions_contract = replace(CONTRACTS["predictions"], min_rows=test_labels.shape[0], max_rows=test_labels.shape[0])
+    predictions_report = validate(predictions_contract, evaluation_predictions)
+    write_json(predictions_report, project_bucket, f"{validation_prefix}/predictions.json")
+    enforce(predictions_report, predictions_contract)
     
-    if test_rmse < train_rmse:
+    write_json(comparison, project_bucket, f"training-pipeline/model-evaluation/{run_date}/{run_id}/champion-challenger.json")
+    registry.record_metrics(run_id, {"test_rmse": comparison["challenger"]["rmse"], "test_mae": comparison["challenger"]["mae"]})
+    
+    if comparison["promote"]:
         '''
-        Proceed to production deployment. Options:
+        Proceed to production deployment (ROLLOUT):
+        
+        - promote: the challenger replaces the champion right away
+        - canary: the inference router (lambda/model-deployment) serves ROLLOUT_SHARE of the requests with the challenger
+        - shadow: the router scores ROLLOUT_SHARE of the requests with the challenger off the response path
         
-        - Shadow deployment
-        - Canary deployment
-        - Blue/green deployment
-        - A/B testing
+        Canary and shadow rollouts end when the challenger is promoted (or the rollout is cleared) in the registry.
         '''
-        print("Production deployment implementation pending...")
+        rollout = os.environ.get("ROLLOUT", "promote")
+        if rollout == "promote" or comparison["champion_version"] is None:
+            champion = promote(registry, comparison, model, test_features, test_labels)
+            if champion is None:
+                comparison["promote"] = False
+                print(f"Model version {run_id} lost against a champion promoted by a concurrent run")
+            else:
+                print(f"Model version {run_id} promoted to champion (previous champion: {champion['previous']})")
+        else:
+            registry.set_deployment(run_id, rollout, float(os.environ.get("ROLLOUT_SHARE", "0.1")))
+            print(f"Model version {run_id} rolled out as a {rollout} challenger")
     else:
         print("No new champion model found in this training pipeline run.")
-    
-    
-    # *********************************************
-    # TODO: Log microservice metadata
-    #*********************************************
-    
\ No newline at end of file
+
+    return {"test_rmse": comparison["challenger"]["rmse"], "test_mae": comparison["challenger"]["mae"], "promoted": bool(comparison["promote"])}
@@ -1,15 +1,26 @@
+import os
+import asyncio
 import boto3
 import pandas as pd
 import numpy as np
 import json
+import hashlib
+import io
 from io import StringIO
+import shutil
 import tempfile
 from joblib import dump, load
 
+from contracts import DatasetContract, ContractValidator
+from dtypes import csv_dtypes
+from aio import to_thread, prefetch
+from ranged import RangedDownload, open_object, use_ranges, read_into, row_chunks, open_buffer, client, executor
+
 
 def read_data(bucket: str, key: str) -> np.array:
     '''
-        Reads small CSV files from S3.
+        Reads CSV files from S3 with one GET. Files of RANGE_THRESHOLD_BYTES or more are downloaded as parallel
+        byte ranges instead and parsed chunk by chunk as the ranges arrive (see ranged.py).
         
         args:
             bucket: S3 bucket name
@@ -17,15 +28,290 @@ def read_data(bucket: str, key: str) -> np.array:
         returns:
             np.array containing the data
     '''
-    s3_csv = boto3.client("s3").get_object(Bucket=bucket, Key=key)
-    csv_string = s3_csv["Body"].read().decode("utf-8")
+    body, head = open_object(bucket, key)
+    if use_ranges(head["size"]):
+        return read_data_ranged(bucket, key, head, body)
+    csv_string = body.read().decode("utf-8")
     dataset = pd.read_csv(StringIO(csv_string)).to_numpy()
     return dataset
 
 
+def read_data_ranged(bucket: str, key: str, head: dict, first=None) -> np.array:
+    '''
+        Reads a large CSV file from S3 over parallel byte ranges, parsing each row-aligned chunk of the downloaded
+        prefix while the later ranges download.
+        
+        args:
+            bucket: S3 bucket name
+            key: S3 path to the CSV file
+            head: {"size", "etag"} of the file (ranged.open_object)
+            first: body returned by ranged.open_object, whose first range is read instead of requested again
+        returns:
+            np.array containing the data
+    '''
+    columns, chunks, frame = None, [], None
+    for chunk in row_chunks(RangedDownload(bucket, key, head, first=first)):
+        # Only the first chunk starts with the header row
+        frame = pd.read_csv(open_buffer(chunk), header=0 if columns is None else None, names=columns)
+        columns = list(frame.columns)
+        if len(frame):
+            chunks.append(frame.to_numpy())
+    if not chunks:
+        return frame.to_numpy() if frame is not None else np.empty((0, 0))
+    return chunks[0] if len(chunks) == 1 else np.concatenate(chunks)
+
+
+async def read_data_async(bucket: str, key: str) -> np.array:
+    return await to_thread(read_data, bucket, key)
+
+
+async def stream_csv(bucket: str, key: str, dtypes: dict = None, chunk_rows: int = 100000):
+    '''
+        Streams a CSV file from S3 as np.array chunks. The next chunk downloads and parses on the I/O thread pool
+        while the caller processes the current one.
+        
+        args:
+            bucket: S3 bucket name
+            key: S3 path to the CSV file
+            dtypes: dtype plan recorded when the dataset was written (see dtypes.py); None lets pandas infer dtypes
+            chunk_rows: rows parsed per chunk
+        returns:
+            async iterator of np.array chunks
+    '''
+    body = (await to_thread(boto3.client("s3").get_object, Bucket=bucket, Key=key))["Body"]
+    reader = await to_thread(pd.read_csv, body, chunksize=chunk_rows, dtype=csv_dtypes(dtypes))
+    async for chunk in prefetch(frame.to_numpy(dtype=dtypes["dtype"] if dtypes else None) for frame in reader):
+        yield chunk
+
+
+def read_validated(bucket: str, key: str, contract: DatasetContract, dtypes: dict = None, chunk_rows: int = 100000) -> tuple:
+    '''
+        Streams a CSV file from S3 in chunks, validating each chunk against a dataset contract as it arrives
+        (the next chunk is prefetched while the current one is validated).
+        The violation report is returned alongside the data so callers can record it before enforcing it.
+        
+        args:
+            bucket: S3 bucket name
+            key: S3 path to the CSV file
+            contract: DatasetContract the data must satisfy (1-D contracts flatten the single CSV column)
+            dtypes: dtype plan recorded when the dataset was written (see dtypes.py); None lets pandas infer dtypes
+            chunk_rows: rows parsed per chunk
+        returns:
+            (np.array containing the data, validation report)
+    '''
+    return asyncio.run(read_validated_async(bucket, key, contract, dtypes, chunk_rows))
+
+
+async def read_validated_async(bucket: str, key: str, contract: DatasetContract, dtypes: dict = None, chunk_rows: int = 100000) -> tuple:
+    '''
+        read_validated for asyncio code: each chunk is validated while the next one downloads and parses.
+    '''
+    validator = ContractValidator(contract)
+    chunks = []
+    async for chunk in stream_csv(bucket, key, dtypes, chunk_rows):
+        if contract.ndim == 1:
+            chunk = chunk.flatten()
+        validator.update(chunk)
+        chunks.append(chunk)
+    if len(chunks) == 1:
+        dataset = chunks[0]
+    else:
+        dataset = np.concatenate(chunks) if chunks else np.empty((0,) * contract.ndim)
+    return dataset, validator.report()
+
+
+def write_json(document: dict, bucket: str, key: str) -> None:
+    '''
+        Writes a JSON document (e.g. a validation report) to S3.
+        
+        args:
+            document: JSON-serializable dict
+            bucket: S3 bucket name
+            key: S3 path to the JSON file
+        returns:
+            None
+    '''
+    boto3.resource("s3").Object(bucket, key).put(Body=json.dumps(document), ContentType="application/json")
+
+
+async def write_json_async(document: dict, bucket: str, key: str) -> None:
+    await to_thread(write_json, document, bucket, key)
+
+
+def allocate_array(stream, key: str) -> np.array:
+    '''
+        Parses a .npy header from a stream and allocates the (uninitialized) array it describes.
+    '''
+    version = np.lib.format.read_magic(stream)
+    read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+    shape, fortran_order, dtype = read_header(stream)
+    if dtype.hasobject:
+        raise ValueError(f"{key} holds Python objects, which are not read from S3")
+    return np.empty(shape, dtype=dtype, order="F" if fortran_order else "C")
+
+
+def read_array(bucket: str, key: str) -> np.array:
+    '''
+        Reads a .npy file from S3 with a single copy of the data: the header is parsed from the response stream,
+        the array is allocated once with its final shape and dtype, and the rest of the body is read straight
+        into the array's memory (readinto), with no intermediate bytes, string, or DataFrame. Files of
+        RANGE_THRESHOLD_BYTES or more fill the array over parallel byte ranges instead of one stream.
+        
+        args:
+            bucket: S3 bucket name
+            key: S3 path to the .npy file
+        returns:
+            np.array containing the data
+    '''
+    body, head = open_object(bucket, key)
+    dataset = allocate_array(body, key)
+    memory = memoryview(dataset.reshape(-1, order="A")).cast("B")
+    if use_ranges(head["size"]):
+        # The body is positioned past the header, at the first byte of the array
+        RangedDownload(bucket, key, head, memory, offset=head["size"] - len(memory), first=body).wait()
+        return dataset
+    read_into(body, memory, key)
+    return dataset
+
+
+def write_data(dataset: np.array, bucket: str, key: str) -> None:
+    '''
+        Writes an array to S3 as a CSV file.
+        
+        args:
+            dataset: np.array to write
+            bucket: S3 bucket name
+            key: S3 path to the CSV file
+        returns:
+            None
+    '''
+    boto3.resource("s3").Object(bucket, key).put(Body=encode_csv(dataset))
+
+
+def write_array(dataset: np.array, bucket: str, key: str) -> None:
+    '''
+        Writes an array to S3 as a .npy file (dtype and shape preserved).
+        
+        args:
+            dataset: np.array to write
+            bucket: S3 bucket name
+            key: S3 path to the .npy file
+        returns:
+            None
+    '''
+    buffer = io.BytesIO()
+    np.lib.format.write_array(buffer, np.asanyarray(dataset), allow_pickle=False)
+    buffer.seek(0)
+    boto3.client("s3").put_object(Bucket=bucket, Key=key, Body=buffer)
+
+
+async def read_array_async(bucket: str, key: str) -> np.array:
+    return await to_thread(read_array, bucket, key)
+
+
+# *********************************************
+# Streaming uploads
+#*********************************************
+
+# Bytes per multipart upload part (S3 requires at least 5 MB for every part but the last)
+UPLOAD_PART_BYTES = max(int(os.environ.get("UPLOAD_PART_BYTES", str(8 * 1024 * 1024))), 5 * 1024 * 1024)
+
+
+def encode_csv(dataset: np.array, header: bool = True) -> bytes:
+    '''
+        CSV bytes of an array as written by write_data; chunks of one file after the first are encoded without the header.
+    '''
+    return pd.DataFrame(dataset).to_csv(index=None, header=header).encode("utf-8")
+
+
+class MultipartWriter:
+    '''
+        Streams bytes to an S3 object of unknown size as a multipart upload. Writes are buffered into
+        UPLOAD_PART_BYTES parts, and each part uploads on the range thread pool while the next one fills, with at
+        most one part in flight, so memory stays at about two parts whatever the object size. Objects smaller
+        than one part are written with a single PUT; nothing is visible at the key before close().
+
+        args:
+            bucket: S3 bucket name
+            key: S3 path to the object
+    '''
+    def __init__(self, bucket: str, key: str):
+        self.bucket = bucket
+        self.key = key
+        self.buffer = bytearray()
+        self.upload_id = None
+        self.parts = []
+        self.pending = None
+        self.size = 0
+
+    def write(self, data) -> None:
+        self.buffer += data
+        self.size += len(data)
+        if len(self.buffer) >= UPLOAD_PART_BYTES:
+            part, self.buffer = bytes(self.buffer), bytearray()
+            self._upload(part)
+
+    def _upload(self, part: bytes) -> None:
+        if self.upload_id is None:
+            self.upload_id = client().create_multipart_upload(Bucket=self.bucket, Key=self.key)["UploadId"]
+        number = len(self.parts) + (self.pending is not None) + 1
+        self._wait()
+        self.pending = executor().submit(self._upload_part, number, part)
+
+    def _upload_part(self, number: int, part: bytes) -> dict:
+        response = client().upload_part(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, PartNumber=number, Body=part)
+        return {"PartNumber": number, "ETag": response["ETag"]}
+
+    def _wait(self) -> None:
+        if self.pending is not None:
+            pending, self.pending = self.pending, None
+            self.parts.append(pending.result())
+
+    def close(self) -> None:
+        if self.upload_id is None:
+            client().put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self.buffer))
+            return
+        if self.buffer:
+            part, self.buffer = bytes(self.buffer), bytearray()
+            self._upload(part)
+        self._wait()
+        client().complete_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, MultipartUpload={"Parts": self.parts})
+
+    def abort(self) -> None:
+        '''
+            Discards the upload (its parts are otherwise kept, and billed, until a lifecycle rule removes them).
+        '''
+        if self.upload_id is None:
+            return
+        if self.pending is not None:
+            self.pending.cancel()
+            self.pending = None
+        client().abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+
+
+def hash_array(dataset: np.array, *salts: str) -> str:
+    '''
+        Content hash of an array (values, shape, and dtype) plus optional salts such as a serialized config.
+        
+        args:
+            dataset: np.array to hash
+            salts: additional strings that change the hash
+        returns:
+            hex SHA-256 digest
+    '''
+    digest = hashlib.sha256()
+    digest.update(str((dataset.shape, dataset.dtype.str)).encode("utf-8"))
+    digest.update(np.ascontiguousarray(dataset).data)
+    for salt in salts:
+        digest.update(salt.encode("utf-8"))
+    return digest.hexdigest()
+    
+
 def load_model_from_s3(bucket: str, key: str):
     '''
-        Downloads a serialized machine learning model from S3, deserializes it, and returns it.
+        Downloads a serialized machine learning model from S3 with one GET, deserializes it, and returns it.
+        Models of RANGE_THRESHOLD_BYTES or more are downloaded as parallel byte ranges into memory instead and
+        unpickled in place.
         
         args:
             bucket: S3 bucket name
@@ -33,9 +319,15 @@ def load_model_from_s3(bucket: str, key: str):
         returns:
             Scikit-learn model
     '''
+    body, head = open_object(bucket, key)
+    if use_ranges(head["size"]):
+        return load(open_buffer(RangedDownload(bucket, key, head, first=body).wait()))
     with tempfile.TemporaryFile() as fp:
-        boto3.client("s3").download_fileobj(Fileobj=fp, Bucket=bucket, Key=key)
+        shutil.copyfileobj(body, fp)
         fp.seek(0)
         model = load(fp)
         return model
-        
+
+
+async def load_model_from_s3_async(bucket: str, key: str):
+    return await to_thread(load_model_from_s3, bucket, key)
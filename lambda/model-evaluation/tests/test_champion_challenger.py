@@ -0,0 +1,116 @@
+import boto3
+import numpy as np
+import pytest
+from sklearn.linear_model import LinearRegression
+
+RNG = np.random.default_rng(0)
+
+TRAIN_FEATURES = RNG.uniform(0, 10, size=(200, 2))
+
+TEST_FEATURES = RNG.uniform(0, 10, size=(50, 2))
+
+TEST_LABELS = TEST_FEATURES @ np.array([2.0, -1.0]) + 1.0
+
+
+@pytest.fixture
+def image(stage):
+    return stage("model-evaluation")
+
+
+def fitted(noise: float, seed: int) -> LinearRegression:
+    '''
+        A model whose test error grows with the noise of its training labels.
+    '''
+    labels = TRAIN_FEATURES @ np.array([2.0, -1.0]) + 1.0 + np.random.default_rng(seed).normal(scale=noise, size=len(TRAIN_FEATURES))
+    return LinearRegression().fit(TRAIN_FEATURES, labels)
+
+
+def registered(image, bucket: str, versions: dict) -> tuple:
+    registry = image.registry.ModelRegistry(bucket)
+    models = {}
+    for version, noise in versions.items():
+        models[version] = fitted(noise, seed=len(models))
+        registry.register(models[version], version, {"run_id": version})
+    return registry, models
+
+
+def score_keys(registry, version: str) -> list:
+    listing = boto3.client("s3").list_objects_v2(Bucket=registry.bucket, Prefix=f"{registry.prefix}/scores/{version}/")
+    return [item["Key"] for item in listing.get("Contents", [])]
+
+
+def test_champion_scores_are_cached(image, aws, monkeypatch):
+    registry, models = registered(image, aws, {"champion": 5.0, "challenger": 0.1})
+    registry.promote("champion")
+    compare = image.champion_challenger.compare
+
+    first = compare(registry, "challenger", models["challenger"], TEST_FEATURES, TEST_LABELS)
+    assert (first["champion_version"], first["champion_cached"], first["promote"]) == ("champion", False, True)
+    assert score_keys(registry, "champion") == [f"{registry.prefix}/scores/champion/{first['test_set_sha256']}.npz"]
+
+    # A warm container reuses the scores in memory, a new one reads them from S3: the champion is not loaded again
+    monkeypatch.setattr(image.registry.ModelRegistry, "load", lambda self, version: pytest.fail(f"{version} was loaded"))
+    assert compare(registry, "challenger", models["challenger"], TEST_FEATURES, TEST_LABELS)["champion_cached"] is True
+    image.champion_challenger._CHAMPION_SCORES.clear()
+    again = compare(registry, "challenger", models["challenger"], TEST_FEATURES, TEST_LABELS)
+
+    assert again["champion_cached"] is True
+    assert again["champion"] == first["champion"]
+    assert again["challenger_win_rate"] == first["challenger_win_rate"]
+
+
+def test_changed_test_set_invalidates_cached_scores(image, aws):
+    registry, models = registered(image, aws, {"champion": 5.0, "challenger": 0.1})
+    registry.promote("champion")
+    compare = image.champion_challenger.compare
+
+    first = compare(registry, "challenger", models["challenger"], TEST_FEATURES, TEST_LABELS)
+    changed = compare(registry, "challenger", models["challenger"], TEST_FEATURES, TEST_LABELS + 1.0)
+
+    assert changed["test_set_sha256"] != first["test_set_sha256"]
+    assert changed["champion_cached"] is False
+    assert changed["champion"] != first["champion"]
+    assert len(score_keys(registry, "champion")) == 2
+
+
+def test_promote_compares_again_after_a_concurrent_promotion(image, aws):
+    registry, models = registered(image, aws, {"first": 5.0, "concurrent": 1.0, "challenger": 0.1})
+    registry.promote("first")
+    cc = image.champion_challenger
+    comparison = cc.compare(registry, "challenger", models["challenger"], TEST_FEATURES, TEST_LABELS)
+
+    # Another run promoted its model after this comparison; the challenger still beats it
+    registry.promote("concurrent", expected="first")
+    pointer = cc.promote(registry, comparison, models["challenger"], TEST_FEATURES, TEST_LABELS)
+
+    assert (pointer["version"], pointer["previous"]) == ("challenger", "concurrent")
+
+
+def test_promote_gives_up_against_a_better_concurrent_champion(image, aws):
+    registry, models = registered(image, aws, {"first": 5.0, "challenger": 1.0, "concurrent": 0.1})
+    registry.promote("first")
+    cc = image.champion_challenger
+    comparison = cc.compare(registry, "challenger", models["challenger"], TEST_FEATURES, TEST_LABELS)
+    assert comparison["promote"]
+
+    registry.promote("concurrent", expected="first")
+    assert cc.promote(registry, comparison, models["challenger"], TEST_FEATURES, TEST_LABELS) is None
+    assert registry.champion()["version"] == "concurrent"
+
+
+def test_promote_raises_when_the_champion_keeps_changing(image, aws, monkeypatch):
+    registry, models = registered(image, aws, {"first": 5.0, "challenger": 0.1})
+    registry.promote("first")
+    cc = image.champion_challenger
+    comparison = cc.compare(registry, "challenger", models["challenger"], TEST_FEATURES, TEST_LABELS)
+
+    attempts = []
+
+    def changed(self, version, expected=None):
+        attempts.append(expected)
+        raise image.registry.ChampionChanged("changed")
+
+    monkeypatch.setattr(image.registry.ModelRegistry, "promote", changed)
+    with pytest.raises(image.registry.ChampionChanged):
+        cc.promote(registry, comparison, models["challenger"], TEST_FEATURES, TEST_LABELS)
+    assert len(attempts) == cc.PROMOTION_ATTEMPTS
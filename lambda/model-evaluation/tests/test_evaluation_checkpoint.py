@@ -0,0 +1,37 @@
+import json
+import boto3
+
+STAGES = ["data-preparation", "feature-engineering", "model-training", "model-evaluation"]
+
+MARKER = "training-pipeline/checkpoints/2026-10-19/run-1/model-evaluation.json"
+
+
+def completed_at(bucket: str) -> int:
+    return json.loads(boto3.client("s3").get_object(Bucket=bucket, Key=MARKER)["Body"].read())["completed"]
+
+
+def test_evaluation_replays_while_model_unchanged(run_stage, aws):
+    results = [run_stage(name, "run-1") for name in STAGES]
+    marker = completed_at(aws)
+
+    assert run_stage("model-evaluation", "run-1") == results[-1]
+    assert completed_at(aws) == marker
+
+
+def test_evaluation_runs_again_for_a_changed_model_version(run_stage, stage, aws):
+    for name in STAGES:
+        run_stage(name, "run-1")
+    marker = completed_at(aws)
+
+    # The version is removed and registered again: its metadata (and the metrics evaluation recorded) changed
+    registry = stage("model-training").registry.ModelRegistry(aws)
+    model = registry.load("run-1")
+    for key in (registry.artifact_key("run-1"), registry.metadata_key("run-1")):
+        boto3.client("s3").delete_object(Bucket=aws, Key=key)
+    registry.register(model, "run-1", {"run_id": "run-1"})
+    assert registry.metadata("run-1")["metrics"] == {}
+
+    run_stage("model-evaluation", "run-1")
+    assert completed_at(aws) > marker
+    registry = stage("model-training").registry.ModelRegistry(aws)
+    assert set(registry.metadata("run-1")["metrics"]) == {"test_rmse", "test_mae"}
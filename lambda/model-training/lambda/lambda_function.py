@@ -1,49 +1,155 @@
-import uuid
-import s3fs
+import asyncio
 import json
-import numpy as np
-import pandas as pd
+from dataclasses import replace
 from sklearn.linear_model import LinearRegression
+from sklearn.pipeline import Pipeline
 
-from utils import read_data, save_model_to_s3
+from contracts import CONTRACTS, validate, enforce, enforce_same_rows
+from aio import to_thread
+from utils import write_json, hash_array, load_model_from_s3
+from handoff import DatasetHandoff
+from lineage import StageLineage
+from checkpoints import StageCheckpoint
+from retries import retryable
+from registry import ModelRegistry
+from partitioned import PartitionedDataset, dataset_root
 
 
+@retryable
 def lambda_handler(event, context):
     
+    # Reading variables passed in by the parent Step Function
+    run_parameters = json.loads(event['Input']['RunParameters'])
+    
+    handoff = DatasetHandoff(event['Input'], f"pr-{run_parameters['Environment']}-{run_parameters['Project']}-bucket")
+    checkpoint = StageCheckpoint("model-training", run_parameters, handoff)
+    if checkpoint.completed():
+        return checkpoint.result
+    with StageLineage("model-training", run_parameters, handoff, context) as lineage:
+        lineage.metrics.update(run(run_parameters, handoff))
+    return checkpoint.complete(handoff.output())
+
+
+def run(run_parameters: dict, handoff: DatasetHandoff) -> dict:
+    '''
+        Model training stage, shared by the stage Lambda and the fused pipeline.
+        
+        args:
+            run_parameters: run parameters created by the parent Step Function
+            handoff: DatasetHandoff the training datasets are read from
+        returns:
+            {"training_rows"}, recorded as lineage metrics
+    '''
+    
+    feature_pipeline, train_features, train_labels = read_training_data(run_parameters, handoff)
+    
+    # *********************************************
+    # Train model, seralize it, and write it to S3
+    #*********************************************
+    
+    regressor = LinearRegression().fit(train_features, train_labels) 
+    
+    # The transforms are serialized with the model so evaluation and inference score raw features
+    model = Pipeline([("features", feature_pipeline), ("regressor", regressor)])
+    
+    publish_model(model, run_parameters, handoff, {
+        "training_rows": int(train_features.shape[0]),
+        "training_since": run_parameters.get('TrainingSince'),
+        "training_features_sha256": hash_array(train_features),
+        "training_labels_sha256": hash_array(train_labels)
+    })
+    return {"training_rows": int(train_features.shape[0])}
+
+
+def read_training_data(run_parameters: dict, handoff: DatasetHandoff) -> tuple:
+    '''
+        Reads and validates the engineered training features and labels (shared with distributed training).
+        
+        args:
+            run_parameters: run parameters created by the parent Step Function
+            handoff: DatasetHandoff the training datasets are read from
+        returns:
+            (fitted feature pipeline, training features, training labels)
+    '''
+    
     # *********************************************
     # Read training data from S3
     #*********************************************
     
-    # Reading variables passed in by the parent Step Function
-    run_id = json.loads(event['Input']['RunParameters'])['RunId']
-    run_date = json.loads(event['Input']['RunParameters'])['RunDate']
-    environment = json.loads(event['Input']['RunParameters'])['Environment']
-    project = json.loads(event['Input']['RunParameters'])['Project']
+    run_id = run_parameters['RunId']
+    run_date = run_parameters['RunDate']
+    environment = run_parameters['Environment']
+    project = run_parameters['Project']
     
     project_bucket = f"pr-{environment}-{project}-bucket"
     prefix = f"training-pipeline/data-preparation/{run_date}/{run_id}"
+    features_prefix = f"training-pipeline/feature-engineering/{run_date}/{run_id}"
     
-    train_features = read_data(project_bucket, f"{prefix}/train-features.csv")
+    labels_contract = CONTRACTS["train-labels"]
     
-    assert train_features.shape == (7, 1)
-    assert train_features.dtype == "int64"
-
-    train_labels = read_data(project_bucket, f"{prefix}/train-labels.csv").flatten()
+    async def load_feature_pipeline() -> tuple:
+        # Fitted feature engineering transforms for this run; the features contract depends on their output width
+        feature_pipeline = await to_thread(handoff.artifact, "feature-pipeline", lambda: load_model_from_s3(project_bucket, f"{features_prefix}/feature-pipeline.pkl"))
+        return feature_pipeline, replace(CONTRACTS["engineered-features"], n_columns=feature_pipeline.n_features_out_, min_rows=2)
     
-    assert train_labels.shape == (7,)
-    assert train_labels.dtype == "int64"
+    async def read_features() -> tuple:
+        feature_pipeline, features_contract = await load_feature_pipeline()
+        train_features, features_report = await handoff.read_async("engineered-train-features", f"{features_prefix}/train-features.csv", features_contract)
+        return feature_pipeline, features_contract, train_features, features_report
     
-    # *********************************************
-    # Train model, seralize it, and write it to S3
-    #*********************************************
+    async def read_inputs() -> tuple:
+        # The labels download while the feature pipeline loads and the features download
+        return await asyncio.gather(read_features(), handoff.read_async("train-labels", f"{prefix}/train-labels.csv", labels_contract))
     
-    model = LinearRegression().fit(train_features, train_labels) 
+    async def read_incremental_inputs(since: str) -> tuple:
+        # The training rows of every run since a date, from the partitioned training dataset (only the partitions
+        # of those dates are downloaded), while the feature pipeline loads
+        return await asyncio.gather(
+            load_feature_pipeline(),
+            to_thread(PartitionedDataset(project_bucket, dataset_root("train")).read, None, [("date", ">=", since)])
+        )
     
-    save_model_to_s3(model, project_bucket, "models/LinearRegression_Model.pkl")
+    since = run_parameters.get('TrainingSince')
+    if since:
+        # Incremental training: the model trains on every run's training rows since TrainingSince, transformed
+        # with this run's feature pipeline
+        (feature_pipeline, features_contract), rows = asyncio.run(read_incremental_inputs(since))
+        train_features, train_labels = feature_pipeline.transform(rows[:, :-1]), rows[:, -1]
+        features_report, labels_report = validate(features_contract, train_features), validate(labels_contract, train_labels)
+    else:
+        (feature_pipeline, features_contract, train_features, features_report), (train_labels, labels_report) = asyncio.run(read_inputs())
     
-    # *********************************************
-    # TODO: Log microservice metadata
-    # MODEL METADATA GOES INTO SAGEMAKER MODEL REGISTRY
-    #*********************************************
+    validation_prefix = f"training-pipeline/model-training/{run_date}/{run_id}/validation"
+    write_json(features_report, project_bucket, f"{validation_prefix}/train-features.json")
+    write_json(labels_report, project_bucket, f"{validation_prefix}/train-labels.json")
     
+    enforce(features_report, features_contract)
+    enforce(labels_report, labels_contract)
+    enforce_same_rows(features_report, labels_report)
     
+    return feature_pipeline, train_features, train_labels
+
+
+def publish_model(model: Pipeline, run_parameters: dict, handoff: DatasetHandoff, lineage: dict) -> dict:
+    '''
+        Registers the trained model as a new version (the run ID) in the model registry and hands it to the
+        evaluation stage of a fused run.
+        
+        args:
+            model: trained Pipeline (feature transforms and regressor)
+            run_parameters: run parameters created by the parent Step Function
+            handoff: DatasetHandoff of the run
+            lineage: training data lineage recorded with the model version
+        returns:
+            metadata of the registered version
+    '''
+    project_bucket = f"pr-{run_parameters['Environment']}-{run_parameters['Project']}-bucket"
+    metadata = ModelRegistry(project_bucket).register(model, run_parameters['RunId'], {
+        "run_id": run_parameters['RunId'],
+        "run_date": run_parameters['RunDate'],
+        "feature_pipeline": f"training-pipeline/feature-engineering/{run_parameters['RunDate']}/{run_parameters['RunId']}/feature-pipeline.pkl",
+        "reference_sketches": f"training-pipeline/data-preparation/{run_parameters['RunDate']}/{run_parameters['RunId']}/sketches.json",
+        **lineage
+    })
+    handoff.artifacts["model"] = model
+    return metadata
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+from sklearn.linear_model import LinearRegression
+
+
+@pytest.fixture
+def distributed(stage):
+    return stage("model-training").distributed
+
+
+def dataset(rows: int = 5000, columns: int = 6, targets: int = None, seed: int = 0) -> tuple:
+    rng = np.random.default_rng(seed)
+    features = rng.normal(size=(rows, columns)) * rng.uniform(0.1, 100.0, size=columns)
+    weights = rng.normal(size=(columns,) if targets is None else (columns, targets))
+    labels = features @ weights + 3.0 + rng.normal(scale=0.1, size=(rows,) if targets is None else (rows, targets))
+    return features, labels
+
+
+def assert_same_fit(regressor, reference, rtol: float = 1e-9) -> None:
+    assert regressor.coef_.shape == reference.coef_.shape
+    np.testing.assert_allclose(regressor.coef_, reference.coef_, rtol=rtol, atol=1e-9)
+    np.testing.assert_allclose(regressor.intercept_, reference.intercept_, rtol=rtol, atol=1e-9)
+
+
+def test_local_training_matches_a_single_fit(distributed):
+    features, labels = dataset()
+    regressor = distributed.train_local(features, labels, 3)
+
+    assert_same_fit(regressor, LinearRegression().fit(features, labels))
+    np.testing.assert_allclose(regressor.predict(features[:10]), LinearRegression().fit(features, labels).predict(features[:10]))
+
+
+@pytest.mark.parametrize("targets", [None, 1, 2])
+def test_uneven_shards_reduce_to_a_single_fit(distributed, monkeypatch, targets):
+    # Several factor blocks per shard, an empty shard and shards with fewer rows than columns
+    monkeypatch.setattr(distributed, "FACTOR_BLOCK_ROWS", 256)
+    features, labels = dataset(targets=targets, seed=1)
+    edges = [0, 0, 3, 700, 701, 2900, len(features)]
+    statistics = [distributed.shard_statistics(features[start:stop], labels[start:stop]) for start, stop in zip(edges[:-1], edges[1:])]
+
+    reduced = distributed.tree_reduce(statistics)
+    assert reduced["rows"] == len(features)
+    assert_same_fit(distributed.solve(reduced), LinearRegression().fit(features, labels))
+
+
+def test_offset_features_match_a_single_fit(distributed):
+    features, labels = dataset(seed=2)
+    # Features far from zero: the condition number of [1 X] is around 1e8, so the normal equations (around
+    # 1e16) would lose every digit of the coefficients
+    features = features / features.std(axis=0) + 1e4
+    labels = (features - 1e4) @ np.arange(1.0, 7.0) + np.random.default_rng(3).normal(scale=0.1, size=len(features))
+    statistics = [distributed.shard_statistics(features[start:stop], labels[start:stop]) for start, stop in distributed.shard_bounds(len(features), 4)]
+
+    assert_same_fit(distributed.solve(distributed.tree_reduce(statistics)), LinearRegression().fit(features, labels), rtol=1e-6)
+
+
+def test_shard_bounds(distributed):
+    assert distributed.shard_bounds(10, 3) == [(0, 3), (3, 6), (6, 10)]
+    assert distributed.shard_bounds(2, 4) == [(0, 1), (1, 2)]
+    with pytest.raises(ValueError):
+        distributed.tree_reduce([])
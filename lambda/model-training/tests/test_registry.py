@@ -0,0 +1,109 @@
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+import numpy as np
+import pytest
+from sklearn.linear_model import LinearRegression
+
+
+def fitted(offset: float = 0.0) -> LinearRegression:
+    X = np.arange(20, dtype=float).reshape(10, 2)
+    return LinearRegression().fit(X, X.sum(axis=1) + offset)
+
+
+@pytest.fixture
+def registry(stage, aws):
+    return stage("model-training").registry
+
+
+def test_register_and_load(registry, aws):
+    models = registry.ModelRegistry(aws)
+    metadata = models.register(fitted(), "run-1", {"run_id": "run-1"})
+
+    assert metadata["artifact"] == models.artifact_key("run-1")
+    assert models.index()["run-1"]["sha256"] == metadata["sha256"]
+    # A registry in a fresh container downloads the artifact and verifies its checksum
+    registry._MODELS.clear()
+    registry._DOCUMENTS.clear()
+    np.testing.assert_allclose(models.load("run-1").coef_, fitted().coef_)
+
+
+
+def test_load_in_ranges_verifies_checksum(stage, aws, monkeypatch):
+    image = stage("model-training")
+    models = image.registry.ModelRegistry(aws)
+    metadata = models.register(fitted(), "run-1", {"run_id": "run-1"})
+    # Several ranges even for a small artifact, the first one read from the GET that sized the object
+    monkeypatch.setattr(image.ranged, "RANGE_PART_BYTES", 128)
+
+    image.registry._MODELS.clear()
+    np.testing.assert_allclose(models.load("run-1").coef_, fitted().coef_)
+
+    image.registry._MODELS.clear()
+    boto3.client("s3").put_object(Bucket=aws, Key=metadata["artifact"], Body=b"tampered")
+    with pytest.raises(ValueError, match="does not match its registered checksum"):
+        models.load("run-1")
+
+def test_register_same_artifact_keeps_metrics(registry, aws):
+    models = registry.ModelRegistry(aws)
+    models.register(fitted(), "run-1", {"run_id": "run-1"})
+    models.record_metrics("run-1", {"test_rmse": 1.5})
+
+    # A retried training stage registers the same model again
+    metadata = models.register(fitted(), "run-1", {"run_id": "run-1"})
+    assert metadata["metrics"] == {"test_rmse": 1.5}
+    assert models.index()["run-1"]["metrics"] == {"test_rmse": 1.5}
+
+
+def test_register_different_artifact_is_refused(registry, aws):
+    models = registry.ModelRegistry(aws)
+    original = models.register(fitted(), "run-1", {"run_id": "run-1"})
+    models.promote("run-1")
+
+    with pytest.raises(registry.VersionExists):
+        models.register(fitted(offset=10.0), "run-1", {"run_id": "run-1"})
+
+    registry._MODELS.clear()
+    assert models.metadata("run-1")["sha256"] == original["sha256"]
+    assert models.champion()["sha256"] == original["sha256"]
+    np.testing.assert_allclose(models.load("run-1").intercept_, fitted().intercept_)
+
+
+def test_promote_only_over_the_expected_champion(registry, aws):
+    models = registry.ModelRegistry(aws)
+    for version in ("run-1", "run-2", "run-3"):
+        models.register(fitted(), version, {"run_id": version})
+
+    assert models.promote("run-1", expected=None)["previous"] is None
+    # run-3 was compared before run-2 became the champion
+    models.promote("run-2", expected="run-1")
+    with pytest.raises(registry.ChampionChanged):
+        models.promote("run-3", expected="run-1")
+
+    champion = models.champion()
+    assert (champion["version"], champion["previous"]) == ("run-2", "run-1")
+
+
+def test_concurrent_registrations_keep_every_index_entry(registry, aws):
+    versions = [f"run-{number}" for number in range(8)]
+
+    def register(version: str) -> None:
+        registry.ModelRegistry(aws).register(fitted(), version, {"run_id": version})
+
+    with ThreadPoolExecutor(max_workers=len(versions)) as executor:
+        list(executor.map(register, versions))
+
+    registry._DOCUMENTS.clear()
+    assert set(registry.ModelRegistry(aws).index()) == set(versions)
+
+
+def test_update_raises_after_repeated_conflicts(registry, aws, monkeypatch):
+    models = registry.ModelRegistry(aws)
+    models.register(fitted(), "run-1", {"run_id": "run-1"})
+    monkeypatch.setattr(registry.time, "sleep", lambda seconds: None)
+
+    def conflict(key, document, **condition):
+        raise registry.RegistryConflict(key)
+
+    monkeypatch.setattr(models, "_write", conflict)
+    with pytest.raises(registry.RegistryConflict):
+        models.promote("run-1")